@@ -0,0 +1,233 @@
+"""
+Performance benchmarks: map loading, turns, routing, AI and wars on grid
+maps of 10^2 to 10^5 towns built with a fixed seed.
+
+    python benchmarks/bench.py --sizes 100 1000 --out bench.json
+    python benchmarks/bench.py --save-baseline              # stores benchmarks/baseline.json
+    python benchmarks/bench.py --compare benchmarks/baseline.json
+
+Results (seconds and peak traced memory per operation and size) are written
+as JSON; with --compare, operations slower or bigger than the baseline by
+more than --tolerance are reported and the exit code is 1.
+"""
+from typing import *
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ndrangheta.graph import Simulator
+from ndrangheta.read_dot import load_graph
+
+HERE     = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(HERE, "baseline.json")
+SIZES    = [100, 1_000, 10_000, 100_000]
+
+# =========================================================== #
+
+def write_grid_map(n: int, fpath: str, seed: int = 0, towns_per_family: int = 50):
+    """
+    Writes a DOT map of `n` towns on a square grid, split in vertical
+    stripes of about `towns_per_family` towns, one family per stripe.
+    """
+    rnd   = random.Random(seed)
+    side  = math.ceil(math.sqrt(n))
+    width = max(1, towns_per_family // side) # columns per family
+
+    with open(fpath, "w") as f:
+        f.write("graph G {\n")
+        for i in range(n):
+            x, y = i % side, i // side
+            if x + 1 < side and i + 1 < n:
+                f.write(f"  {i} -- {i+1}\n")
+            if i + side < n:
+                f.write(f"  {i} -- {i+side}\n")
+
+        for i in range(n):
+            x, y = i % side, i // side
+            family  = x // width
+            capital = y == 0 and x % width == 0
+            f.write(
+                f"  {i} [family={family}, pop={rnd.randint(1, 100)}, "
+                f"hold={rnd.uniform(0.5, 1):.2f}, drugs={rnd.choice([0, 0, 1, 5, 50])}, "
+                f"soldiers={rnd.randint(0, 50)}, leader={rnd.randint(1, 5)}"
+                + (", capital=t" if capital else "") + "]\n"
+            )
+        f.write("}\n")
+
+# =========================================================== #
+
+def measure(setup: Callable[[], Callable], memory: bool) -> Dict[str, float]:
+    """
+    Times the operation returned by setup(); if `memory`, sets it up
+    afresh and runs it again under tracemalloc, so that both runs start
+    from the same state (operations change the world they run on).
+    """
+    fn = setup()
+    start = time.perf_counter()
+    fn()
+    out = {"seconds": time.perf_counter() - start}
+
+    if memory:
+        fn = setup()
+        tracemalloc.start()
+        fn()
+        out["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return out
+
+
+def bench_size(n: int, seed: int, options: Dict, memory: bool, repeat: int = 20) -> Dict[str, Dict]:
+    results = dict()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fpath = os.path.join(tmp, f"grid-{n}.dot")
+        write_grid_map(n, fpath, seed)
+
+        results["load_graph"] = measure(lambda: lambda: load_graph(fpath), memory)
+
+        def game() -> Simulator:
+            world, graph = load_graph(fpath, seed=seed)
+            return Simulator(world, graph, player_id=None, seed=seed, **options)
+
+        def turn():
+            sim = game()
+            return sim.advance_time
+
+        results["advance_time"] = measure(turn, memory)
+
+        # Routing between random pairs of towns of the same family
+        sim = game()
+        world, graph = sim.world, sim.router.graph
+        rnd = random.Random(seed)
+        families = sorted(world.family_towns)
+        pairs = list()
+        for _ in range(repeat):
+            towns = sorted(world.family_towns[rnd.choice(families)])
+            pairs.append((rnd.choice(towns), rnd.choice(towns)))
+
+        def routes():
+            router = game().router
+            def route():
+                for a, b in pairs:
+                    router.automatic_path(a, b, router.safest_path_heuristic)
+            return route
+
+        results["automatic_path"] = measure(routes, memory)
+
+        biggest = max(families, key=lambda f: len(world.family_towns[f]))
+
+        def shipments():
+            ai = game().ai
+            return lambda: ai.decide_shipments(biggest)
+
+        results["decide_shipments"] = measure(shipments, memory)
+
+        # Battles between neighbouring towns of different families, capitals
+        # included; the defender's hold is lowered so that war is allowed
+        edges = [(a, b) for a, b in sorted(graph.edges())
+                 if a != b and world.Town(a).family.id != world.Town(b).family.id]
+        random.Random(seed).shuffle(edges)
+
+        def wars():
+            sim = game()
+            world, todo = sim.world, iter(edges)
+            def war():
+                for _ in range(repeat):
+                    for a, b in todo:
+                        ta, tb = world.Town(a), world.Town(b)
+                        if ta.family.id != tb.family.id and ta.family.id in world.families:
+                            tb.hold = 0.5
+                            sim.declare_war(ta.family.id, a, b)
+                            break
+            return war
+
+        results["declare_war"] = measure(wars, memory)
+
+    return results
+
+# =========================================================== #
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    regressions = list()
+    for size, ops in results["results"].items():
+        for op, new in ops.items():
+            old = baseline["results"].get(size, {}).get(op)
+            if old is None:
+                continue
+            for metric in ("seconds", "peak_bytes"):
+                if metric in new and metric in old and old[metric] > 0:
+                    ratio = new[metric] / old[metric]
+                    if ratio > 1 + tolerance:
+                        regressions.append(f"{op}[{size}] {metric}: {old[metric]:.4g} -> {new[metric]:.4g} (x{ratio:.2f})")
+    return regressions
+
+
+def print_table(results: Dict):
+    print(f"{'size':>8} {'operation':<18} {'seconds':>10} {'peak MB':>10}")
+    for size, ops in results["results"].items():
+        for op, r in ops.items():
+            peak = f"{r['peak_bytes'] / 2**20:.2f}" if "peak_bytes" in r else "-"
+            print(f"{size:>8} {op:<18} {r['seconds']:>10.4f} {peak:>10}")
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="ndrangheta performance benchmarks")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="JSON results file")
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc runs")
+    parser.add_argument("--compare", default=None, help="baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--save-baseline", action="store_true", help=f"also write {BASELINE}")
+    parser.add_argument("--vectorized", action="store_true")
+    parser.add_argument("--backend", default="networkx", choices=["networkx", "csr"])
+    parser.add_argument("--single-source", action="store_true")
+    args = parser.parse_args(argv)
+
+    options = {
+        "vectorized": args.vectorized,
+        "backend": args.backend,
+        "single_source": args.single_source,
+    }
+
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "seed": args.seed,
+            "options": options,
+        },
+        "results": {
+            str(n): bench_size(n, args.seed, options, not args.no_memory)
+            for n in args.sizes
+        },
+    }
+
+    print_table(results)
+
+    for fpath in [args.out] + ([BASELINE] if args.save_baseline else []):
+        if fpath is not None:
+            with open(fpath, "w") as f:
+                json.dump(results, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for r in regressions:
+            print("REGRESSION", r)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
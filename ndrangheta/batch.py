@@ -0,0 +1,174 @@
+"""
+Non-interactive runner: plays many seeded AI-only games of the same map
+in a process pool and writes one JSON summary per game.
+
+    moder-mafia-batch ndrangheta/example.dot --turns 100 --seeds 0-999 --out stats.jsonl
+    moder-mafia-batch ndrangheta/example.dot --turns 20 --frames frames/   # one picture per turn
+    moder-mafia-batch ndrangheta/example.dot --turns 20 --trace traces/    # time spent per phase
+    moder-mafia-batch ndrangheta/example.dot --turns 20 --metrics prom/    # Prometheus text files
+"""
+from typing import *
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+# =========================================================== #
+
+def run_game(fpath: str, turns: int, seed: int, options: Dict = None,
+             frames: str = None, frame_format: str = "png", trace: str = None,
+             metrics: str = None) -> Dict:
+    """
+    Plays `turns` turns of the map with every family driven by the AI.
+    With `frames`, a picture of the map after every turn is written to
+    frames/seed-<seed>/. With `trace`, the game is profiled: the summary
+    gets the time spent in each phase and a Chrome trace is written to
+    trace/seed-<seed>.json. With `metrics`, the metrics of the game are
+    written to metrics/seed-<seed>.prom after every turn.
+    """
+    from ndrangheta.graph import Simulator
+    from ndrangheta.read_dot import load_graph
+
+    options = dict(options or ())
+    if trace is not None:
+        options["profile"] = True
+    if metrics is not None:
+        os.makedirs(metrics, exist_ok=True)
+        options["metrics_path"] = os.path.join(metrics, f"seed-{seed}.prom")
+    start = time.perf_counter()
+
+    world, graph = load_graph(fpath, seed=seed)
+    sim = Simulator(world, graph, player_id=None, seed=seed, **options)
+
+    renderer = None
+    if frames is not None:
+        frames = os.path.join(frames, f"seed-{seed}")
+        os.makedirs(frames, exist_ok=True)
+        renderer = sim.renderer(map_path=fpath)
+
+    summary = {"map": fpath, "seed": seed, "turns": turns}
+    try:
+        if renderer is None:
+            sim.advance_time(turns=turns)
+        else:
+            for _ in range(turns):
+                sim.advance_time()
+                renderer.frame(os.path.join(frames, f"turn-{sim.turn:05d}.{frame_format}"))
+    except Exception as e:
+        summary["error"] = f"{type(e).__name__}: {e}"
+
+    summary |= {
+        "turns_played": sim.turn,
+        "families": {
+            f.id: {
+                "money": f.money,
+                "drugs": f.drugs,
+                "towns": len(world.family_towns.get(f.id, ())),
+            }
+            for f in world.families.values()
+        },
+        "kg_shipped":   sim.router.shipped_kgs,
+        "kg_delivered": sim.router.delivered_kgs,
+        "kg_captured":  sim.router.captured_kgs,
+        "wall_time":    time.perf_counter() - start,
+    }
+
+    if trace is not None:
+        os.makedirs(trace, exist_ok=True)
+        sim.profiler.save_chrome_trace(os.path.join(trace, f"seed-{seed}.json"))
+        summary["phases"] = {phase: stats for (phase,), stats in sim.profiler.summary().items()}
+    return summary
+
+
+def _run_game(job: Tuple) -> Dict:
+    return run_game(*job)
+
+
+def run_batch(fpath: str, turns: int, seeds: Iterable[int], jobs: int = None,
+              options: Dict = None, frames: str = None, frame_format: str = "png",
+              trace: str = None, metrics: str = None) -> Iterator[Dict]:
+    """
+    Yields the summary of each game, in the same order as `seeds`.
+    """
+    work = [(fpath, turns, seed, options, frames, frame_format, trace, metrics) for seed in seeds]
+
+    if frames is not None:
+        # Computes the layout once, before the workers look for it
+        from ndrangheta.read_dot import load_graph
+        from ndrangheta.render import load_layout, layout_cache_path
+
+        load_layout(load_graph(fpath)[1], layout_cache_path(fpath))
+
+    if jobs == 1:
+        yield from map(_run_game, work)
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        yield from pool.map(_run_game, work, chunksize=max(1, len(work) // (8 * (jobs or os.cpu_count() or 1))))
+
+# =========================================================== #
+
+def parse_seeds(values: List[str]) -> List[int]:
+    """
+    "3", "0-99" (inclusive range) or a mix of them.
+    """
+    seeds = list()
+    for v in values:
+        if "-" in v[1:]:
+            low, high = v.split("-", 1)
+            seeds.extend(range(int(low), int(high) + 1))
+        else:
+            seeds.append(int(v))
+    return seeds
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Play many AI-only games of a map.")
+    parser.add_argument("map", help="DOT map")
+    parser.add_argument("--turns", type=int, default=100)
+    parser.add_argument("--seeds", nargs="+", default=["0"], help="seeds or ranges, eg. 0-999")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--out", default="-", help="JSON lines output file (default: stdout)")
+    parser.add_argument("--vectorized", action="store_true", help="array-backed town state")
+    parser.add_argument("--backend", default="networkx", choices=["networkx", "csr"])
+    parser.add_argument("--single-source", action="store_true", help="one Dijkstra per family per turn")
+    parser.add_argument("--ai-workers", type=int, default=None,
+                        help="plan the AI families in parallel (0: one worker per core)")
+    parser.add_argument("--ai-executor", default="thread", choices=["thread", "process"])
+    parser.add_argument("--ai-risk", type=float, default=None,
+                        help="size AI requests on this quantile of the kgs delivered (default: expected loss)")
+    parser.add_argument("--ai-routes", type=int, default=1,
+                        help="split AI shipments among this many of the most reliable paths")
+    parser.add_argument("--frames", default=None, help="directory for a picture of the map after every turn")
+    parser.add_argument("--frame-format", default="png", choices=["png", "svg"])
+    parser.add_argument("--trace", default=None,
+                        help="directory for a Chrome trace of every game; adds time per phase to the output")
+    parser.add_argument("--metrics", default=None,
+                        help="directory for the Prometheus metrics of every game, rewritten every turn")
+    args = parser.parse_args(argv)
+
+    options = {
+        "vectorized": args.vectorized,
+        "backend": args.backend,
+        "single_source": args.single_source,
+        "ai_workers": args.ai_workers,
+        "ai_executor": args.ai_executor,
+        "ai_risk": args.ai_risk,
+        "ai_routes": args.ai_routes,
+    }
+
+    out = sys.stdout if args.out == "-" else open(args.out, "w")
+    try:
+        for summary in run_batch(args.map, args.turns, parse_seeds(args.seeds), args.jobs, options,
+                                 args.frames, args.frame_format, args.trace, args.metrics):
+            out.write(json.dumps(summary) + "\n")
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,17 @@
 import locale
 
-locale.setlocale(locale.LC_ALL, '')  # Use '' for auto, or force e.g. to 'en_US.UTF-8'
+# Money of a family when the map doesn't say, and of every family born
+# from the towns of a fallen capital
+FAMILY_MONEY = 1_000_000
+
+_locale_ready = False
+
+def setup_locale():
+    """
+    Formats numbers ({:n}) following the user's locale; done once, by the
+    first console() or play(), so that importing the package stays cheap.
+    """
+    global _locale_ready
+    if not _locale_ready:
+        locale.setlocale(locale.LC_ALL, '')  # Use '' for auto, or force e.g. to 'en_US.UTF-8'
+        _locale_ready = True
@@ -0,0 +1,151 @@
+from typing import *
+from heapq import heappush, heappop
+from itertools import count
+import numpy as np
+
+# =========================================================== #
+
+class ArrayPathTree:
+    """
+    Shortest-path tree over a CSRGraph; same interface as graph.PathTree.
+    """
+    def __init__(self, csr: "CSRGraph", source: int, pred: List[int], dist: List[float]):
+        self.csr    = csr
+        self.source = source
+        self.pred   = pred
+        self.dist   = dist
+
+    def path_to(self, end: "TownID") -> List["TownID"]:
+        import networkx as nx
+
+        i = self.csr.index[end]
+        if self.dist[i] is None:
+            raise nx.NetworkXNoPath(f"Node {end} not reachable from {self.csr.ids[self.source]}")
+
+        path = [i]
+        while path[-1] != self.source:
+            path.append(self.pred[path[-1]])
+        return [self.csr.ids[i] for i in reversed(path)]
+
+
+class CSRGraph:
+    """
+    Compressed sparse row view of the (static) town graph.
+
+    Neighbours of node i are indices[indptr[i]:indptr[i+1]], in the same
+    order as graph.adj, so that Dijkstra breaks ties like networkx does.
+    """
+    def __init__(self, graph):
+        self.ids: List["TownID"] = list(graph.nodes())
+        self.index: Dict["TownID", int] = {n: i for i, n in enumerate(self.ids)}
+
+        indptr, indices = [0], []
+        for n in self.ids:
+            indices.extend(self.index[m] for m in graph.adj[n])
+            indptr.append(len(indices))
+
+        self.indptr  = np.array(indptr,  dtype=np.int64)
+        self.indices = np.array(indices, dtype=np.int64)
+
+        # heapq wants Python ints, reading them one by one from numpy is slow
+        self._indptr  = indptr
+        self._indices = indices
+
+        # Sorted row * n + column of every edge, see adjacent_many()
+        self._edge_keys = None
+
+        # (world, state, towns or TownState rows in CSR order), see town_arrays()
+        self._lookup = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def neighbours(self, town_id: "TownID") -> np.ndarray:
+        i = self.index[town_id]
+        return self.indices[self.indptr[i]:self.indptr[i+1]]
+
+    def adjacent(self, t1: "TownID", t2: "TownID") -> bool:
+        if t1 not in self.index or t2 not in self.index:
+            return False
+        return bool((self.neighbours(t1) == self.index[t2]).any())
+
+    def adjacent_many(self, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        """
+        adjacent() of many pairs of node indices at once.
+        """
+        if self._edge_keys is None:
+            n = len(self)
+            keys = np.repeat(np.arange(n, dtype=np.int64), np.diff(self.indptr)) * n + self.indices
+            self._edge_keys = np.sort(keys)
+
+        if len(self._edge_keys) == 0:
+            return np.zeros(len(rows), dtype=bool)
+
+        keys = rows * len(self) + cols
+        pos = np.searchsorted(self._edge_keys, keys).clip(max=len(self._edge_keys) - 1)
+        return self._edge_keys[pos] == keys
+
+    # =========================================================== #
+
+    def town_arrays(self, world: "World", nodes: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Hold and owner (family id) of every node (or of the node indices
+        `nodes`), in CSR order. The towns (or their TownState rows) of the
+        nodes are looked up once per world.
+        """
+        state = world.state
+        if self._lookup is None or self._lookup[0] is not world or self._lookup[1] is not state:
+            if state is None:
+                lookup = [world.Town(n) for n in self.ids]
+            else:
+                lookup = np.fromiter((world.Town(n)._row for n in self.ids), dtype=np.int64, count=len(self))
+            self._lookup = (world, state, lookup)
+        lookup = self._lookup[2]
+
+        if state is None:
+            towns = lookup if nodes is None else [lookup[i] for i in nodes.tolist()]
+            hold   = np.fromiter((t.hold for t in towns), dtype=np.float64, count=len(towns))
+            family = np.fromiter((t.family.id for t in towns), dtype=np.int64, count=len(towns))
+            return hold, family
+
+        rows = lookup if nodes is None else lookup[nodes]
+        family_ids = np.array([f.id for f in state.families], dtype=np.int64)
+        return state.column("hold")[rows], family_ids[state.family[rows]]
+
+    def dijkstra(self, source: "TownID", weights: np.ndarray,
+                 target: "TownID" = None) -> ArrayPathTree:
+        """
+        Heap-based Dijkstra where entering node v costs weights[v].
+        """
+        w = weights.tolist()
+        indptr, indices = self._indptr, self._indices
+
+        n = len(self)
+        dist: List[float] = [None] * n
+        seen: List[float] = [None] * n
+        pred: List[int]   = [-1] * n
+
+        s = self.index[source]
+        t = self.index[target] if target is not None else -1
+        c = count()
+
+        seen[s] = 0
+        fringe = [(0, next(c), s)]
+        while fringe:
+            d, _, v = heappop(fringe)
+            if dist[v] is not None:
+                continue
+            dist[v] = d
+            if v == t:
+                break
+
+            for u in indices[indptr[v]:indptr[v+1]]:
+                if dist[u] is not None:
+                    continue
+                vu_dist = d + w[u]
+                if seen[u] is None or vu_dist < seen[u]:
+                    seen[u] = vu_dist
+                    heappush(fringe, (vu_dist, next(c), u))
+                    pred[u] = v
+
+        return ArrayPathTree(self, s, pred, dist)
@@ -0,0 +1,155 @@
+from typing import *
+import numpy as np
+
+# =========================================================== #
+
+TOWN_COLUMNS = {
+    "hold":       np.float64,
+    "drugs":      np.float64,
+    "population": np.int64,
+}
+
+LOCAL_COLUMNS = {
+    "money":            np.float64,
+    "tax":              np.float64,
+    "soldiers":         np.int64,
+    "leader":           np.float64,
+    "drug_cost_per_kg": np.float64,
+    "regulars":         np.int64,
+    "saltuary":         np.int64,
+    "regular_dose":     np.float64,
+    "salutar_dose":     np.float64,
+}
+
+
+class TownState:
+    """
+    Struct-of-arrays storage for the state of every town of a world.
+
+    Once a town is attached, its Town and LocalFamily objects become thin
+    views: their columns are read from and written to the arrays below, so
+    the daily drug market of the whole map can be run in a single pass.
+    """
+    def __init__(self, capacity: int = 64):
+        self.size = 0
+        self.columns: Dict[str, np.ndarray] = {
+            name: np.zeros(capacity, dtype=dtype)
+            for name, dtype in (TOWN_COLUMNS | LOCAL_COLUMNS).items()
+        }
+        self.ids    = np.zeros(capacity, dtype=np.int64)
+        self.family = np.zeros(capacity, dtype=np.int64) # index in self.families
+
+        self.families: List["Family"] = list()
+        self.family_index: Dict[int, int] = dict() # id(Family) -> index
+
+        self.world: "World" = None
+
+    @staticmethod
+    def from_towns(towns: Iterable["Town"]) -> "TownState":
+        towns = list(towns)
+        state = TownState(capacity=max(len(towns), 1))
+        for t in towns:
+            state.attach(t)
+        return state
+
+    # =========================================================== #
+
+    def __len__(self):
+        return self.size
+
+    def _grow(self):
+        capacity = 2 * len(self.ids)
+        for name, arr in self.columns.items():
+            self.columns[name] = np.resize(arr, capacity)
+        self.ids    = np.resize(self.ids, capacity)
+        self.family = np.resize(self.family, capacity)
+
+    def _index_of(self, family: "Family") -> int:
+        key = id(family)
+        if key not in self.family_index:
+            self.family_index[key] = len(self.families)
+            self.families.append(family)
+        return self.family_index[key]
+
+    def attach(self, town: "Town"):
+        """
+        Moves the columns of a town (and of its local family) into the arrays.
+        """
+        if self.size == len(self.ids):
+            self._grow()
+
+        row, lf = self.size, town.local_family
+        for name in TOWN_COLUMNS:
+            self.columns[name][row] = getattr(town, name)
+        for name in LOCAL_COLUMNS:
+            self.columns[name][row] = getattr(lf, name)
+
+        self.ids[row]    = town.id
+        self.family[row] = self._index_of(town.family)
+        self.size += 1
+
+        town._state, town._row = self, row
+        lf._state,   lf._row   = self, row
+
+    def set_family(self, row: int, family: "Family"):
+        self.family[row] = self._index_of(family)
+
+    def column(self, name: str) -> np.ndarray:
+        return self.columns[name][:self.size]
+
+    # =========================================================== #
+
+    def sell_daily_doses(self):
+        """
+        Vectorized LocalFamily.sell_daily_doses + Town.consume_drugs_single_day
+        over every non-police town.
+        """
+        n = self.size
+        is_police = np.array([f.id == -1 for f in self.families], dtype=bool)
+        active = ~is_police[self.family[:n]]
+
+        pop   = self.column("population")
+        hold  = self.column("hold")
+        drugs = self.column("drugs")
+
+        regular = self.column("regular_dose") * self.column("regulars") * (pop / 1000)
+        saltuar = (self.column("salutar_dose") * self.column("saltuary") * (pop / 1000)) / 30
+        daily   = regular + saltuar
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            remaining_days = drugs / daily
+
+        plenty = active & (remaining_days > 5)
+        few    = active & ~plenty & (remaining_days > 1)
+        none   = active & ~plenty & ~few
+
+        old_hold = hold.copy()
+        hold[few]  = np.clip(hold[few]  - 0.01, 0.5, 1)
+        hold[none] = np.clip(hold[none] - 0.05, 0.5, 1)
+
+        held = hold != old_hold
+        if self.world is not None and self.world.town_listeners:
+            for tid in self.ids[:n][held].tolist():
+                self.world.town_changed(tid)
+
+        sold = np.zeros(n)
+        sold[plenty] = daily[plenty]
+        sold[few]    = np.maximum(0.5 * daily[few], drugs[few])
+
+        self.column("money")[:] += self.column("drug_cost_per_kg") * sold
+        drugs -= sold
+
+        assert (drugs[active] >= 0).all(), "Drugs under 0 after daily drug use"
+
+        if self.world is not None and self.world.dirty is not None:
+            for tid in self.ids[:n][held].tolist():
+                self.world.touch(tid, "hold")
+            for tid in self.ids[:n][sold != 0].tolist():
+                self.world.touch(tid, "drugs")
+
+        # Town.variate_drugs also keeps the family-wide total in sync
+        per_family = np.bincount(self.family[:n], weights=sold, minlength=len(self.families))
+        for i in np.flatnonzero(per_family):
+            self.families[i].drugs -= per_family[i].item()
+
+        return sold
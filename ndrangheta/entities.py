@@ -8,7 +8,7 @@ import random
 
 KG = float
 
-@dataclass
+@dataclass(slots=True)
 class Request:
     kgs: float
     author: "TownID"
@@ -19,6 +19,8 @@ class Request:
 FamilyID = int
 
 class Family():
+    __slots__ = ("world", "name", "id", "capital", "money", "drugs")
+
     def __init__(self, id: FamilyID, name, attrs: Dict[str, Any], world: World):
         self.world = world
         
@@ -29,8 +31,6 @@ class Family():
         self.money: int = attrs["money"] #1_000_000
         self.drugs: int = 0
         
-        self.scheduled_operations: List[Tuple] = list()
-        
     
     def stats(self, turn=None):
         if turn is None:
@@ -41,7 +41,8 @@ class Family():
             
     def receive_tax(self, from_: "TownID", money):
         # TODO: from_ usabile in futuro per AI
-        print(f"Family {self.id} receives {money:n}€ from {from_}") 
+        if log.isEnabledFor(INFO):
+            log.info(f"Family {self.id} receives {money:n}€ from {from_}")
         self.money += money
 
         
@@ -70,15 +71,38 @@ class Family():
 
     
 class Police(Family):
+    __slots__ = ()
+
     def local_asks_for_drug(self, request: Request):
         raise DrugError("Asked drug to the police!")
 
     
 
+# Every() is never modified, all the local families share one
+TAXES = Every(turn=8, countdown=8)
+
 class LocalFamily:
+    money            = Column()
+    tax              = Column()
+    soldiers         = Column()
+    leader           = Column()
+    drug_cost_per_kg = Column()
+    regulars         = Column()
+    saltuary         = Column()
+    regular_dose     = Column()
+    salutar_dose     = Column()
+
+    __slots__ = ("parent", "town", "_state", "_row",
+                 "_money", "_tax", "_soldiers", "_leader", "_drug_cost_per_kg",
+                 "_regulars", "_saltuary", "_regular_dose", "_salutar_dose")
+
     def __init__(self, parent: Family, town: "Town", soldiers:int, leader: int):
         self.parent = parent
         self.town   = town
+
+        # Set by TownState.attach(); while None, columns live on the instance
+        self._state = None
+        self._row   = None
         
         self.regulars = 7 #7 regulars user every 1000 (once a day)
         self.saltuary = 14 #14 non-regular users every 1000 (once a month)
@@ -93,8 +117,8 @@ class LocalFamily:
         self.leader   = leader
         
         # self.sent_request = False
-        self.futures = [Schedule(self.pay_taxes, Every(turn=7, countdown=7))]
-        self.turn = 0
+        if town.world is not None:
+            town.world.scheduler.schedule(self, owner=self)
 
 
     def change_tax_rate(self, new_tax: float):
@@ -105,6 +129,13 @@ class LocalFamily:
         tax_money = int(self.tax * self.money)
         self.money -= tax_money
         self.parent.receive_tax(self.town.id, tax_money)
+        if self.town.world is not None:
+            self.town.world.metrics.taxes.inc(tax_money)
+
+    # A local family is its own tax task, as a Schedule(self.pay_taxes, TAXES)
+    # would be: one object less per town
+    when = TAXES
+    __call__ = pay_taxes
 
     # =========================================================== #
     
@@ -179,46 +210,25 @@ class LocalFamily:
     def is_drug_situation_critical(self, req: Request):
         return req.needed_before < 5
 
-    # =========================================================== #
-
-    def advance_turn(self):
-        self.turn += 1
-
-        # Scheduled activites executer
-        done = list()
-        for i, task in enumerate(self.futures):
-            if isinstance(task.when, Every):
-                if task.when.countdown == 0:
-                    print(task)
-                    task()
-                    task.when.countdown = task.when.turn
-                else:
-                    task.when.countdown -= 1
-                    
-            elif isinstance(task.when, In):
-                if task.when.turn == 0:
-                    print(task)
-                    task()
-                    done.append(i)
-                else:
-                    task.when.turn -= 1
-                    
-        # removes done tasks
-        for i in done[::-1]:
-            del self.futures[i]
-              
-        # self.update_family_about_local_drug_situation()
-
 # =========================================================== #
 
 TownID = int
 
 class Town():
-    TOWNS: Dict[TownID, "Town"] = dict()
+    hold       = Column(watched=True, exported=True)
+    drugs      = Column(exported=True)
+    population = Column(exported=True)
+
+    # Copied as node attributes of the graph by Simulator.update_graph
+    EXPORTED = ("name", "family", "is_capital", "hold", "drugs", "population")
+
+    __slots__ = ("world", "id", "family", "is_capital", "name", "local_family",
+                 "_state", "_row", "_hold", "_drugs", "_population")
     
     def __init__(self, town_id: TownID, family: Family, world=None, **kwargs):        
-        # assert(town_id not in Town.TOWNS)
         self.world = world
+        self._state = None
+        self._row   = None
         
         self.id:     TownID = town_id
         self.family: Family = family
@@ -226,13 +236,13 @@ class Town():
         
         self.name: str   = ""
         self.hold: float = (
-            random.uniform(0.5, 1)
+            self.rng.uniform(0.5, 1)
             if kwargs["hold"] is None
             else kwargs["hold"]
         )
         self.population = (
             kwargs["pop"] if kwargs["pop"] is not None
-            else random.randint(1, 100) * 1000
+            else self.rng.randint(1, 100) * 1000
         )
 
         self.local_family = LocalFamily(
@@ -242,19 +252,11 @@ class Town():
             leader=kwargs["leader"]
         )
         self.drugs = kwargs["drugs"] if self.family.id != -1 else 0 
-        
-        Town.TOWNS[self.id] = self
 
         
-    # @staticmethod
-    # def get(id: TownID):
-    #     return Town.TOWNS[id]
-
-    
-    # @staticmethod
-    # def get_of_family(id: FamilyID):
-    #     return [t for t in Town.TOWNS.values() if t.family.id == id]
-
+    @property
+    def rng(self):
+        return self.world.rng if self.world is not None else random
 
     def str_stats(self, am_hostile: bool) -> str:
         s = ""
@@ -272,23 +274,22 @@ class Town():
 
         return s
 
-    
-    # @staticmethod
-    # def print_cities(family_id, exclude_others=False):
-    #     for tid in Town.TOWNS:
-    #         t = Town.get(tid)
-
-    #         if exclude_others and t.family.id != family_id:
-    #             continue
-
-    #         print(t.str_stats(t.family.id != family_id))
-
             
     def change_ownership(self, new_family: Family):
+        if self.world is not None and self.id in self.world.towns:
+            self.world.move_town(self.id, self.family.id, new_family.id)
+            self.world.town_changed(self.id, owner=True)
+            self.world.metrics.towns_changed.inc()
+
         self.family = new_family
         self.local_family.parent = self.family
+        if self._state is not None:
+            self._state.set_family(self._row, new_family)
         if self.is_capital:
             self.is_capital = False
+        if self.world is not None:
+            self.world.touch(self.id, "family")
+            self.world.touch(self.id, "is_capital")
         #TODO: e se diventa una città indipendente (ie. Fam.FAM[id] non esiste)?
 
         
@@ -299,7 +300,7 @@ class Town():
         if loss_percent <= 5:
             hold = cap(self.hold * 1.12, 0.5, 1)
         elif loss_percent <= 10:
-            hold = cap(self.hold * random.uniform(0.95, 1.05), 0.5, 1)
+            hold = cap(self.hold * self.rng.uniform(0.95, 1.05), 0.5, 1)
         else:
             hold = cap(self.hold * (0.95 - (loss_percent-10)/100), 0.5, 1)
 
@@ -339,13 +340,13 @@ class Town():
             # hold = 1    => prob = 1
             # hold = 0.75 => prob = 0.5
             # hold = 0.50 => prob = 0
-            if not montecarlo(self.hold - (1 - self.hold)):
+            if not montecarlo(self.hold - (1 - self.hold), self.rng):
                 self.capture_shipment(ship)
                 return 0
 
             return 1.0
         
-        return random.uniform((1 + self.hold) / 2, 1)
+        return self.rng.uniform((1 + self.hold) / 2, 1)
  
         
     def receive_shipment(self, ship: "Shipment"):
@@ -381,4 +382,3 @@ class Town():
             pass # is police town
         else:
             self.consume_drugs_single_day() #TODO perchè qui?!
-            self.local_family.advance_turn()
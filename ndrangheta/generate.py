@@ -0,0 +1,256 @@
+"""
+Builds worlds directly from a topology, without going through a DOT file.
+
+    world, graph = generate_world(1_000_000, n_families=200, topology="grid", seed=1)
+
+Town attributes are drawn from distributions given as a constant, a
+(low, high) range (uniform) or a callable (numpy Generator, size) -> array.
+"""
+from typing import *
+import math
+import random
+from collections import deque
+
+import numpy as np
+import networkx as nx
+
+from ndrangheta.config import FAMILY_MONEY
+from ndrangheta.entities import Family, Town
+from ndrangheta.world import World
+from ndrangheta.read_dot import sanitize_metanode
+
+Distribution = Union[float, Tuple[float, float], Callable[[np.random.Generator, int], np.ndarray]]
+
+TOPOLOGIES = ("grid", "geometric", "scale_free")
+
+# =========================================================== #
+
+def draw(dist: Distribution, rng: np.random.Generator, size: int, integer=False) -> np.ndarray:
+    if callable(dist):
+        values = np.asarray(dist(rng, size))
+    elif isinstance(dist, tuple):
+        low, high = dist
+        values = rng.integers(low, high, size, endpoint=True) if integer else rng.uniform(low, high, size)
+    else:
+        values = np.full(size, dist)
+    return values.astype(np.int64 if integer else np.float64)
+
+
+def build_topology(topology: str, n: int, rng: np.random.Generator,
+                   degree: int = 6, m: int = 2) -> nx.Graph:
+    """
+    grid:       square grid, towns numbered row by row
+    geometric:  random geometric graph with about `degree` neighbours per
+                town, its components then linked by their nearest towns
+    scale_free: Barabási–Albert graph, `m` edges per new town
+    """
+    g = nx.Graph()
+    g.add_nodes_from(range(n))
+
+    if topology == "grid":
+        side = math.ceil(math.sqrt(n))
+        ids  = np.arange(n)
+        right = ids[(ids % side < side - 1) & (ids + 1 < n)]
+        down  = ids[ids + side < n]
+        g.add_edges_from(zip(right.tolist(), (right + 1).tolist()))
+        g.add_edges_from(zip(down.tolist(), (down + side).tolist()))
+
+    elif topology == "geometric":
+        radius = math.sqrt(degree / (math.pi * n))
+        pos = rng.uniform(0, 1, (n, 2))
+        u, v = geometric_edges(pos, radius)
+        g.add_edges_from(zip(u.tolist(), v.tolist()))
+        connect_components(g, pos, radius)
+
+    elif topology == "scale_free":
+        g = nx.barabasi_albert_graph(n, min(m, n - 1), seed=int(rng.integers(2**32)))
+
+    else:
+        raise ValueError(f"Unknown topology {topology}, expected one of {TOPOLOGIES}")
+
+    return g
+
+
+def geometric_edges(pos: np.ndarray, radius: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pairs of points closer than `radius`, bucketing points in square cells
+    of side `radius` so that only neighbouring cells are compared.
+    """
+    cells = int(math.ceil(1 / radius)) + 1
+    cx, cy = (pos // radius).astype(np.int64).T
+    key = cx * cells + cy
+
+    order  = np.argsort(key, kind="stable")
+    start  = np.searchsorted(key[order], np.arange(cells * cells))
+    count  = np.diff(np.append(start, len(key)))
+
+    us, vs = list(), list()
+    for dx, dy in [(0, 0), (1, -1), (1, 0), (1, 1), (0, 1)]:
+        ok = (cx + dx < cells) & (cy + dy >= 0) & (cy + dy < cells)
+        i  = np.flatnonzero(ok)
+        other = key[i] + dx * cells + dy
+
+        # every point i against every point of the neighbouring cell
+        n_other = count[other]
+        i_rep = np.repeat(i, n_other)
+        first = np.repeat(start[other] - np.cumsum(n_other) + n_other, n_other)
+        j = order[first + np.arange(n_other.sum())]
+
+        near = ((pos[i_rep] - pos[j]) ** 2).sum(axis=1) < radius ** 2
+        if (dx, dy) == (0, 0):
+            near &= i_rep < j
+        us.append(i_rep[near])
+        vs.append(j[near])
+
+    return np.concatenate(us), np.concatenate(vs)
+
+
+def connect_components(g: nx.Graph, pos: np.ndarray, radius: float):
+    """
+    Adds edges until `g` is connected: in each round, every group of
+    components but the largest is linked to the nearest town outside it
+    (searched in square cells of side `radius`, ring by ring).
+    """
+    components = sorted(nx.connected_components(g), key=lambda c: (-len(c), min(c)))
+    if len(components) <= 1:
+        return
+
+    label = np.empty(len(pos), dtype=np.int64)
+    for i, c in enumerate(components):
+        label[list(c)] = i
+    label = label.tolist()
+    members = {i: sorted(c) for i, c in enumerate(components)}
+    parent  = list(range(len(components)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    cells = int(math.ceil(1 / radius)) + 1
+    cx, cy = (pos // radius).astype(np.int64).T
+    key   = cx * cells + cy
+    order = np.argsort(key, kind="stable")
+    start = np.searchsorted(key[order], np.arange(cells * cells + 1)).tolist()
+
+    def ring(x: int, y: int, k: int) -> Iterator[int]:
+        for i in range(max(x - k, 0), min(x + k, cells - 1) + 1):
+            for j in range(max(y - k, 0), min(y + k, cells - 1) + 1):
+                if max(abs(i - x), abs(j - y)) == k:
+                    yield from order[start[i * cells + j]:start[i * cells + j + 1]].tolist()
+
+    def nearest_outside(group: int) -> Tuple[float, int, int]:
+        best = (math.inf, -1, -1)
+        for u in members[group]:
+            x, y = int(cx[u]), int(cy[u])
+            k = 0
+            # Points k rings away are at least (k - 1) * radius away
+            while k < cells and (k - 1) * radius < best[0]:
+                for v in ring(x, y, k):
+                    if find(label[v]) != group:
+                        best = min(best, (math.dist(pos[u], pos[v]), u, v))
+                k += 1
+        return best
+
+    while len(members) > 1:
+        largest = max(members, key=lambda i: (len(members[i]), -i))
+        links = [nearest_outside(i) for i in sorted(members) if i != largest]
+        for _, u, v in links:
+            a, b = find(label[u]), find(label[v])
+            g.add_edge(u, v)
+            if a != b:
+                if len(members[a]) < len(members[b]):
+                    a, b = b, a
+                parent[b] = a
+                members[a] += members.pop(b)
+
+
+def place_capitals(capitals: Union[str, List[int]], n: int, n_families: int,
+                   rng: np.random.Generator) -> List[int]:
+    """
+    "spread": evenly spaced town ids; "random": random towns; or explicit ids.
+    """
+    if capitals == "spread":
+        return [int(i * n / n_families) for i in range(n_families)]
+    if capitals == "random":
+        return rng.choice(n, size=n_families, replace=False).tolist()
+    return list(capitals)
+
+
+def assign_territories(g: nx.Graph, capitals: List[int]) -> np.ndarray:
+    """
+    Each town goes to the family whose capital is the closest (multi-source
+    BFS); towns unreachable from every capital (only in a disconnected
+    graph) are dealt round-robin.
+    """
+    family = np.full(g.number_of_nodes(), -1, dtype=np.int64)
+    queue  = deque()
+    for fid, c in enumerate(capitals):
+        family[c] = fid
+        queue.append(c)
+
+    adj = g.adj
+    while queue:
+        t = queue.popleft()
+        for n in adj[t]:
+            if family[n] == -1:
+                family[n] = family[t]
+                queue.append(n)
+
+    orphans = np.flatnonzero(family == -1)
+    family[orphans] = np.arange(len(orphans)) % len(capitals)
+    return family
+
+# =========================================================== #
+
+def generate_world(n_towns: int, n_families: int = 2, topology: str = "grid",
+                   capitals: Union[str, List[int]] = "spread", seed: int = None,
+                   pop: Distribution = (1, 100),
+                   hold: Distribution = (0.5, 1.0),
+                   drugs: Distribution = 0.0,
+                   soldiers: Distribution = (0, 50),
+                   leader: Distribution = 1,
+                   money: int = FAMILY_MONEY,
+                   vectorized: bool = False,
+                   **topology_options) -> Tuple[World, nx.Graph]:
+    """
+    Returns (world, graph) like read_dot.load_graph. `pop` is in thousands
+    of inhabitants, as in DOT maps; families are numbered 0..n_families-1.
+    """
+    rng = np.random.default_rng(seed)
+
+    g = build_topology(topology, n_towns, rng, **topology_options)
+    capitals = place_capitals(capitals, n_towns, n_families, rng)
+    family   = assign_territories(g, capitals)
+
+    pops      = draw(pop, rng, n_towns, integer=True) * 1000
+    holds     = draw(hold, rng, n_towns)
+    drugs_    = draw(drugs, rng, n_towns)
+    soldiers_ = draw(soldiers, rng, n_towns, integer=True)
+    leaders   = draw(leader, rng, n_towns, integer=True)
+
+    w = World(rng=None if seed is None else random.Random(seed))
+    families = [
+        Family(fid, str(fid), sanitize_metanode({"family": fid, "money": money}), world=w)
+        for fid in range(n_families)
+    ]
+    for f, c in zip(families, capitals):
+        f.capital = c
+        w.add_family(f)
+
+    is_capital = np.zeros(n_towns, dtype=bool)
+    is_capital[capitals] = True
+
+    for tid, fid, p, h, d, s, l, c in zip(range(n_towns), family.tolist(), pops.tolist(),
+                                          holds.tolist(), drugs_.tolist(), soldiers_.tolist(),
+                                          leaders.tolist(), is_capital.tolist()):
+        w.add_town(Town(tid, families[fid], world=w,
+                        hold=h, pop=p, drugs=d, soldiers=s, leader=l, capital=c))
+
+    nx.set_node_attributes(g, dict(zip(range(n_towns), family.tolist())), "family")
+
+    if vectorized:
+        w.attach_state()
+
+    return (w, g)
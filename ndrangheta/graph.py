@@ -1,16 +1,24 @@
+import os
+import json
+import math
+import time
+import itertools
 import random
 import logging
+import functools
+import threading
+from dataclasses import dataclass, field
+import numpy as np
 import networkx as nx
-import matplotlib.pyplot as plt
 
-from networkx.drawing.nx_pydot import read_dot
 # from networkx.algorithms.shortest_paths.generic import shortest_path
 
 from ndrangheta.config import *
 from ndrangheta.world import World
+from ndrangheta.ledger import DELIVERED, CAPTURED
+from ndrangheta.profiler import Profiler, profiled
 from ndrangheta.entities import *
-from ndrangheta.utils import montecarlo, show, Schedule
-from ndrangheta.read_dot import sanitize_metanode
+from ndrangheta.utils import montecarlo, shuffle, Schedule, In, log, console, INFO, DEBUG
 
 from typing import *
 
@@ -18,7 +26,13 @@ from typing import *
 
 class ShipmentError(Exception): pass
 
+# Survival probability used in place of 0 (a town with hold 1 captures every
+# hostile shipment) by Routing.most_reliable_path_heuristic, to keep its cost finite
+RELIABILITY_FLOOR = 1e-300
+
 class Shipment:
+    __slots__ = ("kgs", "initial_kgs", "price_per_kg", "from_family", "ledger", "id")
+
     def __init__(self, kgs: float, retail_price_kg: float, author: FamilyID):
         self.kgs = kgs
         self.initial_kgs = kgs
@@ -30,7 +44,9 @@ class Shipment:
         self.price_per_kg = retail_price_kg
         self.from_family = author
 
-        self.loss_history: List[Tuple[TownID, float]] = list()
+        # Set once sent, see ShipmentLedger.open()
+        self.ledger: "ShipmentLedger" = None
+        self.id: int = None
         
     def loss_absolute(self) -> float:
         return round(self.initial_kgs - self.kgs, 2)
@@ -38,16 +54,238 @@ class Shipment:
     def loss_percent(self) -> float:
         return round(100 * (1 - self.kgs / self.initial_kgs), 2)
 
-    def displace(self, loss_multiplier: float, town: TownID):
+    def displace(self, loss_multiplier: float, town: Town):
+        before = self.kgs
         self.kgs *= loss_multiplier
-        self.loss_history.append((town, loss_multiplier))
+        if self.ledger is not None:
+            self.ledger.hop(self.id, town.id, loss_multiplier, before - self.kgs)
+
+    @property
+    def loss_history(self) -> List[Tuple[Town, float]]:
+        """
+        (town, multiplier) of every hop so far, read from the ledger.
+        """
+        if self.ledger is None:
+            return []
+        w = self.ledger.world
+        return [(w.Town(tid), m) for tid, m in self.ledger.history(self.id)]
+
+
+class RouteCache:
+    """
+    Paths already computed by Routing.automatic_path, keyed by
+    (family, start, end, heuristic).
+
+    An entry is dropped as soon as hold or owner of one of the towns on its
+    path changes. Changes in towns off the path are not tracked: a cached
+    route stays valid, but may no longer be the cheapest one.
+
+    Shared by the threads planning AI turns (see Simulator.plan_ai_turns),
+    hence the lock; forked planners record what they put instead.
+    """
+    def __init__(self):
+        self.routes:  Dict[Tuple, List[TownID]] = dict()
+        self.by_town: Dict[TownID, Set[Tuple]]  = dict()
+
+        # Routing.alternative_paths, dropped as soon as one of them is
+        self.alternatives: Dict[Tuple, List[List[TownID]]] = dict()
+
+        self.hits, self.misses = 0, 0
+        self._lock = threading.Lock()
+
+        # None, or (key, path(s), alternatives?) of every put since set
+        # to a list; see _plan_in_worker
+        self.recorded: Union[List[Tuple[Tuple, List, bool]], None] = None
+
+    def __len__(self):
+        return len(self.routes)
+
+    def get(self, key: Tuple) -> Union[List[TownID], None]:
+        with self._lock:
+            path = self.routes.get(key)
+            if path is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return list(path)
+
+    def put(self, key: Tuple, path: List[TownID]):
+        with self._lock:
+            self.routes[key] = list(path)
+            for tid in path:
+                self.by_town.setdefault(tid, set()).add(key)
+            if self.recorded is not None:
+                self.recorded.append((key, path, False))
+
+    def get_all(self, key: Tuple) -> Union[List[List[TownID]], None]:
+        with self._lock:
+            paths = self.alternatives.get(key)
+            if paths is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return [list(p) for p in paths]
+
+    def put_all(self, key: Tuple, paths: List[List[TownID]]):
+        with self._lock:
+            self.alternatives[key] = [list(p) for p in paths]
+            for tid in set(itertools.chain.from_iterable(paths)):
+                self.by_town.setdefault(tid, set()).add(key)
+            if self.recorded is not None:
+                self.recorded.append((key, paths, True))
+
+    def invalidate(self, town_id: TownID):
+        with self._lock:
+            for key in self.by_town.pop(town_id, ()):
+                self.routes.pop(key, None)
+                self.alternatives.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self.routes, self.by_town, self.alternatives = dict(), dict(), dict()
+
+
+class PathTree:
+    """
+    Shortest-path tree from a single source, as computed by Dijkstra.
+    """
+    def __init__(self, source: TownID, pred: Dict[TownID, List[TownID]], dist: Dict[TownID, float]):
+        self.source = source
+        self.pred   = pred
+        self.dist   = dist
+
+    def path_to(self, end: TownID) -> List[TownID]:
+        if end not in self.dist:
+            raise nx.NetworkXNoPath(f"Node {end} not reachable from {self.source}")
+
+        # pred[n][0] is the first predecessor Dijkstra settled on, the same
+        # one nx.dijkstra_path would pick between equally short paths
+        path = [end]
+        while path[-1] != self.source:
+            path.append(self.pred[path[-1]][0])
+        return path[::-1]
+
+
+@dataclass
+class PathRisk:
+    """
+    Outcome of the shipments simulated by Routing.path_risk; kgs are
+    fractions of the kgs sent, 0 for captured shipments.
+    """
+    capture_probability: float
+    mean: float
+    quantiles: Dict[float, float]
 
 
 class Routing:
-    def __init__(self, world: World, graph):
+    def __init__(self, world: World, graph, cache=True, single_source=False, backend="networkx"):
         self.w     = world
         self.graph = graph
 
+        # "networkx": nx.dijkstra_* with the Python heuristics as weights;
+        # "csr": array Dijkstra over a CSRGraph with per-node weight vectors.
+        # Heuristics without a vectorized twin always use networkx.
+        my_assert(backend in ("networkx", "csr"), ValueError__(f"Unknown routing backend {backend}"))
+        self.backend = backend
+        self._csr = None
+
+        # Totals over every shipment sent through this router
+        self.shipped_kgs, self.delivered_kgs, self.captured_kgs = 0.0, 0.0, 0.0
+
+        self.cache = RouteCache() if cache else None
+
+        # single_source: one Dijkstra per (family, source, heuristic) per
+        # turn; every path from that source is read from its tree
+        self.single_source = single_source
+        self.trees: Dict[Tuple, PathTree] = dict()
+
+        # csr backend: hold and owner of every node, refreshed at the nodes
+        # of the towns changed since (town_changed() is called before the
+        # change is made), and per-node weights by (family, heuristic),
+        # dropped on any change; see array_weights()
+        self._arrays: Tuple["np.ndarray", "np.ndarray"] = None
+        self._stale: Set[TownID] = set()
+        self._weights: Dict[Tuple[FamilyID, Callable], "np.ndarray"] = dict()
+
+        # The vectorized twin of each heuristic, for the csr backend
+        self.array_twins: Dict[Callable, Callable] = {
+            self.safest_path_heuristic:        self.safest_path_weights,
+            self.best_expected_path_heuristic: self.best_expected_path_weights,
+            self.most_reliable_path_heuristic: self.most_reliable_path_weights,
+        }
+
+        # Guards the caches above and the Dijkstra counter against the
+        # threads planning AI turns; Dijkstra itself runs unlocked. Changes
+        # of the world (town_changed) never happen while they plan.
+        self._lock = threading.Lock()
+
+        self.w.add_town_listener(self.town_changed)
+
+        # Called with (shipment, path, last town reached) once a shipment is
+        # delivered or captured
+        self.shipment_listeners: List[Callable[[Shipment, List[TownID], TownID], None]] = list()
+
+
+    @property
+    def csr(self) -> "CSRGraph":
+        from ndrangheta.csr import CSRGraph
+
+        if self._csr is None:
+            self._csr = CSRGraph(self.graph)
+        return self._csr
+
+    def array_weights(self, family_id: FamilyID, strategy: Callable) -> Union["np.ndarray", None]:
+        """
+        Per-node weights equivalent to `strategy`, if the csr backend is on
+        and `strategy` has a vectorized twin; None otherwise.
+        """
+        if self.backend != "csr":
+            return None
+
+        twin = self.array_twins.get(strategy)
+        if twin is None:
+            return None
+
+        csr = self.csr
+        with self._lock:
+            if self._arrays is None:
+                self._arrays = csr.town_arrays(self.w)
+                self._stale = set()
+            elif self._stale:
+                nodes = np.array([csr.index[t] for t in self._stale if t in csr.index], dtype=np.int64)
+                self._arrays[0][nodes], self._arrays[1][nodes] = csr.town_arrays(self.w, nodes)
+                self._stale = set()
+
+            key = (family_id, twin)
+            weights = self._weights.get(key)
+            if weights is None:
+                weights = self._weights[key] = twin(family_id, *self._arrays)
+            return weights
+
+    def _count_dijkstra(self):
+        with self._lock:
+            self.w.metrics.dijkstra.inc()
+
+    def town_changed(self, town_id: TownID, owner: bool):
+        if self.cache is not None:
+            self.cache.invalidate(town_id)
+        if owner:
+            self.trees = dict()
+        if self._arrays is not None:
+            self._stale.add(town_id)
+            if self._weights:
+                self._weights = dict()
+
+    def new_turn(self):
+        self.trees = dict()
+
+    def close(self):
+        """
+        Stops following the changes of the world, eg. when another Routing
+        (Simulator) takes over the same world.
+        """
+        self.w.remove_town_listener(self.town_changed)
+
         
     def describe_shipment(self, town: Town, loss: float, my_family: FamilyID):
         """
@@ -56,10 +294,9 @@ class Routing:
         is_hostile = town.family.id != my_family
 
         # print(f"shipment_family={my_family}, this family={town.family.id}")
-        print(f"In node {town.id} lost {100*(1-loss):.2f}%")
-        print("\tWas " + ("" if is_hostile else "not ") + "hostile")
-        print(f"\tHold is {town.hold:.2f}")
-        print("")
+        log.debug("In node %s lost %.2f%%", town.id, 100*(1-loss))
+        log.debug("\tWas %shostile", "" if is_hostile else "not ")
+        log.debug("\tHold is %.2f\n", town.hold)
 
 
     def is_valid_shipment(self, start: TownID, end: TownID, ship: Shipment=None) -> bool:
@@ -88,6 +325,8 @@ class Routing:
         Move a package from a city to the other.
         """
         
+        # A dict lookup, whatever the backend: cheaper than numpy for one
+        # hop (send_shipments checks batches with CSRGraph.adjacent_many)
         if end_id not in self.graph.adj[start_id]:
             raise ShipmentError(f"Node {start_id} not adjacent to node {end_id}")
 
@@ -95,7 +334,8 @@ class Routing:
 
         remaining_percent = end.transit_shipment(ship)
         
-        self.describe_shipment(end, remaining_percent, ship.from_family)
+        if log.isEnabledFor(DEBUG):
+            self.describe_shipment(end, remaining_percent, ship.from_family)
         
         if remaining_percent == 0:
             return False
@@ -104,6 +344,7 @@ class Routing:
             return True
     
         
+    @profiled("transit")
     def send_shipment_manual(self,
                 start: TownID, end: TownID,
                 ship: Shipment, path: List[TownID]) -> int:
@@ -113,24 +354,35 @@ class Routing:
 
         assert(self.is_valid_shipment(start, end, ship))
 
-        print()
-        print("*"*12)
-        print(f"SHIPMENT: {start} to {end}, {ship.kgs}kg\n")
+        log.info("\n%s\nSHIPMENT: %s to %s, %skg\n", "*"*12, start, end, ship.kgs)
         
         town = self.w.Town(start)
         town.mail_shipment(ship)
+        self.shipped_kgs += ship.initial_kgs
+        self.w.ledger.open(ship, start, end)
+        metrics = self.w.metrics
+        metrics.shipments_sent.inc()
+        metrics.kg_sent.inc(ship.initial_kgs)
         
         from_node = path[0]
         
         for town_id in path[1:]: #NB: la prima iter sarà move(start, start)!
+            before = ship.kgs
             ok = self.move_single(from_node, town_id, ship)
 
             if not ok:
-                print(f"Failed to deliver, package captured in {town_id}! Lost {ship.kgs}kg!")
-                print("*"*12)
+                log.info("Failed to deliver, package captured in %s! Lost %skg!\n%s",
+                         town_id, ship.kgs, "*"*12)
                 self.w.Town(town_id).capture_shipment(ship)
+                self.captured_kgs += ship.kgs
+                self.w.ledger.close(ship, CAPTURED, town_id)
+                metrics.shipments_captured.inc()
+                metrics.kg_captured.inc(ship.kgs)
+                for listener in self.shipment_listeners:
+                    listener(ship, path, town_id)
                 return 0
             
+            metrics.hop_kg_lost.observe(before - ship.kgs)
             from_node = town_id
 
         town = self.w.Town(end)
@@ -138,32 +390,232 @@ class Routing:
         # new_hold = town.change_hold(ship.loss_percent())
 
         town.receive_shipment(ship)  
+        self.delivered_kgs += ship.kgs
+        self.w.ledger.close(ship, DELIVERED, end)
+        metrics.shipments_delivered.inc()
+        metrics.kg_delivered.inc(ship.kgs)
+        for listener in self.shipment_listeners:
+            listener(ship, path, end)
             
-        print(
-            f"Arrived at destination ({town.id}) "
-            f"with {ship.kgs:.2f}kg, "
-            f"lost {ship.loss_absolute():.2f}kg on the way.\n"
-            f"Hold at {town.id} changed from {old_hold:.2f} to {town.hold:.2f}"
-            f"(difference: {town.hold-old_hold:.2f})" 
-        )
-        print("*"*12)
+        if log.isEnabledFor(INFO):
+            log.info(
+                f"Arrived at destination ({town.id}) "
+                f"with {ship.kgs:.2f}kg, "
+                f"lost {ship.loss_absolute():.2f}kg on the way.\n"
+                f"Hold at {town.id} changed from {old_hold:.2f} to {town.hold:.2f}"
+                f"(difference: {town.hold-old_hold:.2f})\n"
+                + "*"*12
+            )
         
         return ship.kgs
 
+    @profiled("transit")
+    def send_shipments(self, batch: List[Tuple[TownID, TownID, Shipment, List[TownID]]],
+                       rng: "np.random.Generator" = None) -> List[float]:
+        """
+        send_shipment_manual() of many (start, end, shipment, path) at once:
+        the random draws of every hop are made in one go (from `rng`, by
+        default seeded from the world's generator) and captures and
+        deliveries are applied afterwards, in batch order.
+
+        Every hop sees holds and owners as they were before the batch. Hop
+        j of the i-th shipment uses draw offset(i) + j the way Town.transit_shipment
+        uses its random(), so given the same draws each shipment ends as
+        with send_shipment_manual. Returns the kgs delivered by each
+        shipment (0 if captured).
+        """
+        if len(batch) == 0:
+            return []
+        if rng is None:
+            rng = np.random.default_rng(self.w.rng.getrandbits(64))
+
+        # Every check comes before any change: a rejected batch leaves the
+        # world as it was
+        needed: Dict[TownID, float] = dict()
+        for start, end, ship, _ in batch:
+            assert(self.is_valid_shipment(start, end, ship))
+            needed[start] = needed.get(start, 0.0) + ship.initial_kgs
+        for start, kgs in needed.items():
+            if self.w.Town(start).drugs < kgs:
+                raise ShipmentError(f"Wanted to send {kgs}kg in total, "
+                                    f"but only {self.w.Town(start).drugs} are available in {start}")
+
+        csr = self.csr
+        n = len(batch)
+        hops = np.array([len(path) - 1 for _, _, _, path in batch], dtype=np.int64)
+        nodes = np.fromiter((csr.index[t] for _, _, _, path in batch for t in path),
+                            dtype=np.int64, count=int(hops.sum()) + n)
+
+        # Hop k (the pos-th of its shipment) goes from nodes[k + ship] to nodes[k + ship + 1]
+        ship_of_hop = np.repeat(np.arange(n), hops)
+        hop         = np.arange(len(ship_of_hop))
+        pos         = hop - (np.cumsum(hops) - hops)[ship_of_hop]
+        src, dst    = nodes[hop + ship_of_hop], nodes[hop + ship_of_hop + 1]
+
+        bad = np.flatnonzero(~csr.adjacent_many(src, dst))
+        if len(bad):
+            raise ShipmentError(f"Node {csr.ids[src[bad[0]]]} not adjacent to node {csr.ids[dst[bad[0]]]}")
+
+        ledger, metrics = self.w.ledger, self.w.metrics
+        for start, end, ship, _ in batch:
+            self.w.Town(start).mail_shipment(ship)
+            self.shipped_kgs += ship.initial_kgs
+            ledger.open(ship, start, end)
+            metrics.shipments_sent.inc()
+            metrics.kg_sent.inc(ship.initial_kgs)
+
+        towns, inv = np.unique(dst, return_inverse=True)
+        town_objs  = [self.w.Town(csr.ids[i]) for i in towns.tolist()]
+        hold   = np.array([t.hold for t in town_objs], dtype=np.float64)[inv]
+        family = np.array([t.family.id for t in town_objs], dtype=np.int64)[inv]
+        town   = np.array([t.id for t in town_objs], dtype=np.int64)[inv]
+        author = np.array([ship.from_family for _, _, ship, _ in batch], dtype=np.int64)[ship_of_hop]
+
+        # Same arithmetic as transit_shipment, montecarlo and Random.uniform
+        u = rng.random(len(ship_of_hop))
+        hostile = family != author
+        low = (1 + hold) / 2
+        mult = np.where(hostile, 1.0, low + (1 - low) * u)
+        caught = hostile & ~(u > hold - (1 - hold))
+
+        capture_at = np.full(n, np.iinfo(np.int64).max)
+        np.minimum.at(capture_at, ship_of_hop[caught], pos[caught])
+        passed = pos < capture_at[ship_of_hop]
+
+        # Shipment kgs hop by hop, in the same order of products as displace()
+        m = np.ones((n, int(hops.max())))
+        m[ship_of_hop[passed], pos[passed]] = mult[passed]
+        kgs = np.array([ship.kgs for _, _, ship, _ in batch], dtype=np.float64)
+        lost = np.zeros_like(m)
+        for j in range(m.shape[1]):
+            before, kgs = kgs, kgs * m[:, j]
+            lost[:, j] = before - kgs
+
+        ids = np.array([ship.id for _, _, ship, _ in batch], dtype=np.int64)
+        lost = lost[ship_of_hop[passed], pos[passed]]
+        ledger.add_hops(ids, ids[ship_of_hop[passed]], town[passed], mult[passed], lost)
+        metrics.hop_kg_lost.observe_many(lost)
+
+        log.info("BATCH: %d shipments, %d hops, %d captured", n, len(ship_of_hop), int((capture_at < hops).sum()))
+
+        delivered = list()
+        for (start, end, ship, path), k, c, h in zip(batch, kgs.tolist(), capture_at.tolist(), hops.tolist()):
+            ship.kgs = k
+
+            if c < h:
+                # Captured twice, as transit_shipment and send_shipment_manual do
+                town = self.w.Town(path[c + 1])
+                town.capture_shipment(ship)
+                town.capture_shipment(ship)
+                self.captured_kgs += ship.kgs
+                ledger.close(ship, CAPTURED, town.id)
+                metrics.shipments_captured.inc()
+                metrics.kg_captured.inc(ship.kgs)
+                for listener in self.shipment_listeners:
+                    listener(ship, path, town.id)
+                delivered.append(0)
+            else:
+                self.w.Town(end).receive_shipment(ship)
+                self.delivered_kgs += ship.kgs
+                ledger.close(ship, DELIVERED, end)
+                metrics.shipments_delivered.inc()
+                metrics.kg_delivered.inc(ship.kgs)
+                for listener in self.shipment_listeners:
+                    listener(ship, path, end)
+                delivered.append(ship.kgs)
+
+        return delivered
+
     def automatic_path(self, start_id: TownID, end_id: TownID,
                        strategy: Callable[[TownID, TownID, Any], float]) -> List[TownID]:
 
         start, end = self.w.Town(start_id), self.w.Town(end_id)
         self.check_is_valid_shipment_geographically(start, end)
+
+        if self.single_source:
+            return self.path_tree(start.family.id, start_id, strategy).path_to(end_id)
+
+        key = (start.family.id, start_id, end_id, strategy)
+        if self.cache is not None:
+            path = self.cache.get(key)
+            if path is not None:
+                return path
             
-        return nx.dijkstra_path(
-            self.graph,
-            start_id, end_id,
-            weight=lambda n1, n2, e: strategy(
-                start.family.id,
-                n1, n2, e
-            )
-        )
+        self._count_dijkstra()
+        with self.w.profiler.span("dijkstra", start.family.id):
+            weights = self.array_weights(start.family.id, strategy)
+            if weights is not None:
+                path = self.csr.dijkstra(start_id, weights, target=end_id).path_to(end_id)
+            else:
+                path = nx.dijkstra_path(
+                    self.graph,
+                    start_id, end_id,
+                    weight=lambda n1, n2, e: strategy(
+                        start.family.id,
+                        n1, n2, e
+                    )
+                )
+
+        if self.cache is not None:
+            self.cache.put(key, path)
+        return path
+    
+        
+    def path_tree(self, family_id: FamilyID, source: TownID,
+                  strategy: Callable[[TownID, TownID, Any], float]) -> PathTree:
+        """
+        Shortest-path tree from `source`, computed once per turn.
+        """
+        key = (family_id, source, strategy)
+        tree = self.trees.get(key)
+        if tree is not None:
+            return tree
+
+        self._count_dijkstra()
+        with self.w.profiler.span("dijkstra", family_id):
+            weights = self.array_weights(family_id, strategy)
+            if weights is not None:
+                tree = self.csr.dijkstra(source, weights)
+            else:
+                pred, dist = nx.dijkstra_predecessor_and_distance(
+                    self.graph, source,
+                    weight=lambda n1, n2, e: strategy(family_id, n1, n2, e)
+                )
+                tree = PathTree(source, pred, dist)
+
+        # Two planning threads may build the same tree: the last one is kept
+        with self._lock:
+            self.trees[key] = tree
+        return tree
+
+    def alternative_paths(self, start_id: TownID, end_id: TownID, k: int,
+                          strategy: Callable[[TownID, TownID, Any], float]) -> List[List[TownID]]:
+        """
+        The k cheapest loop-free paths from start_id to end_id (fewer if
+        there are not as many), cheapest first; cached like automatic_path.
+        """
+        start, end = self.w.Town(start_id), self.w.Town(end_id)
+        self.check_is_valid_shipment_geographically(start, end)
+
+        key = (start.family.id, start_id, end_id, strategy, k)
+        if self.cache is not None:
+            paths = self.cache.get_all(key)
+            if paths is not None:
+                return paths
+
+        family_id = start.family.id
+        self._count_dijkstra()
+        with self.w.profiler.span("dijkstra", family_id):
+            paths = list(itertools.islice(
+                nx.shortest_simple_paths(
+                    self.graph, start_id, end_id,
+                    weight=lambda n1, n2, e: strategy(family_id, n1, n2, e)
+                ), k
+            ))
+
+        if self.cache is not None:
+            self.cache.put_all(key, paths)
+        return paths
     
         
     def safest_path_heuristic(self, my_family: FamilyID, _, end_id: TownID, __):
@@ -172,9 +624,12 @@ class Routing:
         if t2.family.id != my_family:
             # Safe = evita a tutti i costi, a meno che non sia
             # inevitabile, un nodo di una famiglia avversaria
-            return len(Town.TOWNS) * t2.hold
+            return len(self.w.towns) * t2.hold
         
         return 1 - t2.hold
+
+    def safest_path_weights(self, my_family: FamilyID, hold, family):
+        return np.where(family != my_family, len(self.w.towns) * hold, 1 - hold)
     
 
     def send_shipment_safest(self, 
@@ -200,16 +655,80 @@ class Routing:
         # hold = 0.5 => v = 1 => no risk passing
         return 2 * (1 - t2.hold)                
 
+    def best_expected_path_weights(self, my_family: FamilyID, hold, family):
+        return np.where(family != my_family, (1 + hold) / 2, 2 * (1 - hold))
+
+
+    def most_reliable_path_heuristic(self, my_family, __, t_id2, _):
+        t2 = self.w.Town(t_id2)
+
+        # -log of the expected fraction of a shipment that survives
+        # entering t2 (see expected_multiplier_path): costs add up along a
+        # path as survival multiplies, so the cheapest path delivers most
+        if t2.family.id != my_family:
+            p = min(1, 2 * (1 - t2.hold))
+        else:
+            p = (3 + t2.hold) / 4
+        return -math.log(max(p, RELIABILITY_FLOOR))
+
+    def most_reliable_path_weights(self, my_family: FamilyID, hold, family):
+        p = np.where(family != my_family, np.minimum(1, 2 * (1 - hold)), (3 + hold) / 4)
+        return -np.log(np.maximum(p, RELIABILITY_FLOOR))
+
+    def send_shipment_most_reliable(self,
+            start: TownID,
+            end: TownID,
+            ship: Shipment) -> int:
+
+        return self.send_shipment_manual(
+            start, end, ship,
+            self.automatic_path(start, end, self.most_reliable_path_heuristic)
+        )
+
     
     def expected_multiplier_path(self, path: List, my_family: FamilyID, strategy: Callable) -> float:
+        """
+        Expected fraction of a shipment delivered along `path` (captures
+        count as 0), following Town.transit_shipment.
+        """
         m = 1
         for tid in path[1:]:
             t = self.w.Town(tid)
             if t.family.id != my_family:
-                m *= 2*(1 - t.hold)
+                # Passes with probability 1 - (2*hold - 1), untouched
+                m *= min(1, 2*(1 - t.hold))
             else:
-                m *= (1 + t.hold) / 2
+                # E[Uniform((1 + hold) / 2, 1)]
+                m *= (3 + t.hold) / 4
         return m
+
+    def path_risk(self, path: List[TownID], my_family: FamilyID, samples: int = 2_000,
+                  quantiles: Iterable[float] = (0.05, 0.25, 0.5, 0.75, 0.95),
+                  rng: "np.random.Generator" = None) -> "PathRisk":
+        """
+        Simulates `samples` shipments along `path` with the rules of
+        Town.transit_shipment, all hops of all of them in one NumPy draw.
+        Draws from `rng` (default: seeded from the world's generator).
+        """
+        if rng is None:
+            rng = np.random.default_rng(self.w.rng.getrandbits(64))
+
+        towns  = [self.w.Town(tid) for tid in path[1:]]
+        hold   = np.array([t.hold for t in towns], dtype=np.float64)
+        hostile = np.array([t.family.id != my_family for t in towns], dtype=bool)
+
+        u = rng.random((samples, len(towns)))
+        low = (1 + hold) / 2
+        captured = (hostile & ~(u > hold - (1 - hold))).any(axis=1)
+        delivered = np.where(hostile, 1.0, low + (1 - low) * u).prod(axis=1)
+        delivered[captured] = 0
+
+        quantiles = tuple(quantiles)
+        return PathRisk(
+            capture_probability = float(captured.mean()),
+            mean                = float(delivered.mean()),
+            quantiles           = dict(zip(quantiles, np.quantile(delivered, quantiles).tolist())),
+        )
     
 # =========================================================== #
 
@@ -238,6 +757,8 @@ class Narcos():
             raise DrugError(f"{money_needed:n}$ needed, but you only have {family.money:n}")
 
         family.money -= money_needed
+        self.world.metrics.narcos_spend.inc(money_needed)
+        self.world.metrics.narcos_kg.inc(kgs)
 
         return Schedule(self.deliver_drugs, In(turn=1), kgs, family, dest)
 
@@ -261,40 +782,102 @@ class Ask():
 from ndrangheta.read_dot import load_graph
 
 class AI:
-    def __init__(self, world: World, simulator: "Simulator"):
+    def __init__(self, world: World, simulator: "Simulator", risk_quantile: float = None,
+                 routes: int = 1):
         self.s = simulator
         self.w = world
+
+        # routes > 1: every request is split evenly among the most reliable
+        # `routes` paths (Routing.alternative_paths), so that a single
+        # capture does not lose all of it
+        self.routes = routes
+
+        # None: requests are sized on the expected loss of their path.
+        # Otherwise on this quantile of the kgs delivered (see Routing.path_risk),
+        # eg. 0.25 to cover the loss in 3 shipments out of 4.
+        self.risk_quantile = risk_quantile
         
     def decide_shipments(self, family_id):
-        fam  = self.w.Family(family_id)
-        reqs = self.sort_ai_cities_proposals(family_id)
+        if family_id == -1:
+            return
+        self.commit_shipments(
+            family_id, [(r, None) for r in self.sort_ai_cities_proposals(family_id)]
+        )
+
+    @profiled("plan", family_arg=0)
+    def plan_shipments(self, family_id) -> List[Tuple[Request, List[List[TownID]]]]:
+        """
+        Read-only half of decide_shipments(): the requests of the towns of
+        a family, most urgent first, each with its paths from the capital.
+        Does not change the world, so plans of different families can be
+        computed at the same time (see Simulator.plan_ai_turns).
+        """
+        if family_id == -1:
+            return []
+
+        fam = self.w.Family(family_id)
+        return [(r, self.paths(fam, r)) for r in self.sort_ai_cities_proposals(family_id)]
+
+    def paths(self, fam: Family, req: Request) -> List[List[TownID]]:
+        """
+        The paths a request is shipped along.
+        """
+        router = self.s.router
+        if self.routes > 1:
+            return router.alternative_paths(fam.capital, req.author, self.routes,
+                                            router.most_reliable_path_heuristic)
+        return [router.automatic_path(fam.capital, req.author, router.safest_path_heuristic)]
+
+    @profiled("commit", family_arg=0)
+    def commit_shipments(self, family_id, plan: List[Tuple[Request, Union[List[List[TownID]], None]]]):
+        """
+        Buys and sends the shipments of a plan while money lasts. None paths
+        are computed now; planned paths are dropped if capital or destination
+        changed hands since they were planned.
+        """
+        fam = self.w.Family(family_id)
         
-        if family_id == -1 or len(reqs) == 0:
+        if family_id == -1 or len(plan) == 0:
             return
 
-        print(f"TURN: AI {family_id}")
+        log.info("TURN: AI %s", family_id)
         #Provo tutte le richieste; la prima che posso esaudire, la esaudisco;
         #do priorità a quelle più urgenti.
         #Per ora, unica opzione è comprare dai narcos
-        sorted_reqs = reqs
-
-        print("REQUESTS:")
-        for r in sorted_reqs:
-            print("\t", r)
+        if log.isEnabledFor(INFO):
+            log.info("REQUESTS:")
+            for r, _ in plan:
+                log.info("\t %s", r)
             
-        for r in sorted_reqs:
+        for r, paths in plan:
             cost = self.s.ask_drug_price_to_narcos(r.kgs)
             
             if fam.money > cost:
-                print("CHOSEN: ", r)
+                if paths is not None and (paths[0][0] != fam.capital or
+                                          self.w.Town(r.author).family.id != family_id):
+                    log.info("STALE:   %s", r)
+                    continue
+                if r.kgs <= 0:
+                    # Narcos can't deliver, nor the capital send, 0 kg
+                    log.info("EMPTY:   %s", r)
+                    continue
+
+                log.info("CHOSEN:  %s", r)
                 self.s.buy_from_narcos(family_id, r.kgs, immediate=True)
 
-                self.s.router.send_shipment_safest(
-                    fam.capital, r.author,
-                    Shipment(r.kgs, 80_000, fam.id)
-                )
+                if paths is None:
+                    paths = self.paths(fam, r)
+                for path in paths:
+                    # min: the parts may add up to a hair more than was bought
+                    kgs = min(r.kgs / len(paths), self.w.Town(fam.capital).drugs)
+                    if kgs <= 0:
+                        log.info("DRY:     %s", r)
+                        break
+                    ship = Shipment(kgs, 80_000, fam.id)
+                    self.s.router.send_shipment_manual(fam.capital, r.author, ship, path)
 
             
+    @profiled("requests", family_arg=0)
     def sort_ai_cities_proposals(self, family_id: FamilyID):
         """
         Sorts all the proposals of every city of a family.
@@ -321,69 +904,357 @@ class AI:
         path = self.s.router.automatic_path(
             fam.capital, req.author, self.s.router.safest_path_heuristic
         )
-        mult = self.s.router.expected_multiplier_path(
-            path, fam.id, self.s.router.safest_path_heuristic
-        )
+        if self.risk_quantile is None:
+            mult = self.s.router.expected_multiplier_path(
+                path, fam.id, self.s.router.safest_path_heuristic
+            )
+        else:
+            # Seeded by the request, not drawn from the world's generator:
+            # planning stays read-only (see plan_shipments). Entries must be
+            # non-negative: a seed may not be, nor the police's id (-1)
+            entropy = [self.s.seed or 0, self.s.turn, fam.id, req.author]
+            rng = np.random.default_rng([x & 0xFFFF_FFFF_FFFF_FFFF for x in entropy])
+            risk = self.s.router.path_risk(path, fam.id, quantiles=(self.risk_quantile,), rng=rng)
+            mult = risk.quantiles[self.risk_quantile]
         req.kgs *= (2 - mult)
 
         return req
 
 
+@dataclass(slots=True)
+class Attack:
+    """
+    A war declared by `family`, from its town `attacker` to `defender`.
+    """
+    family: FamilyID
+    attacker: TownID
+    defender: TownID
+
+
+@dataclass
+class Command:
+    turn: int
+    name: str
+    args: Tuple = ()
+    kwargs: Dict[str, Any] = field(default_factory=dict)
+
+    def to_json(self) -> List:
+        return [self.turn, self.name, list(self.args), self.kwargs]
+
+    @staticmethod
+    def from_json(row: List) -> "Command":
+        turn, name, args, kwargs = row
+        return Command(turn, name, tuple(args), kwargs)
+
+
+def command(method):
+    """
+    Marks a Simulator method as a player command. Top-level calls that
+    succeed are appended to Simulator.journal; calls made while another
+    command runs (eg. by the AI during advance_time) are not.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self._in_command:
+            return method(self, *args, **kwargs)
+
+        turn = self.turn
+        self._in_command = True
+        try:
+            out = method(self, *args, **kwargs)
+        finally:
+            self._in_command = False
+        self.journal.append(Command(turn, method.__name__, args, kwargs))
+        return out
+    return wrapper
+
+
+def save_journal(fpath: str, journal: List[Command], seed: int = None):
+    with open(fpath, "w") as f:
+        json.dump({"seed": seed, "commands": [c.to_json() for c in journal]}, f)
+
+
+def load_journal(fpath: str) -> Tuple[Union[int, None], List[Command]]:
+    """
+    Returns (seed, commands) of a journal written by save_journal.
+    """
+    with open(fpath) as f:
+        data = json.load(f)
+    return data["seed"], [Command.from_json(row) for row in data["commands"]]
+
+
+# The AI of the simulator planning in a forked worker, see plan_ai_turns()
+_PLANNER: Union[AI, None] = None
+
+def _plan_in_worker(family_id: FamilyID) -> Tuple[List[Tuple[Request, List[TownID]]], List[Tuple], Tuple]:
+    """
+    The plan of a family, with what planning left in the worker's copy of
+    the router: the routes it cached, strategies by name (a bound method
+    would pickle the whole router), and its Dijkstra runs, hits and misses.
+    """
+    cache, dijkstra = _PLANNER.s.router.cache, _PLANNER.w.metrics.dijkstra
+    runs = dijkstra.value
+    if cache is None:
+        return _PLANNER.plan_shipments(family_id), [], (dijkstra.value - runs, 0, 0)
+
+    cache.recorded, hits, misses = list(), cache.hits, cache.misses
+    plan = _PLANNER.plan_shipments(family_id)
+    routes = [(key[:3] + (key[3].__name__,) + key[4:], paths, many)
+              for key, paths, many in cache.recorded]
+    cache.recorded = None
+    return plan, routes, (dijkstra.value - runs, cache.hits - hits, cache.misses - misses)
+
+
 class Simulator:
-    def __init__(self, world: World, graph):
+    def __init__(self, world: World, graph, vectorized=False, single_source=False,
+                 backend="networkx", player_id: Union[FamilyID, None] = 0, seed: int = None,
+                 ai_workers: int = None, ai_executor: str = "thread", ai_risk: float = None,
+                 ai_routes: int = 1, profile=False, metrics_path: str = None):
         self.world  = world
-        self.router = Routing(world, graph)
+        if vectorized:
+            self.world.attach_state()
+
+        # See profiler
+        if profile:
+            self.world.profiler = Profiler(world)
+
+        # world.metrics is written to this file after every turn, see metrics
+        self.metrics_path = metrics_path
+
+        # With a seed, every random draw of the game comes from world.rng
+        # and a game is reproduced by its seed and its journal
+        self.seed = seed
+        if seed is not None:
+            self.world.rng = random.Random(seed)
+
+        # Player commands, in order of execution; see replay()
+        self.journal: List[Command] = list()
+        self._in_command = False
+
+        self.router = Routing(world, graph, single_source=single_source, backend=backend)
         self.narcos = Narcos(world)
         
-        self.player_id, self.player = 0, self.world.Family(0)
+        # player_id=None: every family is played by the AI
+        self.player_id = player_id
+        self.player    = None if player_id is None else self.world.Family(player_id)
+
+        self.ai = AI(self.world, self, risk_quantile=ai_risk, routes=ai_routes)
 
-        self.ai = AI(self.world, self)
-        self.turn = 0
+        # ai_workers=None: each AI family plans and acts in its turn.
+        # Otherwise every AI family plans at once, on the state of the map
+        # after the town step, with ai_workers threads or forked processes
+        # (0: one per core); plans are then carried out in turn order.
+        # Processes are forked anew every turn, to see the map of that turn
+        # (see plan_ai_turns): only worth it on very large maps.
+        my_assert(ai_executor in ("thread", "process"), ValueError__(f"Unknown AI executor {ai_executor}"))
+        self.ai_workers  = ai_workers
+        self.ai_executor = ai_executor
+
+        # Family-owned tasks due in the current turn, see advance_time()
+        self.due_operations: Dict[FamilyID, List[Schedule]] = dict()
+
+        # Attacks due in the current turn, fought in its war phase (see resolve_wars)
+        self.attacks: List[Attack] = list()
+
+        # See renderer()
+        self._renderer, self._viewer = None, None
+
+    @property
+    def turn(self) -> int:
+        return self.world.scheduler.now
+
+    @property
+    def rng(self):
+        return self.world.rng
+
+    @property
+    def profiler(self) -> Profiler:
+        return self.world.profiler
+
+    def replay(self, journal: Iterable[Command]):
+        """
+        Runs again the commands of a journal; the simulator must start
+        from the same map and seed as the recorded one.
+        """
+        for c in journal:
+            my_assert(c.turn == self.turn,
+                      ValueError__(f"Command {c.name} recorded at turn {c.turn}, replayed at {self.turn}"))
+            getattr(self, c.name)(*c.args, **c.kwargs)
+
+    def schedule(self, task: Schedule, family_id: FamilyID):
+        """
+        Schedules a task of a family; it will run during that family's turn.
+        """
+        self.world.scheduler.schedule(task, owner=self.world.Family(family_id))
 
     def update_graph(self):
-        for tid, t in self.world.towns.items():
-            print(t.__dict__.items())
-            nx.set_node_attributes(
-                self.router.graph,
-                {tid:
-                 ({k:v for k,v in t.__dict__.items() if k not in ["local_family"]} |
-                  {"family": t.family.id})}   
-            )
+        """
+        Copies into the graph the exported fields of the towns (Town.EXPORTED)
+        changed since the previous call; the first call copies all of them.
+        """
+        w = self.world
+        if w.dirty is None:
+            dirty = {tid: Town.EXPORTED for tid in w.towns}
+        else:
+            dirty = w.dirty
+        w.dirty = dict()
+
+        values = dict()
+        for tid, fields in dirty.items():
+            t = w.Town(tid)
+            values[tid] = {
+                f: (t.family.id if f == "family" else getattr(t, f)) for f in fields
+            }
+
+        log.debug("Graph sync: %d towns changed", len(values))
+        nx.set_node_attributes(self.router.graph, values)
         
-    def save_graph(self, fpath):
+    def renderer(self, map_path: str = None, interactive=False) -> "Renderer":
+        """
+        The Renderer of this game, created on first use; `map_path` lets it
+        cache the layout next to the map.
+        """
+        from ndrangheta.render import Renderer
+
+        if interactive:
+            if self._viewer is None:
+                self._viewer = Renderer(self, map_path=map_path, interactive=True)
+            return self._viewer
+
+        if self._renderer is None:
+            self._renderer = Renderer(self, map_path=map_path)
+        return self._renderer
+
+    def save_graph(self, fpath="web/map.svg"):
         self.update_graph()
-        show(self.router.graph, False, True, fpath="web/map.svg")
+        self.renderer().frame(fpath)
 
     def show_graph(self):
         self.update_graph()
-        show(self.router.graph)
+        self.renderer(interactive=True).show()
 
     # =========================================================== #
     
+    @command
     def advance_time(self, turns=1):
+        profiler, metrics = self.world.profiler, self.world.metrics
         for _ in range(turns):
-            for _, town in self.world.towns.items():
-                town.advance_turn()
-
-            # Every turn follows a random order of execution
-            for family_id in shuffle(list(self.world.families)):
-                self.ai_family_turn(family_id)
-
-            self.turn += 1
+            start = time.perf_counter()
+            with profiler.span("turn"):
+                self.router.new_turn()
+                due = self.world.scheduler.advance()
+
+                with profiler.span("towns"):
+                    if self.world.state is not None:
+                        self.world.state.sell_daily_doses()
+                    else:
+                        for _, town in self.world.towns.items():
+                            town.advance_turn()
+
+                # Tasks of local families (eg. taxes) run right after the town
+                # step; tasks of families run during the family's turn.
+                self.due_operations = dict()
+                with profiler.span("local_tasks"):
+                    for owner, task in due:
+                        if isinstance(owner, Family):
+                            self.due_operations.setdefault(owner.id, list()).append(task)
+                        elif owner is None or owner.town.family.id != -1:
+                            task()
+
+                # War phase: attacks declared last turn, all at once
+                if self.attacks:
+                    attacks, self.attacks = self.attacks, list()
+                    self.resolve_wars(attacks)
+
+                # Every turn follows a random order of execution
+                order = shuffle(list(self.world.families), self.rng)
+                plans = self.plan_ai_turns(order) if self.ai_workers is not None else dict()
+                for family_id in order:
+                    self.ai_family_turn(family_id, plans.get(family_id))
+
+            metrics.turn.set(self.turn)
+            metrics.turn_seconds.observe(time.perf_counter() - start)
+            if self.metrics_path is not None:
+                metrics.write(self.metrics_path)
 
         
-    def ai_family_turn(self, family_id: FamilyID):
+    @profiled("family", world="world", family_arg=0)
+    def ai_family_turn(self, family_id: FamilyID, plan: List[Tuple[Request, List[TownID]]] = None):
+        for op in self.due_operations.pop(family_id, ()):
+            op()
+
         if family_id != self.player_id:
-            self.ai.decide_shipments(family_id)
-            return
+            if plan is None:
+                self.ai.decide_shipments(family_id)
+            else:
+                self.ai.commit_shipments(family_id, plan)
 
-        # if human player:
-        for op in self.player.scheduled_operations:
-            op()
-        self.player.scheduled_operations = list()
+    @profiled("planning", world="world")
+    def plan_ai_turns(self, families: List[FamilyID]) -> Dict[FamilyID, List[Tuple[Request, List[TownID]]]]:
+        """
+        AI.plan_shipments of every AI family among `families`, computed in
+        parallel. Planning draws no random numbers and leaves the router
+        as it would leave it planning in turn, so the game does not depend
+        on the number of workers or on the executor.
+
+        Threads share the caches of the router, which are locked (the
+        paths they find stay cached for the commit phase and later turns).
+        Forked workers send back the routes they cached, which are put in
+        the router in family order, as are their Dijkstra counts; trees of
+        single_source only last the turn and are not sent back.
+
+        The process executor forks a new pool every turn, since workers
+        must see the map of the turn: a few tens of ms per turn, so only
+        worth it where planning takes seconds.
+        """
+        global _PLANNER
+
+        ai = [f for f in families if f != self.player_id and f != -1]
+        if len(ai) == 0:
+            return dict()
+        workers = min(self.ai_workers or os.cpu_count() or 1, len(ai))
+
+        # Not imported with the module: most games never plan in parallel
+        import multiprocessing
+        from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+        if self.ai_executor == "process":
+            # Forked workers see the map as it is now; only plans come back
+            _PLANNER = self.ai
+            try:
+                with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork")) as pool:
+                    results = list(pool.map(_plan_in_worker, ai, chunksize=max(1, len(ai) // (4 * workers))))
+            finally:
+                _PLANNER = None
+
+            cache, plans = self.router.cache, list()
+            for plan, routes, (runs, hits, misses) in results:
+                plans.append(plan)
+                self.world.metrics.dijkstra.inc(runs)
+                if cache is None:
+                    continue
+                cache.hits, cache.misses = cache.hits + hits, cache.misses + misses
+                for key, paths, many in routes:
+                    key = key[:3] + (getattr(self.router, key[3]),) + key[4:]
+                    (cache.put_all if many else cache.put)(key, paths)
+        else:
+            if self.router.backend == "csr":
+                self.router.csr # built once, not by every thread
+            with ThreadPoolExecutor(workers) as pool:
+                plans = list(pool.map(self.ai.plan_shipments, ai))
+
+        return dict(zip(ai, plans))
 
 
+    @profiled("narcos", world="world", family_arg=0)
     def buy_from_narcos(self, family_id, kgs, immediate=False) -> Union[Tuple[Callable, KG], None]:
+        """
+        Pays the narcos. Without `immediate`, returns the delivery task,
+        which the caller has to schedule.
+
+        Not a command: a journal could not replay the scheduling of its
+        delivery. Players use order_drugs or buy_drugs_now.
+        """
         family = self.world.Family(family_id)
         dest   = family.capital
 
@@ -404,30 +1275,51 @@ class Simulator:
         else:
             return self.router.send_shipment_safest(id1, id2, ship)
 
+    @command
+    def order_drugs(self, family_id: FamilyID, kgs: KG):
+        """
+        Pays the narcos now; drugs reach the capital during the next turn.
+        """
+        self.schedule(self.buy_from_narcos(family_id, kgs), family_id)
+
+    @command
+    def buy_drugs_now(self, family_id: FamilyID, kgs: KG):
+        """
+        Pays the narcos; drugs reach the capital at once.
+        """
+        self.buy_from_narcos(family_id, kgs, immediate=True)
+
+    @command
+    def schedule_shipment(self, family_id: FamilyID, id1: TownID, id2: TownID, kgs: KG):
+        """
+        Sends `kgs` from id1 to id2 during the next turn.
+        """
+        ship = Shipment(kgs, 80_000, family_id)
+        if self.router.is_valid_shipment(id1, id2, ship):
+            self.schedule(Schedule(self.send_shipment, In(turn=1), id1, id2, ship), family_id)
+
         
+    @command
     def change_tax(self, player_id: FamilyID, city: TownID, amount: float):
         self.world.Family(player_id).change_tax_in(city, amount)
 
         
+    @command
     def declare_war_schedule(self, player_id: FamilyID, tid1: TownID, tid2: TownID):
-        t1, t2 = self.world.Town(tid1), self.world.Town(tid2)
-
-        if t1.family == t2.family:
-            raise WarError("Can't declare war between two friendly city!")
-        if t2.hold > 0.7:
-            raise WarError("Can't declare war if hold in defender is >0.7!")
-        if t1.family.id != player_id:
-            raise WarError("Can't control non-owned cities!")
-        # TODO: controlla che città siano dirimpettaie 
+        """
+        Declares war now; the battle is fought in the war phase of the next
+        turn (see resolve_wars).
+        """
+        self.check_war(player_id, self.world.Town(tid1), self.world.Town(tid2))
 
-        t1.family.scheduled_operations.append(
-            Schedule(self.declare_war, In(turn=1),
-                     player_id, tid1, tid2)
+        self.world.scheduler.schedule(
+            Schedule(self.enlist_attack, In(turn=1), Attack(player_id, tid1, tid2))
         )
-    
-    def declare_war(self, player_id: FamilyID, tid1: TownID, tid2: TownID):
-        t1, t2 = self.world.Town(tid1), self.world.Town(tid2)
 
+    def enlist_attack(self, attack: Attack):
+        self.attacks.append(attack)
+
+    def check_war(self, player_id: FamilyID, t1: Town, t2: Town):
         if t1.family == t2.family:
             raise WarError("Can't declare war between two friendly city!")
         if t2.hold > 0.7:
@@ -436,6 +1328,41 @@ class Simulator:
             raise WarError("Can't control non-owned cities!")
         # TODO: controlla che città siano dirimpettaie 
 
+    @profiled("wars", world="world")
+    def resolve_wars(self, attacks: List[Attack]) -> List[Union[bool, None]]:
+        """
+        Fights a batch of attacks, defender by defender (by town id), the
+        strongest attacker of a town first. An attack made invalid by an
+        earlier battle of the batch (the attacking town was lost, the
+        defender now belongs to the attacker...) is dropped. A town
+        conquered earlier in the batch is attacked as usual: its hold is
+        0.7, so its former owner can strike back.
+
+        Returns, for every attack, whether the town was conquered (None:
+        dropped).
+        """
+        w = self.world
+        strength = [w.Town(a.attacker).local_family.soldiers * w.Town(a.attacker).local_family.leader
+                    for a in attacks]
+        order = sorted(range(len(attacks)),
+                       key=lambda i: (attacks[i].defender, -strength[i], attacks[i].attacker, attacks[i].family))
+
+        outcome: List[Union[bool, None]] = [None] * len(attacks)
+        for i in order:
+            a = attacks[i]
+            try:
+                outcome[i] = self.declare_war(a.family, a.attacker, a.defender)
+            except WarError as e:
+                log.info("WAR DROPPED: %s -> %s (%s)", a.attacker, a.defender, e)
+        return outcome
+
+    @profiled("war", world="world", family_arg=0)
+    def declare_war(self, player_id: FamilyID, tid1: TownID, tid2: TownID) -> bool:
+        """
+        Fights a battle now; returns whether tid2 was conquered.
+        """
+        t1, t2 = self.world.Town(tid1), self.world.Town(tid2)
+        self.check_war(player_id, t1, t2)
         
         def defense_factor(t):
             return 2 ** ((t.hold - 0.6) * 10)
@@ -443,27 +1370,14 @@ class Simulator:
         atk_val = t1.local_family.soldiers * t1.local_family.leader
         def_val = t2.local_family.soldiers * t2.local_family.leader * defense_factor(t2)
 
-        print(atk_val, def_val)
+        log.info("%s %s", atk_val, def_val)
         
         if atk_val > def_val:
-            print(f"City {t2.id} conquered!")
+            log.info("City %s conquered!", t2.id)
+            self.world.metrics.wars_won.inc()
             
             if t2.is_capital:
-                # BUG: cancellazione comporta qualche side effect?
-                del self.world.families[t2.family.id]
-                
-                towns = [t for t in self.world.towns.values() if t.family==t2.family]
-
-                for t in towns:
-                    if t == t2:
-                        continue
-                    # new_family
-                    fam_id = self.world.new_id_for_family()
-                    f = Family(fam_id, str(fam_id), sanitize_metanode({"family": fam_id}), world=self.world)
-                    t.change_ownership(f)
-                    t.change_hold(loss_percent=100)
-                    t.is_capital = True
-                    f.capital = t.id
+                self.dissolve_family(t2, heir=t1.family)
                     
             t2.change_ownership(t1.family)
 
@@ -471,7 +1385,7 @@ class Simulator:
                 round((atk_val - def_val) / t1.local_family.leader)
             )
             t2.local_family.soldiers = (
-                random.randint(0, t2.local_family.soldiers // 4)
+                self.rng.randint(0, t2.local_family.soldiers // 4)
             )
             
             t1.local_family.variate_leader(+0.5)
@@ -481,9 +1395,10 @@ class Simulator:
             t1.hold += 0.08
 
             t1.family.drugs += t2.drugs
-            
+            return True
             
         else:
+            self.world.metrics.wars_lost.inc()
             t1.local_family.variate_leader(-1)
             t2.local_family.variate_leader(+1)
 
@@ -494,15 +1409,61 @@ class Simulator:
                 round((def_val - atk_val) / t2.local_family.leader)
             )
             t1.local_family.soldiers = (
-                random.randint(0, t1.local_family.soldiers // 4)
+                self.rng.randint(0, t1.local_family.soldiers // 4)
             )
+            return False
+
+    def dissolve_family(self, capital: Town, heir: Family = None) -> List[Family]:
+        """
+        The family of a fallen capital is no more: each of its other towns
+        becomes the capital of a new family, in order of town id. Only the
+        towns of that family are visited (World.family_towns).
+
+        Drugs already paid to the narcos still reach the fallen capital,
+        during the turn of `heir` (its conqueror; with no heir, right after
+        the town step). Shipments the family scheduled are dropped.
+        """
+        w = self.world
+        old = capital.family
+        fid = old.id
+        w.remove_family(fid)
+
+        is_delivery = lambda task: task.func == self.narcos.deliver_drugs
+        dropped = w.scheduler.reassign(old, heir, keep=is_delivery)
+        for task in self.due_operations.pop(fid, ()):
+            if is_delivery(task):
+                if heir is None:
+                    task()
+                else:
+                    self.due_operations.setdefault(heir.id, list()).append(task)
+            else:
+                dropped.append(task)
+        for task in dropped:
+            log.info("Family %s dissolved, dropped %s%s", fid, task.func.__name__, task.args)
+
+        families = list()
+        for t in sorted(w.towns_of_family(fid), key=lambda t: t.id):
+            if t is capital:
+                continue
+            fam_id = w.new_id_for_family()
+            f = Family(fam_id, str(fam_id), {"money": FAMILY_MONEY}, world=w)
+            w.add_family(f)
+            t.change_ownership(f)
+            t.change_hold(loss_percent=100)
+            t.is_capital = True
+            w.touch(t.id, "is_capital")
+            f.capital = t.id
+            families.append(f)
+        return families
 
             
+
 # =========================================================== #
 
 def play():
     import readline
 
+    console()
     world, graph = load_graph("ndrangheta/example.dot")
     sim = Simulator(world, graph)
     player_id = 0
@@ -515,8 +1476,18 @@ def play():
             s = input("λ) ").split(" ")
 
             if s[0] == "save":
-                sim.save_graph(0)
-                
+                sim.save_graph()
+
+            if s[0] == "dump": # checkpoint the whole game
+                from ndrangheta.snapshot import save_snapshot
+                save_snapshot(sim, s[1])
+
+            if s[0] == "resume":
+                from ndrangheta.snapshot import load_snapshot
+                sim    = load_snapshot(s[1])
+                world  = sim.world
+                player = world.Family(player_id)
+
             if s[0] == "show":
                 sim.show_graph()
 
@@ -536,18 +1507,15 @@ def play():
 
                 # Scala i soldi, delivera la droga solo il giorno dopo
                 if Ask.confirm():
-                    operation = sim.buy_from_narcos(player_id, amount)
-                    player.scheduled_operations.append(operation)
+                    sim.order_drugs(player_id, amount)
                     
                     
             if s[0] == "send": #path
                 from_, to, amount = int(s[1]), int(s[2]), int(s[3])
-                ship = Shipment(amount, 80_000, world.Town(from_).family.id)
-                    
-                if sim.router.is_valid_shipment(from_, to, ship):
-                    player.scheduled_operations.append(
-                        Schedule(sim.send_shipment, In(turn=1), from_, to, ship)
-                    )
+                sim.schedule_shipment(player_id, from_, to, amount)
+
+            if s[0] == "journal": # commands played so far, see Simulator.replay
+                save_journal(s[1], sim.journal, sim.seed)
 
 
             if s[0] == "list":
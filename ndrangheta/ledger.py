@@ -0,0 +1,185 @@
+"""
+Shipment ledger: every shipment sent in a world and every hop it made,
+stored as typed columns rather than per-shipment Python lists. The hops
+of a shipment are added to the columns when it is closed.
+
+    w.ledger.loss_per_town()          # {TownID: kg lost or captured there}
+    w.ledger.capture_rate_per_family()
+    w.ledger.kg_lost_per_turn()
+"""
+from typing import *
+import numpy as np
+
+# Outcome of a shipment
+IN_TRANSIT, DELIVERED, CAPTURED = 0, 1, 2
+
+SHIPMENT_COLUMNS = {
+    "family":    np.int64,
+    "start":     np.int64,
+    "end":       np.int64,
+    "turn":      np.int32,
+    "kgs":       np.float64, # sent
+    "final_kgs": np.float64, # delivered or captured
+    "outcome":   np.int8,
+    "last":      np.int64,   # town where it was delivered or captured
+    "first_hop": np.int64,   # its hops are rows first_hop .. first_hop + hops - 1
+    "hops":      np.int64,
+}
+
+HOP_COLUMNS = {
+    "ship":       np.int64,
+    "town":       np.int64,
+    "multiplier": np.float64,
+    "lost":       np.float64, # kgs lost entering the town
+    "turn":       np.int32,
+}
+
+
+class Table:
+    """
+    Growable struct-of-arrays table; rows are only appended.
+    """
+    def __init__(self, columns: Dict[str, type], capacity: int = 64):
+        self.size = 0
+        self.columns: Dict[str, np.ndarray] = {
+            name: np.zeros(capacity, dtype=dtype) for name, dtype in columns.items()
+        }
+
+    def __len__(self):
+        return self.size
+
+    def column(self, name: str) -> np.ndarray:
+        return self.columns[name][:self.size]
+
+    def _reserve(self, n: int):
+        capacity = len(next(iter(self.columns.values())))
+        if self.size + n <= capacity:
+            return
+        capacity = max(2 * capacity, self.size + n)
+        for name, arr in self.columns.items():
+            self.columns[name] = np.resize(arr, capacity)
+
+    def append(self, **values) -> int:
+        self._reserve(1)
+        row = self.size
+        for name, v in values.items():
+            self.columns[name][row] = v
+        self.size += 1
+        return row
+
+    def extend(self, **values: np.ndarray) -> int:
+        """
+        Appends len(values) rows at once; returns the index of the first one.
+        """
+        n = len(next(iter(values.values())))
+        self._reserve(n)
+        row = self.size
+        for name, v in values.items():
+            self.columns[name][row:row + n] = v
+        self.size += n
+        return row
+
+
+class ShipmentLedger:
+    def __init__(self, world: "World"):
+        self.world = world
+        self.ships = Table(SHIPMENT_COLUMNS)
+        self.hops  = Table(HOP_COLUMNS)
+        # (town, multiplier, lost, turn) of the hops of shipments still in
+        # transit, by shipment; moved to `hops` when the shipment is closed
+        self._pending: Dict[int, List[Tuple]] = dict()
+
+    def __len__(self):
+        return len(self.ships)
+
+    # =========================================================== #
+
+    def open(self, ship: "Shipment", start: "TownID", end: "TownID") -> int:
+        """
+        Records a shipment leaving `start`; it is bound to this ledger and
+        gets its id.
+        """
+        ship.ledger = self
+        ship.id = self.ships.append(
+            family=ship.from_family, start=start, end=end, turn=self.world.scheduler.now,
+            kgs=ship.initial_kgs, outcome=IN_TRANSIT, last=-1, first_hop=len(self.hops), hops=0,
+        )
+        return ship.id
+
+    def hop(self, ship_id: int, town: "TownID", multiplier: float, lost: float):
+        self._pending.setdefault(ship_id, list()).append((town, multiplier, lost, self.world.scheduler.now))
+
+    def add_hops(self, ships: np.ndarray, ship_ids: np.ndarray, towns: np.ndarray,
+                 multipliers: np.ndarray, lost: np.ndarray):
+        """
+        hop() of many hops at once, for the shipments `ships` opened one
+        after the other; hops are grouped by shipment, in that order.
+        """
+        first = self.hops.extend(ship=ship_ids, town=towns, multiplier=multipliers, lost=lost,
+                                 turn=np.full(len(ship_ids), self.world.scheduler.now))
+        counts = np.bincount(ship_ids - ships[0], minlength=len(ships))
+        self.ships.columns["first_hop"][ships] = first + np.cumsum(counts) - counts
+        self.ships.columns["hops"][ships] = counts
+
+    def close(self, ship: "Shipment", outcome: int, town: "TownID"):
+        """
+        Records where a shipment ended; its hop() rows are added to `hops`.
+        """
+        cols = self.ships.columns
+        pending = self._pending.pop(ship.id, None)
+        if pending:
+            towns, multipliers, lost, turns = zip(*pending)
+            cols["first_hop"][ship.id] = self.hops.extend(
+                ship=np.full(len(pending), ship.id), town=towns, multiplier=multipliers, lost=lost, turn=turns)
+            cols["hops"][ship.id] = len(pending)
+        cols["outcome"][ship.id]   = outcome
+        cols["last"][ship.id]      = town
+        cols["final_kgs"][ship.id] = ship.kgs
+
+    def history(self, ship_id: int) -> List[Tuple["TownID", float]]:
+        """
+        (town, multiplier) of every hop a shipment made.
+        """
+        if ship_id in self._pending:
+            return [(town, m) for town, m, _, _ in self._pending[ship_id]]
+        first, n = int(self.ships.columns["first_hop"][ship_id]), int(self.ships.columns["hops"][ship_id])
+        hops = self.hops.columns
+        return list(zip(hops["town"][first:first + n].tolist(), hops["multiplier"][first:first + n].tolist()))
+
+    # =========================================================== #
+
+    def _captured(self) -> np.ndarray:
+        return self.ships.column("outcome") == CAPTURED
+
+    def loss_per_town(self) -> Dict["TownID", float]:
+        """
+        Kgs lost in transit through each town plus the kgs captured there.
+        """
+        captured = self._captured()
+        towns = np.concatenate([self.hops.column("town"), self.ships.column("last")[captured]])
+        kgs   = np.concatenate([self.hops.column("lost"), self.ships.column("final_kgs")[captured]])
+        return _group_sum(towns, kgs)
+
+    def kg_lost_per_turn(self) -> Dict[int, float]:
+        """
+        Kgs lost in transit plus kgs captured, by turn.
+        """
+        captured = self._captured()
+        turns = np.concatenate([self.hops.column("turn"), self.ships.column("turn")[captured]])
+        kgs   = np.concatenate([self.hops.column("lost"), self.ships.column("final_kgs")[captured]])
+        return _group_sum(turns, kgs)
+
+    def capture_rate_per_family(self) -> Dict["FamilyID", float]:
+        """
+        Captured shipments over shipments that reached their end, by family.
+        """
+        done = self.ships.column("outcome") != IN_TRANSIT
+        family = self.ships.column("family")[done]
+        keys, inv = np.unique(family, return_inverse=True)
+        captured = np.bincount(inv, weights=self._captured()[done], minlength=len(keys))
+        return dict(zip(keys.tolist(), (captured / np.bincount(inv, minlength=len(keys))).tolist()))
+
+
+def _group_sum(keys: np.ndarray, values: np.ndarray) -> Dict[int, float]:
+    uniq, inv = np.unique(keys, return_inverse=True)
+    return dict(zip(uniq.tolist(), np.bincount(inv, weights=values, minlength=len(uniq)).tolist()))
@@ -0,0 +1,175 @@
+"""
+Counters and histograms of a game, written in the Prometheus text
+exposition format.
+
+    sim = Simulator(world, graph, metrics_path="/var/lib/node_exporter/ndrangheta.prom")
+    sim.advance_time(turns=100)    # the file is rewritten after every turn
+    world.metrics.shipments_captured.value
+
+The file is replaced atomically, so a scraper (eg. the textfile collector
+of node_exporter) never reads half of it. Values start from zero with
+every new World, like the counters of a restarted process.
+"""
+from typing import *
+import os
+import math
+import bisect
+import tempfile
+
+import numpy as np
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name  = name
+        self.help  = help
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        yield self.name, "", self.value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float]):
+        self.name    = name
+        self.help    = help
+        self.buckets = sorted(buckets)
+        # counts[i]: observations in (buckets[i-1], buckets[i]]; the last one above every bucket
+        self.counts  = [0] * (len(self.buckets) + 1)
+        self.sum     = 0.0
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def observe_many(self, values: np.ndarray):
+        """
+        observe() of every value of an array.
+        """
+        if len(values) == 0:
+            return
+        for i, n in enumerate(np.bincount(np.searchsorted(self.buckets, values, side="left"),
+                                          minlength=len(self.counts)).tolist()):
+            self.counts[i] += n
+        self.sum += float(np.sum(values))
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        total = 0
+        for le, n in zip(self.buckets + [math.inf], self.counts):
+            total += n
+            yield self.name + "_bucket", f'{{le="{_format(le)}"}}', total
+        yield self.name + "_sum", "", self.sum
+        yield self.name + "_count", "", total
+
+
+Metric = Union[Counter, Gauge, Histogram]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = dict()
+
+    def _add(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._add(Counter(name, help))
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        return self._add(Gauge(name, help))
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float]) -> Histogram:
+        return self._add(Histogram(name, help, buckets))
+
+    def values(self) -> Dict[str, float]:
+        """
+        Every sample, by name (with labels, if any).
+        """
+        return {name + labels: value for m in self.metrics.values() for name, labels, value in m.samples()}
+
+    def exposition(self) -> str:
+        """
+        The Prometheus text format (version 0.0.4) of every metric.
+        """
+        lines = list()
+        for m in self.metrics.values():
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            for name, labels, value in m.samples():
+                lines.append(f"{name}{labels} {_format(value)}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, fpath: str):
+        """
+        Replaces `fpath` with exposition(), atomically.
+        """
+        folder = os.path.dirname(os.path.abspath(fpath))
+        fd, tmp = tempfile.mkstemp(dir=folder, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(self.exposition())
+            os.replace(tmp, fpath)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+
+def _format(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class SimulationMetrics(Registry):
+    """
+    The metrics every game keeps up to date, see World.metrics.
+    """
+    def __init__(self):
+        super().__init__()
+        c, h = self.counter, self.histogram
+
+        self.turn         = self.gauge("ndrangheta_turn", "Current turn")
+        self.turn_seconds = h("ndrangheta_turn_seconds", "Wall time of a turn",
+                              (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60))
+
+        self.shipments_sent      = c("ndrangheta_shipments_sent_total", "Shipments sent")
+        self.shipments_delivered = c("ndrangheta_shipments_delivered_total", "Shipments delivered")
+        self.shipments_captured  = c("ndrangheta_shipments_captured_total", "Shipments captured")
+        self.kg_sent      = c("ndrangheta_kg_sent_total", "Kgs of drugs sent")
+        self.kg_delivered = c("ndrangheta_kg_delivered_total", "Kgs of drugs delivered")
+        self.kg_captured  = c("ndrangheta_kg_captured_total", "Kgs of drugs captured")
+        self.hop_kg_lost  = h("ndrangheta_hop_kg_lost", "Kgs lost by a shipment entering a town",
+                              (0.001, 0.01, 0.1, 0.5, 1, 5, 10, 50))
+        self.dijkstra     = c("ndrangheta_dijkstra_total", "Shortest path searches (route cache misses)")
+
+        self.narcos_spend = c("ndrangheta_narcos_spend_total", "Money paid to the narcos")
+        self.narcos_kg    = c("ndrangheta_narcos_kg_total", "Kgs of drugs bought from the narcos")
+        self.taxes        = c("ndrangheta_taxes_collected_total", "Money paid by local families as taxes")
+
+        self.wars_won      = c("ndrangheta_wars_won_total", "Wars won by the attacker")
+        self.wars_lost     = c("ndrangheta_wars_lost_total", "Wars lost by the attacker")
+        self.towns_changed = c("ndrangheta_town_owner_changes_total", "Towns that changed hands")
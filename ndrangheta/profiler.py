@@ -0,0 +1,162 @@
+"""
+Timing of the phases of a turn (town step, AI planning, requests,
+Dijkstra, narcos, shipment transit, wars), per family and per turn.
+
+    sim = Simulator(world, graph, profile=True)
+    sim.advance_time(turns=10)
+    print(sim.profiler.summary_table())
+    sim.profiler.save_chrome_trace("turns.json")   # chrome://tracing, Perfetto
+
+Off by default: world.profiler is then NO_PROFILER, whose spans do
+nothing. Spans nest (a "transit" span is inside the "family" span of its
+family), so the time of a phase includes the phases it contains. Spans
+recorded in forked planning workers (ai_executor="process") are lost.
+"""
+from typing import *
+import os
+import json
+import time
+import threading
+import functools
+from contextlib import nullcontext
+
+# A span: (phase, family, turn, thread, start, end), times in nanoseconds
+Span = Tuple[str, Union[int, None], Union[int, None], int, int, int]
+
+
+class _Timer:
+    __slots__ = ("profiler", "phase", "family", "start")
+
+    def __init__(self, profiler: "Profiler", phase: str, family):
+        self.profiler = profiler
+        self.phase    = phase
+        self.family   = family
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        p = self.profiler
+        turn = p.world.scheduler.now if p.world is not None else None
+        # list.append is atomic: planning threads share the profiler
+        p.spans.append((self.phase, self.family, turn, threading.get_ident(), self.start, end))
+        return False
+
+
+class Profiler:
+    enabled = True
+
+    def __init__(self, world: "World" = None):
+        self.world = world
+        self.spans: List[Span] = list()
+
+    def span(self, phase: str, family: "FamilyID" = None) -> ContextManager:
+        """
+        Times the `with` block as `phase`, done by `family` (if any).
+        """
+        return _Timer(self, phase, family)
+
+    def clear(self):
+        self.spans = list()
+
+    # =========================================================== #
+
+    def summary(self, by: Sequence[str] = ("phase",)) -> Dict[Tuple, Dict[str, float]]:
+        """
+        Calls, total, mean and max duration (seconds) of the spans grouped
+        by `by`, a subset of ("phase", "family", "turn").
+        """
+        fields = {"phase": 0, "family": 1, "turn": 2}
+        groups: Dict[Tuple, List[int]] = dict()
+        for span in self.spans:
+            key = tuple(span[fields[f]] for f in by)
+            groups.setdefault(key, list()).append(span[5] - span[4])
+
+        return {
+            key: {
+                "calls": len(durations),
+                "total": sum(durations) / 1e9,
+                "mean":  sum(durations) / len(durations) / 1e9,
+                "max":   max(durations) / 1e9,
+            }
+            for key, durations in groups.items()
+        }
+
+    def summary_table(self, by: Sequence[str] = ("phase",)) -> str:
+        """
+        summary() as text, slowest first.
+        """
+        rows = sorted(self.summary(by).items(), key=lambda kv: -kv[1]["total"])
+        header = "/".join(by)
+        width = max([len(header)] + [len(" ".join(map(str, key))) for key, _ in rows])
+
+        lines = [f"{header:<{width}} {'calls':>8} {'total s':>10} {'mean ms':>10} {'max ms':>10}"]
+        for key, s in rows:
+            name = " ".join(map(str, key))
+            lines.append(f"{name:<{width}} {s['calls']:>8} {s['total']:>10.4f} "
+                         f"{s['mean'] * 1e3:>10.3f} {s['max'] * 1e3:>10.3f}")
+        return "\n".join(lines)
+
+    def chrome_trace(self) -> Dict:
+        """
+        The spans as Chrome trace events ("X" complete events, microseconds).
+        """
+        pid = os.getpid()
+        t0 = min((s[4] for s in self.spans), default=0)
+        threads: Dict[int, int] = dict()
+
+        events = list()
+        for phase, family, turn, ident, start, end in self.spans:
+            tid = threads.setdefault(ident, len(threads))
+            events.append({
+                "name": phase, "cat": "turn" if phase == "turn" else "phase", "ph": "X",
+                "ts": (start - t0) / 1e3, "dur": (end - start) / 1e3,
+                "pid": pid, "tid": tid,
+                "args": {"turn": turn, "family": family},
+            })
+        for ident, tid in threads.items():
+            name = "main" if ident == threading.main_thread().ident else f"worker {tid}"
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                           "args": {"name": name}})
+
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save_chrome_trace(self, fpath: str):
+        with open(fpath, "w") as f:
+            json.dump(self.chrome_trace(), f)
+
+
+class NullProfiler(Profiler):
+    """
+    Records nothing; every span is the same do-nothing context manager.
+    """
+    enabled = False
+
+    _NULL_SPAN = nullcontext()
+
+    def span(self, phase: str, family: "FamilyID" = None) -> ContextManager:
+        return self._NULL_SPAN
+
+
+NO_PROFILER = NullProfiler()
+
+
+def profiled(phase: str, world: str = "w", family_arg: int = None):
+    """
+    Method decorator: times every call as `phase` with the profiler of
+    the world at attribute `world` of the instance; the family is the
+    positional argument at index `family_arg`, if given.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            profiler = getattr(self, world).profiler
+            if not profiler.enabled:
+                return method(self, *args, **kwargs)
+            family = args[family_arg] if family_arg is not None and family_arg < len(args) else None
+            with profiler.span(phase, family):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,17 +1,17 @@
 from typing import *
+import re
+import random
+import numpy as np
 import networkx as nx
-import matplotlib.pyplot as plt
 
 from ndrangheta.config import *
 from ndrangheta.entities import *
 from ndrangheta.world import World
 
-from networkx.drawing.nx_pydot import read_dot
-
 # =========================================================== #
 
 def sanitize_metanode(node: Dict) -> Dict:
-    node["money"] = int(node.get("money", 1_000_000))
+    node["money"] = int(node.get("money", FAMILY_MONEY))
     node["family"] = int(node["family"])
     node["is_player"] = node.get("player", "f") == "t"
     if "player" in node:
@@ -19,70 +19,25 @@ def sanitize_metanode(node: Dict) -> Dict:
     return node
 
     
-def load_graph(fpath="ndrangheta/example.dot"):
-    w = World()
-    g = nx.Graph(read_dot(fpath))
-
-    def convert_labels_to_int(g):
-        new_g = nx.Graph()
-        for n in g.nodes():
-            if n.isnumeric(): #nodes representing cities
-                new_g.add_node(int(n), **g.nodes()[n])
-                new_g.add_edge(int(n), int(n))
-            else: #metanodes
-                new_g.add_node(n, **g.nodes()[n])
-                
-        for (x,y) in g.edges():
-            new_g.add_edge(int(x), int(y))
-
-        return new_g
-    
-    g = convert_labels_to_int(g)
-
-    # =========================================================== #
-
-
-    def extract_metanodes(g) -> Dict:
-        out, to_remove = dict(), list()
-        
-        for n in g.nodes():
-            if isinstance(n, str):
-                d = sanitize_metanode(g.nodes()[n])
-                out[d["family"]] = d
-                to_remove.append(n)
-
-        g.remove_nodes_from(to_remove)
-        return out
-
-    metainfo: Dict["FamilyID", Dict] = extract_metanodes(g)
-
-    # =========================================================== #
+def sanitize_dot(node: Dict) -> Dict:
+    node["family"] = int(node.get("family", 0))
+    node["pop"]    = None if "pop" not in node else int(node["pop"]) * 1000
+    node["hold"]   = None if "hold" not in node else float(node["hold"])
+    node["drugs"]  = float(node.get("drugs", 0))
+    node["capital"] = node.get("capital", "f") == "t"
+    node["soldiers"] = int(node.get("soldiers", 0))
+    node["leader"] = int(node.get("leader", 1))
     
-    def map_nodes(f, g):
-        for name in g.nodes():
-            d = f(g.nodes()[name])
-            nx.set_node_attributes(g, d)
-
-    def sanitize_dot(node: Dict) -> Dict:
-        node["family"] = int(node.get("family", 0))
-        node["pop"]    = None if "pop" not in node else int(node["pop"]) * 1000
-        node["hold"]   = None if "hold" not in node else float(node["hold"])
-        node["drugs"]  = float(node.get("drugs", 0))
-        node["capital"] = node.get("capital", "f") == "t"
-        node["soldiers"] = int(node.get("soldiers", 0))
-        node["leader"] = int(node.get("leader", 1))
-        
-        return node
+    return node
 
-    map_nodes(sanitize_dot, g)
 
-    # =========================================================== #
-    
-    # TODO
-    # if Family.FAMILIES != dict() or Town.TOWNS != dict():
-    #     print("Polluted Family/Towns, resetting")
-    #     Family.FAMILIES = dict()
-    #     Town.TOWNS      = dict()
+def build_world(g: nx.Graph, metainfo: Dict["FamilyID", Dict], seed: int = None) -> World:
+    """
+    Creates Town() / Family() instances out of a graph whose nodes
+    have already been sanitized. With a `seed`, the world gets its own
+    random generator (see World.rng).
+    """
+    w = World(rng=None if seed is None else random.Random(seed))
     
     # Crea istanze Town() / Family()
     for n in g.nodes():
@@ -94,7 +49,6 @@ def load_graph(fpath="ndrangheta/example.dot"):
             if family_id not in metainfo:
                 metainfo[family_id] = sanitize_metanode({"family": family_id})
 
-            print(Family)
             if family_id == -1:
                 fam_obj = Police(-1, "Police",  metainfo[family_id], world=w)
             else:
@@ -120,4 +74,334 @@ def load_graph(fpath="ndrangheta/example.dot"):
         if f.capital is None:
             raise Exception(f"Family {f.id} has no capital!")
         
-    return (w, g)
+    return w
+
+# =========================================================== #
+
+class DotSyntaxError(Exception): pass
+
+TOKEN = re.compile(r"""
+    (?P<space>\s+|//[^\n]*|\#[^\n]*|/\*.*?\*/)
+  | (?P<edge>--|->)
+  | (?P<id>"(?:[^"\\]|\\.)*"|-?(?:\.[0-9]+|[0-9]+(?:\.[0-9]*)?)|[A-Za-z_\x80-\uffff][A-Za-z_0-9\x80-\uffff]*)
+  | (?P<punct>[{}\[\];,=:])
+""", re.VERBOSE | re.DOTALL)
+
+
+# Whole-line statements, as written by map generators: `0 -- 1` and
+# `0 [family=0, pop=10]`. Parsed without going through the tokenizer.
+FAST_EDGE = re.compile(r"\s*([0-9]+)\s*--\s*([0-9]+)\s*;?\s*$")
+FAST_NODE = re.compile(r'\s*([0-9]+|[A-Za-z_][A-Za-z_0-9]*)\s*\[([^\]\["<>/#]*)\]\s*;?\s*$')
+FAST_ATTRS = re.compile(r"""
+    \s*(?:(?:[A-Za-z_][A-Za-z_0-9]*)\s*=\s*(?:-?(?:\.[0-9]+|[0-9]+(?:\.[0-9]*)?)|[A-Za-z_][A-Za-z_0-9]*)\s*[,;]?\s*)*
+""", re.VERBOSE)
+FAST_ATTR = re.compile(r"([A-Za-z_][A-Za-z_0-9]*)\s*=\s*([^\s,;]+)")
+KEYWORDS = ("node", "edge", "graph", "digraph", "subgraph", "strict")
+
+
+def fast_statement(line: str) -> Optional[Tuple]:
+    """
+    ("edge", u, v) or ("node", name, attrs) if the line is one of the
+    simple statements above, None otherwise.
+    """
+    m = FAST_EDGE.match(line)
+    if m is not None:
+        return ("edge", m.group(1), m.group(2))
+
+    m = FAST_NODE.match(line)
+    if m is not None and m.group(1) not in KEYWORDS and FAST_ATTRS.fullmatch(m.group(2)):
+        return ("node", m.group(1), dict(FAST_ATTR.findall(m.group(2))))
+
+    return None
+
+
+def tokenize_dot(lines: Iterable[str]) -> Iterator[Tuple[str, str]]:
+    """
+    Yields (kind, text) tokens, reading the file one line at a time.
+    Quoted strings, HTML labels and /* */ comments may span lines.
+
+    Lines holding a whole simple statement (see fast_statement) are
+    yielded as a single ("stmt", parsed) token, when the previous token
+    cannot be continued by them.
+    """
+    buf = ""
+    depth = 0         # nesting of {}, 1 inside the graph body
+    last  = ("", "")  # last token yielded
+    pending = None    # fast statement, held until we know the next line does not continue it
+    for line in lines:
+        if pending is not None:
+            head = line.lstrip()[:1]
+            if head == "":
+                continue
+            if head in ("/", "#"):
+                buf += line
+                continue
+            if head in ("-", "[", "=", ","):
+                buf = pending[0] + buf
+            else:
+                last = ("punct", ";")
+                yield ("stmt", pending[1])
+            pending = None
+
+        if not buf and depth == 1 and (last[0] == "id" or last[1] in (";", "]", "{", "}")):
+            stmt = fast_statement(line)
+            if stmt is not None:
+                pending = (line, stmt)
+                continue
+
+        buf += line
+        pos = 0
+        while pos < len(buf):
+            if buf[pos] == "<": # HTML string, <...> with nested <>
+                nest, end = 0, pos
+                while end < len(buf):
+                    nest += {"<": 1, ">": -1}.get(buf[end], 0)
+                    end += 1
+                    if nest == 0:
+                        break
+                if nest != 0:
+                    break
+                last = ("id", buf[pos:end])
+                yield last
+                pos = end
+                continue
+
+            m = TOKEN.match(buf, pos)
+            if m is None:
+                break # incomplete, wait for the next line
+            if m.lastgroup != "space":
+                last = (m.lastgroup, m.group())
+                depth += {"{": 1, "}": -1}.get(last[1], 0)
+                yield last
+            pos = m.end()
+        buf = buf[pos:]
+
+    if pending is not None:
+        buf = pending[0] + buf
+
+    if buf.strip():
+        raise DotSyntaxError(f"Unexpected input: {buf[:40]!r}")
+
+
+def parse_dot(lines: Iterable[str]) -> Tuple[Dict[str, Dict], List[Tuple[str, str]]]:
+    """
+    Parses the DOT subset used by maps: node statements, edge chains whose
+    ends are nodes or {anonymous groups}, default attribute statements and
+    graph attributes (both ignored).
+
+    Returns the attributes of every node, ordered like networkx's pydot
+    reader orders them (declared nodes first, then nodes only seen in
+    edges), and the list of edges in file order.
+    """
+    tokens = tokenize_dot(lines)
+    peeked: List[Tuple[str, str]] = list()
+
+    def peek():
+        if not peeked:
+            peeked.append(next(tokens, ("eof", "")))
+        return peeked[0]
+
+    def take(expected=None):
+        tok = peek()
+        peeked.pop()
+        if expected is not None and tok[1] != expected:
+            raise DotSyntaxError(f"Expected {expected!r}, found {tok[1]!r}")
+        return tok
+
+    def name(text):
+        return text[1:-1] if text.startswith('"') else text
+
+    def attr_list() -> Dict[str, str]:
+        attrs = dict()
+        while peek()[1] == "[":
+            take("[")
+            while peek()[1] != "]":
+                key = name(take()[1])
+                take("=")
+                attrs[key] = take()[1]
+                if peek()[1] in (",", ";"):
+                    take()
+            take("]")
+        return attrs
+
+    def operand() -> List[str]:
+        if peek()[1] != "{":
+            return [name(take()[1])]
+        # anonymous group, eg. 0 -- {1 2}
+        take("{")
+        group = list()
+        while peek()[1] != "}":
+            kind, text = take()
+            if kind == "id":
+                group.append(name(text))
+        take("}")
+        return group
+
+    declared: Dict[str, Dict] = dict()
+    edge_only: Dict[str, Dict] = dict()
+    edges: List[Tuple[str, str]] = list()
+
+    # Header
+    if peek()[1] == "strict":
+        take()
+    if take()[1] not in ("graph", "digraph"):
+        raise DotSyntaxError("Not a DOT graph")
+    if peek()[1] != "{":
+        take()
+    take("{")
+
+    while peek()[1] != "}":
+        kind, text = peek()
+        if kind == "eof":
+            raise DotSyntaxError("Unexpected end of file")
+        if kind == "stmt":
+            take()
+            if text[0] == "edge":
+                edges.append((text[1], text[2]))
+                edge_only.setdefault(text[1], dict())
+                edge_only.setdefault(text[2], dict())
+            else:
+                declared.setdefault(text[1], dict()).update(text[2])
+            continue
+        if text in (";", ","):
+            take()
+            continue
+        if text in ("node", "edge", "graph"):
+            take()
+            attr_list()
+            continue
+        if text == "subgraph":
+            raise DotSyntaxError("Named subgraphs are not supported")
+
+        is_group = text == "{"
+        chain = [operand()]
+        if peek()[1] == "=": # graph attribute
+            take()
+            take()
+            continue
+        while peek()[0] == "edge":
+            take()
+            chain.append(operand())
+        attrs = attr_list()
+
+        if len(chain) == 1 and not is_group:
+            n = chain[0][0]
+            declared.setdefault(n, dict()).update(attrs)
+            continue
+
+        for src, dst in zip(chain, chain[1:]):
+            for u in src:
+                for v in dst:
+                    edges.append((u, v))
+        for group in chain:
+            for n in group:
+                edge_only.setdefault(n, dict())
+
+    take("}")
+
+    nodes = declared
+    for n in edge_only:
+        if n not in nodes:
+            nodes[n] = dict()
+
+    return nodes, edges
+
+
+def pydot_edge_order(nodes: List[str], edges: List[Tuple[str, str]]) -> Iterator[Tuple[str, str]]:
+    """
+    Edges in the order load_graph_pydot ends up inserting them, so that both
+    readers build the same adjacency (and Dijkstra breaks ties the same way).
+
+    nx.Graph(MultiGraph) and Graph.edges() both walk the nodes in order and
+    emit each edge from its earlier endpoint; pydot then adds them in turn.
+    That is, each edge once, from its earlier endpoint, grouped by that
+    endpoint in node order and by first appearance in the file within a
+    group: a sort of node positions, no adjacency needs to be built.
+    """
+    if not edges:
+        return
+    pos = {n: i for i, n in enumerate(nodes)}
+    u = np.fromiter((pos[a] for a, _ in edges), dtype=np.int64, count=len(edges))
+    v = np.fromiter((pos[b] for _, b in edges), dtype=np.int64, count=len(edges))
+    lo, hi = np.minimum(u, v), np.maximum(u, v)
+    del u, v
+
+    _, first = np.unique(lo * len(nodes) + hi, return_index=True)
+    order = first[np.lexsort((first, lo[first]))]
+    for i in range(0, len(order), 1 << 16): # Python ints, a chunk at a time
+        chunk = order[i:i + (1 << 16)]
+        for a, b in zip(lo[chunk].tolist(), hi[chunk].tolist()):
+            yield nodes[a], nodes[b]
+
+
+def load_graph(fpath="ndrangheta/example.dot", seed: int = None):
+    """
+    Reads a map, streaming the file once; towns are numeric nodes,
+    metanodes (family configurations) are the other ones. Edges are put
+    in pydot's order once the file is read, since it depends on the
+    order of nodes that may be declared after their edges.
+    """
+    with open(fpath) as f:
+        nodes, edges = parse_dot(f)
+
+    g, metainfo = nx.Graph(), dict()
+    for n, attrs in nodes.items():
+        if n.isnumeric(): #nodes representing cities
+            t = int(n)
+            g.add_node(t, **sanitize_dot(attrs))
+            g.add_edge(t, t)
+        else: #metanodes
+            d = sanitize_metanode(attrs)
+            metainfo[d["family"]] = d
+
+    g.add_edges_from((int(x), int(y)) for x, y in pydot_edge_order(list(nodes), edges))
+
+    return (build_world(g, metainfo, seed), g)
+
+    
+def load_graph_pydot(fpath="ndrangheta/example.dot", seed: int = None):
+    """
+    Reference reader going through pydot; slow, but it understands the
+    whole DOT language.
+    """
+    from networkx.drawing.nx_pydot import read_dot
+
+    g = nx.Graph(read_dot(fpath))
+
+    def convert_labels_to_int(g):
+        new_g = nx.Graph()
+        for n in g.nodes():
+            if n.isnumeric(): #nodes representing cities
+                new_g.add_node(int(n), **g.nodes()[n])
+                new_g.add_edge(int(n), int(n))
+            else: #metanodes
+                new_g.add_node(n, **g.nodes()[n])
+                
+        for (x,y) in g.edges():
+            new_g.add_edge(int(x), int(y))
+
+        return new_g
+    
+    g = convert_labels_to_int(g)
+
+    # =========================================================== #
+
+
+    def extract_metanodes(g) -> Dict:
+        out, to_remove = dict(), list()
+        
+        for n in g.nodes():
+            if isinstance(n, str):
+                d = sanitize_metanode(g.nodes()[n])
+                out[d["family"]] = d
+                to_remove.append(n)
+
+        g.remove_nodes_from(to_remove)
+        return out
+
+    metainfo: Dict["FamilyID", Dict] = extract_metanodes(g)
+
+    for n in g.nodes():
+        sanitize_dot(g.nodes()[n])
+
+    return (build_world(g, metainfo, seed), g)
@@ -0,0 +1,264 @@
+"""
+Map renderer for per-turn frames.
+
+The layout is computed once per map and cached next to the map file
+(<map>.layout.npz); each frame then only updates node colours, labels
+and the overlay of the shipments sent since the previous frame.
+
+    r = Renderer(sim, map_path="ndrangheta/example.dot")
+    sim.advance_time()
+    r.frame("turn-0001.png")
+"""
+from typing import *
+import os
+import hashlib
+import tempfile
+
+import numpy as np
+import networkx as nx
+
+from ndrangheta.csr import CSRGraph
+
+# Up to this many nodes the layout is networkx's spring layout, above it
+# pivot MDS (spring layout is quadratic in the number of nodes)
+SPRING_LIMIT = 500
+# Node labels (id and hold) are drawn only on maps up to this size
+LABEL_LIMIT  = 300
+# Bigger maps are rasterized in vector formats (SVG, PDF)
+RASTER_LIMIT = 5_000
+
+FAMILY_CMAP  = "Paired"
+POLICE_COLOR = (0.6, 0.6, 0.6, 1.0)
+
+# =========================================================== #
+
+def graph_digest(csr: CSRGraph) -> str:
+    h = hashlib.sha1()
+    for arr in (np.array(csr.ids, dtype=np.int64), csr.indptr, csr.indices):
+        h.update(arr.tobytes())
+    return h.hexdigest()
+
+
+def bfs_distances(csr: CSRGraph, source: int) -> np.ndarray:
+    """
+    Hop distance of every node from node index `source` (-1 if unreachable),
+    expanding a whole BFS level per numpy step.
+    """
+    dist = np.full(len(csr), -1, dtype=np.int64)
+    dist[source] = 0
+    frontier, d = np.array([source]), 0
+
+    while frontier.size:
+        starts, counts = csr.indptr[frontier], np.diff(csr.indptr)[frontier]
+        first = np.repeat(starts - np.cumsum(counts) + counts, counts)
+        nbrs = csr.indices[first + np.arange(counts.sum())]
+        nbrs = np.unique(nbrs[dist[nbrs] < 0])
+
+        d += 1
+        dist[nbrs] = d
+        frontier = nbrs
+    return dist
+
+
+def pivot_mds(csr: CSRGraph, pivots: int = 50, seed: int = 0) -> np.ndarray:
+    """
+    Pivot MDS (Brandes & Pich): classical MDS on the hop distances from a
+    few far apart pivot nodes. Linear in the size of the map.
+    """
+    n = len(csr)
+    k = min(pivots, n)
+    rng = np.random.default_rng(seed)
+
+    dists = np.empty((n, k))
+    closest = np.full(n, np.inf)
+    p = int(rng.integers(n))
+    for i in range(k):
+        d = bfs_distances(csr, p).astype(np.float64)
+        d[d < 0] = d.max() + 1 # other components
+        dists[:, i] = d
+        closest = np.minimum(closest, d)
+        p = int(closest.argmax())
+
+    sq = dists ** 2
+    c = sq - sq.mean(axis=0) - sq.mean(axis=1, keepdims=True) + sq.mean()
+    u, s, _ = np.linalg.svd(-0.5 * c, full_matrices=False)
+    return u[:, :2] * s[:2]
+
+
+def compute_layout(graph: nx.Graph, csr: CSRGraph = None, seed: int = 0) -> np.ndarray:
+    """
+    Position of every node, in graph.nodes() order, scaled into [0, 1].
+    """
+    csr = csr if csr is not None else CSRGraph(graph)
+    n = len(csr)
+    if n == 0:
+        return np.zeros((0, 2))
+
+    if n <= SPRING_LIMIT:
+        pos = nx.spring_layout(graph, seed=seed)
+        pos = np.array([pos[node] for node in csr.ids], dtype=np.float64)
+    else:
+        pos = pivot_mds(csr, seed=seed)
+
+    pos = pos - pos.min(axis=0)
+    return pos / max(pos.max(), 1e-12)
+
+
+def load_layout(graph: nx.Graph, cache: str = None, csr: CSRGraph = None, seed: int = 0) -> np.ndarray:
+    """
+    compute_layout(), read from / written to the `cache` file if given. A
+    cache computed for a different topology is ignored and overwritten.
+    """
+    csr = csr if csr is not None else CSRGraph(graph)
+    digest = graph_digest(csr)
+
+    if cache is not None and os.path.exists(cache):
+        with np.load(cache) as data:
+            if str(data["digest"]) == digest:
+                return data["pos"]
+
+    pos = compute_layout(graph, csr, seed)
+
+    if cache is not None:
+        # Batch runs may share the cache: write it atomically
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(cache)), suffix=".npz")
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, pos=pos, digest=np.array(digest))
+        os.replace(tmp, cache)
+
+    return pos
+
+
+def layout_cache_path(map_path: str) -> str:
+    return map_path + ".layout.npz"
+
+# =========================================================== #
+
+class Renderer:
+    """
+    Draws a simulator's map with matplotlib; artists are created once and
+    updated in place at every frame().
+    """
+    def __init__(self, sim: "Simulator", map_path: str = None, seed: int = 0,
+                 labels: bool = None, size: Tuple[float, float] = (10, 10), dpi: int = 100,
+                 interactive: bool = False):
+        from matplotlib.figure import Figure
+        from matplotlib.collections import LineCollection
+        from matplotlib import colormaps
+
+        self.sim = sim
+        self.csr = sim.router.csr
+        cache = None if map_path is None else layout_cache_path(map_path)
+        self.pos = load_layout(sim.router.graph, cache, self.csr, seed)
+
+        n = len(self.csr)
+        self.cmap = colormaps[FAMILY_CMAP]
+        self.dpi  = dpi
+
+        if interactive:
+            import matplotlib.pyplot as plt
+            self.fig = plt.figure(figsize=size)
+        else:
+            self.fig = Figure(figsize=size)
+        ax = self.ax = self.fig.add_axes([0, 0, 1, 1])
+        ax.set_axis_off()
+        ax.set_xlim(-0.02, 1.02)
+        ax.set_ylim(-0.02, 1.02)
+        rasterized = n > RASTER_LIMIT
+
+        # Edges never change
+        rows = np.repeat(np.arange(n), np.diff(self.csr.indptr))
+        keep = rows < self.csr.indices
+        segments = np.stack([self.pos[rows[keep]], self.pos[self.csr.indices[keep]]], axis=1)
+        ax.add_collection(LineCollection(segments, colors="0.75", linewidths=0.5,
+                                         zorder=1, rasterized=rasterized))
+
+        self.nodes = ax.scatter(self.pos[:, 0], self.pos[:, 1], s=max(1.0, min(300.0, 40_000 / max(n, 1))),
+                                zorder=2, linewidths=1.5, rasterized=rasterized)
+
+        self.shipments = LineCollection([], linewidths=2, zorder=3)
+        ax.add_collection(self.shipments)
+        self.sent: List[Tuple[List["TownID"], "FamilyID", bool]] = list()
+        sim.router.shipment_listeners.append(self.shipment_done)
+
+        self.labels = None
+        if labels if labels is not None else n <= LABEL_LIMIT:
+            self.labels = [
+                ax.text(x, y, "", fontsize=7, ha="center", va="center", zorder=4)
+                for x, y in self.pos
+            ]
+
+        self.family = None
+        self.hold   = None
+
+    # =========================================================== #
+
+    def shipment_done(self, ship: "Shipment", path: List["TownID"], last: "TownID"):
+        reached = path[:path.index(last) + 1] if last in path else path
+        self.sent.append((reached, ship.from_family, last != path[-1]))
+
+    def family_color(self, family_id: "FamilyID"):
+        return POLICE_COLOR if family_id == -1 else self.cmap(family_id % self.cmap.N)
+
+    def update(self):
+        """
+        Brings colours, capitals, labels and shipments up to date; only
+        the nodes whose owner or hold changed are touched.
+        """
+        w = self.sim.world
+        hold, family = self.csr.town_arrays(w)
+
+        if self.family is None:
+            changed = np.arange(len(family))
+            colors = np.zeros((len(family), 4))
+        else:
+            changed = np.flatnonzero(family != self.family)
+            colors = self.nodes.get_facecolors()
+        for i in changed.tolist():
+            colors[i] = self.family_color(family[i])
+        self.nodes.set_facecolors(colors)
+        self.family = family
+
+        edges = np.zeros((len(family), 4))
+        capitals = [self.csr.index[f.capital] for f in w.families.values() if f.capital in self.csr.index]
+        edges[capitals] = (0, 0, 0, 1)
+        self.nodes.set_edgecolors(edges)
+
+        if self.labels is not None:
+            rounded = np.round(hold, 2)
+            if self.hold is None:
+                changed = np.arange(len(hold))
+            else:
+                changed = np.flatnonzero(rounded != self.hold)
+            for i in changed.tolist():
+                self.labels[i].set_text(f"{self.csr.ids[i]}\n{rounded[i]:.2f}")
+            self.hold = rounded
+
+        segments, colors, styles = list(), list(), list()
+        for path, fid, captured in self.sent:
+            if len(path) < 2:
+                continue
+            segments.append(self.pos[[self.csr.index[t] for t in path]])
+            colors.append((0.8, 0, 0, 1) if captured else self.family_color(fid))
+            styles.append("dashed" if captured else "solid")
+        self.shipments.set_segments(segments)
+        self.shipments.set_colors(colors)
+        self.shipments.set_linestyles(styles or "solid")
+        self.sent = list()
+
+    def frame(self, fpath: str):
+        """
+        Writes the current map; the format follows the extension (png, svg...).
+        """
+        self.update()
+        self.ax.set_title(f"Turn {self.sim.turn}", loc="left", y=0.97, x=0.01)
+        self.fig.savefig(fpath, dpi=self.dpi)
+
+    def show(self):
+        import matplotlib.pyplot as plt
+
+        self.update()
+        plt.show()
+
+    def close(self):
+        self.sim.router.shipment_listeners.remove(self.shipment_done)
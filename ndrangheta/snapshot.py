@@ -0,0 +1,444 @@
+"""
+Binary snapshots of a running game: towns, local families, families,
+pending Schedule()s, graph topology, turn counter, random generator
+state, shipment ledger and journal of player commands.
+
+    save_snapshot(sim, "campaign.snap")
+    sim = load_snapshot("campaign.snap")
+
+Layout: MAGIC, version (uint32), header length (uint64), JSON header,
+then raw little-endian arrays aligned to ALIGN bytes, whose dtype, shape
+and offset are listed in the header. Town columns are memory-mapped
+(copy-on-write) on load, so resuming a big map does not read it whole.
+
+Pending tasks run by a LocalFamily (taxes) are stored as arrays; any
+other task is pickled, with world objects (towns, families, simulator...)
+stored by reference.
+"""
+from typing import *
+import os
+import io
+import gc
+import json
+import pickle
+import random
+import tempfile
+
+import numpy as np
+import networkx as nx
+
+from ndrangheta.engine import TOWN_COLUMNS, LOCAL_COLUMNS, TownState
+from ndrangheta.entities import Family, Police, LocalFamily, Town
+from ndrangheta.graph import Simulator, Command
+from ndrangheta.utils import Schedule
+from ndrangheta.world import World
+
+MAGIC   = b"NDRSNAP\0"
+VERSION = 1
+ALIGN   = 64
+
+class SnapshotError(Exception): pass
+
+# =========================================================== #
+
+class _Pickler(pickle.Pickler):
+    def __init__(self, f, sim: Simulator):
+        super().__init__(f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.sim = sim
+
+    def persistent_id(self, obj):
+        w = self.sim.world
+        if isinstance(obj, Town) and w.towns.get(obj.id) is obj:
+            return ("town", obj.id)
+        if isinstance(obj, LocalFamily) and w.towns.get(obj.town.id) is obj.town:
+            return ("local", obj.town.id)
+        if isinstance(obj, Family) and w.families.get(obj.id) is obj:
+            return ("family", obj.id)
+        if obj is w.ledger:
+            return ("ledger",)
+
+        for name in ("world", "router", "narcos", "ai"):
+            if obj is getattr(self.sim, name):
+                return (name,)
+        if obj is self.sim:
+            return ("simulator",)
+        return None
+
+
+class _Unpickler(pickle.Unpickler):
+    def __init__(self, f, sim: Simulator):
+        super().__init__(f)
+        self.sim = sim
+
+    def persistent_load(self, pid):
+        kind, *key = pid
+        if kind == "town":
+            return self.sim.world.Town(key[0])
+        if kind == "local":
+            return self.sim.world.Town(key[0]).local_family
+        if kind == "family":
+            return self.sim.world.Family(key[0])
+        if kind == "simulator":
+            return self.sim
+        if kind == "ledger":
+            return self.sim.world.ledger
+        return getattr(self.sim, kind)
+
+# =========================================================== #
+
+def _is_tax_task(owner, task: Schedule) -> bool:
+    # Tax tasks all run every entities.TAXES: the town is all there is to save
+    return isinstance(owner, LocalFamily) and task is owner
+
+
+def _town_arrays(w: World) -> Dict[str, np.ndarray]:
+    towns = list(w.towns.values())
+    n = len(towns)
+
+    arrays = {
+        "town_id":      np.fromiter((t.id for t in towns), dtype=np.int64, count=n),
+        "town_family":  np.fromiter((t.family.id for t in towns), dtype=np.int64, count=n),
+        "town_capital": np.fromiter((t.is_capital for t in towns), dtype=np.bool_, count=n),
+    }
+
+    state = w.state
+    if state is not None:
+        rows = np.fromiter((t._row for t in towns), dtype=np.int64, count=n)
+        in_order = bool((rows == np.arange(n)).all())
+        for name in TOWN_COLUMNS | LOCAL_COLUMNS:
+            col = state.column(name)
+            arrays[name] = col if in_order else col[rows]
+    else:
+        for name, dtype in TOWN_COLUMNS.items():
+            arrays[name] = np.array([getattr(t, name) for t in towns], dtype=dtype)
+        for name, dtype in LOCAL_COLUMNS.items():
+            arrays[name] = np.array([getattr(t.local_family, name) for t in towns], dtype=dtype)
+
+    return arrays
+
+
+def _graph_arrays(graph: nx.Graph) -> Dict[str, np.ndarray]:
+    """
+    Adjacency in CSR form, keeping the neighbour order of every node
+    (routing breaks ties following it).
+    """
+    nodes = list(graph.nodes())
+    index = {n: i for i, n in enumerate(nodes)}
+    indptr, indices = [0], []
+    for n in nodes:
+        indices.extend(index[m] for m in graph.adj[n])
+        indptr.append(len(indices))
+
+    return {
+        "graph_nodes":   np.array(nodes, dtype=np.int64),
+        "graph_indptr":  np.array(indptr, dtype=np.int64),
+        "graph_indices": np.array(indices, dtype=np.int64),
+    }
+
+
+def _ledger_arrays(w: World) -> Dict[str, np.ndarray]:
+    arrays = dict()
+    for prefix, table in (("ledger_ship_", w.ledger.ships), ("ledger_hop_", w.ledger.hops)):
+        for name in table.columns:
+            arrays[prefix + name] = table.column(name)
+    return arrays
+
+
+def save_snapshot(sim: Simulator, fpath: str):
+    """
+    Writes the whole game to `fpath`. The file is replaced atomically, so
+    a game loaded (memory-mapped) from the same path keeps working.
+    """
+    w = sim.world
+    sched = w.scheduler
+
+    arrays = _town_arrays(w) | _graph_arrays(sim.router.graph) | _ledger_arrays(w)
+
+    # Pending tasks, in order of execution
+    due, seq, kind, town = [], [], [], []
+    others = list()
+    for i, (d, owner, task) in enumerate(sched):
+        due.append(d)
+        seq.append(i)
+        if _is_tax_task(owner, task):
+            kind.append(0)
+            town.append(owner.town.id)
+        else:
+            kind.append(1)
+            town.append(-1)
+            others.append((i, owner, task))
+
+    arrays |= {
+        "task_due":  np.array(due, dtype=np.int64),
+        "task_seq":  np.array(seq, dtype=np.int64),
+        "task_kind": np.array(kind, dtype=np.int8),
+        "task_town": np.array(town, dtype=np.int64),
+    }
+
+    blob = io.BytesIO()
+    try:
+        _Pickler(blob, sim).dump(others)
+    except (pickle.PicklingError, AttributeError, TypeError) as e:
+        raise SnapshotError(f"Pending task can't be saved: {e}")
+    blob = blob.getvalue()
+
+    header = {
+        "version":   VERSION,
+        "turn":      sched.now,
+        "player_id": sim.player_id,
+        "options": {
+            "vectorized":    w.state is not None,
+            "single_source": sim.router.single_source,
+            "backend":       sim.router.backend,
+            "ai_workers":    sim.ai_workers,
+            "ai_executor":   sim.ai_executor,
+            "ai_risk":       sim.ai.risk_quantile,
+            "ai_routes":     sim.ai.routes,
+            "metrics_path":  sim.metrics_path,
+        },
+        "seed":        sim.seed,
+        "rng":         _rng_state(w.rng),
+        "journal":     [c.to_json() for c in sim.journal],
+        "highest_fid": w.highest_fid,
+        "families": [
+            {"id": f.id, "name": f.name, "money": f.money, "drugs": f.drugs,
+             "capital": f.capital, "police": isinstance(f, Police)}
+            for f in w.families.values()
+        ],
+        "town_names": {str(t.id): t.name for t in w.towns.values() if t.name},
+        "router": {
+            "shipped_kgs":   sim.router.shipped_kgs,
+            "delivered_kgs": sim.router.delivered_kgs,
+            "captured_kgs":  sim.router.captured_kgs,
+        },
+        "arrays": dict(),
+        "tasks": {"length": len(blob)},
+    }
+
+    # Offsets depend on the header length, which depends on the offsets:
+    # lay out the data after a header of fixed (padded) size.
+    sizes = {name: arr.nbytes for name, arr in arrays.items()}
+    header_len = ALIGN
+    while True:
+        offset = _align(len(MAGIC) + 12 + header_len)
+        for name, arr in arrays.items():
+            header["arrays"][name] = {"dtype": arr.dtype.newbyteorder("<").str, "shape": list(arr.shape), "offset": offset}
+            offset = _align(offset + sizes[name])
+        header["tasks"]["offset"] = offset
+
+        raw = json.dumps(header).encode()
+        if len(raw) <= header_len:
+            break
+        header_len = _align(len(raw))
+    raw = raw.ljust(header_len)
+
+    folder = os.path.dirname(os.path.abspath(fpath))
+    fd, tmp = tempfile.mkstemp(dir=folder, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC)
+            f.write(np.uint32(VERSION).tobytes())
+            f.write(np.uint64(header_len).tobytes())
+            f.write(raw)
+            for name, arr in arrays.items():
+                f.seek(header["arrays"][name]["offset"])
+                np.ascontiguousarray(arr, dtype=arr.dtype.newbyteorder("<")).tofile(f)
+            f.seek(header["tasks"]["offset"])
+            f.write(blob)
+        os.replace(tmp, fpath)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _rng_state(rng) -> List:
+    version, internal, gauss = rng.getstate()
+    return [version, list(internal), gauss]
+
+
+def _align(offset: int) -> int:
+    return -(-offset // ALIGN) * ALIGN
+
+# =========================================================== #
+
+def read_header(fpath: str) -> Dict:
+    with open(fpath, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise SnapshotError(f"{fpath} is not a snapshot")
+        version = int(np.frombuffer(f.read(4), dtype="<u4")[0])
+        if version != VERSION:
+            raise SnapshotError(f"Snapshot version {version} not supported (expected {VERSION})")
+        header_len = int(np.frombuffer(f.read(8), dtype="<u8")[0])
+        return json.loads(f.read(header_len))
+
+
+def load_snapshot(fpath: str, mmap=True) -> Simulator:
+    """
+    Rebuilds the Simulator saved in `fpath`. With `mmap`, the town columns
+    of a vectorized game stay backed by the file (copy-on-write).
+    """
+    header = read_header(fpath)
+
+    def array(name, mapped=False):
+        a = header["arrays"][name]
+        dtype, shape = np.dtype(a["dtype"]), tuple(a["shape"])
+        if mapped and mmap and int(np.prod(shape)) > 0:
+            return np.memmap(fpath, dtype=dtype, mode="c", offset=a["offset"], shape=shape)
+        return np.fromfile(fpath, dtype=dtype, count=int(np.prod(shape)), offset=a["offset"]).reshape(shape)
+
+    # Hundreds of thousands of objects are created below and none of them
+    # is garbage: don't let the cyclic collector walk them over and over
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        options = header["options"]
+
+        # The game goes on with its own generator even if it was using the
+        # global random module
+        rng = random.Random()
+        version, internal, gauss = header["rng"]
+        rng.setstate((version, tuple(internal), gauss))
+        w = World(rng=rng)
+
+        for attrs in header["families"]:
+            cls = Police if attrs["police"] else Family
+            f = cls(attrs["id"], attrs["name"], {"money": attrs["money"]}, world=w)
+            f.drugs   = attrs["drugs"]
+            f.capital = attrs["capital"]
+            w.add_family(f)
+        w.highest_fid = header["highest_fid"]
+
+        _load_towns(w, header, array, options["vectorized"])
+
+        _load_ledger(w, header, array)
+
+        graph = _build_graph(array("graph_nodes"), array("graph_indptr"), array("graph_indices"))
+        nx.set_node_attributes(graph, {t.id: t.family.id for t in w.towns.values()}, "family")
+
+        sim = Simulator(w, graph, single_source=options["single_source"],
+                        backend=options["backend"], player_id=header["player_id"],
+                        ai_workers=options.get("ai_workers"), ai_executor=options.get("ai_executor", "thread"),
+                        ai_risk=options.get("ai_risk"), ai_routes=options.get("ai_routes", 1),
+                        metrics_path=options.get("metrics_path"))
+        for name, value in header["router"].items():
+            setattr(sim.router, name, value)
+        sim.seed    = header["seed"]
+        sim.journal = [Command.from_json(row) for row in header["journal"]]
+
+        with open(fpath, "rb") as f:
+            f.seek(header["tasks"]["offset"])
+            others = _Unpickler(io.BytesIO(f.read(header["tasks"]["length"])), sim).load()
+        _load_tasks(w, header, array, others)
+    finally:
+        if enabled:
+            gc.enable()
+
+    return sim
+
+
+def _load_towns(w: World, header: Dict, array: Callable, vectorized: bool):
+    """
+    Towns and local families, without going through __init__ (which would
+    draw random numbers and schedule taxes again).
+    """
+    ids      = array("town_id").tolist()
+    families = list(map(w.families.__getitem__, array("town_family").tolist()))
+    capitals = array("town_capital").tolist()
+    n        = len(ids)
+
+    state = None
+    if vectorized:
+        state = TownState(capacity=1)
+        state.columns = {name: array(name, mapped=True) for name in TOWN_COLUMNS | LOCAL_COLUMNS}
+        state.ids     = np.asarray(ids, dtype=np.int64)
+        state.size    = n
+        state.families = list(w.families.values())
+        state.family_index = {id(f): i for i, f in enumerate(state.families)}
+        state.family = np.fromiter((state.family_index[id(f)] for f in families), dtype=np.int64, count=n)
+        state.world = w
+        w.state = state
+
+    towns = list()
+    for row, (tid, fam, cap) in enumerate(zip(ids, families, capitals)):
+        t  = Town.__new__(Town)
+        lf = LocalFamily.__new__(LocalFamily)
+        t.world, t.id, t.family, t.is_capital, t.name, t.local_family = w, tid, fam, cap, "", lf
+        lf.parent, lf.town = fam, t
+        if state is not None:
+            t._state,  t._row  = state, row
+            lf._state, lf._row = state, row
+        else:
+            t._state,  t._row  = None, None
+            lf._state, lf._row = None, None
+        towns.append(t)
+
+    if state is None:
+        # Slot setters, bypassing the Column descriptors
+        for name in TOWN_COLUMNS:
+            set_ = getattr(Town, "_" + name).__set__
+            for t, v in zip(towns, array(name).tolist()):
+                set_(t, v)
+        for name in LOCAL_COLUMNS:
+            set_ = getattr(LocalFamily, "_" + name).__set__
+            for t, v in zip(towns, array(name).tolist()):
+                set_(t.local_family, v)
+
+    w.towns = dict(zip(ids, towns))
+    for tid, name in header["town_names"].items():
+        w.towns[int(tid)].name = name
+    for tid, fam in zip(ids, families):
+        w.family_towns.setdefault(fam.id, set()).add(tid)
+
+
+def _load_ledger(w: World, header: Dict, array: Callable):
+    """
+    Snapshots written before the ledger existed load with an empty one.
+    """
+    for prefix, table in (("ledger_ship_", w.ledger.ships), ("ledger_hop_", w.ledger.hops)):
+        names = [prefix + name for name in table.columns]
+        if not all(name in header["arrays"] for name in names):
+            continue
+        for name, full in zip(list(table.columns), names):
+            table.columns[name] = array(full).astype(table.columns[name].dtype)
+        table.size = len(table.columns[name])
+
+
+def _build_graph(nodes: np.ndarray, indptr: np.ndarray, indices: np.ndarray) -> nx.Graph:
+    """
+    Fills the adjacency by hand, as add_edge() can't reproduce every
+    neighbour order; both directions of an edge share one attribute dict.
+    """
+    g = nx.Graph()
+    g.add_nodes_from(nodes.tolist())
+
+    # Number every undirected edge once, then give each its dict
+    rows = np.repeat(np.arange(len(nodes)), np.diff(indptr))
+    key = np.minimum(rows, indices) * len(nodes) + np.maximum(rows, indices)
+    _, edge = np.unique(key, return_inverse=True)
+    datas = [dict() for _ in range(edge.max() + 1)] if len(edge) else []
+
+    names, bounds = nodes[indices].tolist(), indptr.tolist()
+    datas = list(map(datas.__getitem__, edge.tolist()))
+
+    adj = g._adj
+    for i, u in enumerate(nodes.tolist()):
+        adj[u] = dict(zip(names[bounds[i]:bounds[i+1]], datas[bounds[i]:bounds[i+1]]))
+    return g
+
+
+def _load_tasks(w: World, header: Dict, array: Callable, others: List):
+    sched = w.scheduler
+    sched.now = header["turn"]
+    others = {i: (owner, task) for i, owner, task in others}
+
+    due, kind, town = array("task_due"), array("task_kind").tolist(), array("task_town").tolist()
+    order = np.lexsort((array("task_seq"), due)).tolist()
+    due = due.tolist()
+    for i in order:
+        if kind[i] == 0:
+            lf = w.towns[town[i]].local_family
+            owner, task = lf, lf
+        else:
+            owner, task = others[i]
+        sched._push(due[i], owner, task)
@@ -1,15 +1,50 @@
 from typing import *
+import sys
+import logging
 from random import random
 from random import shuffle as shuffle_1
 from dataclasses import dataclass
-from networkx import draw
-from matplotlib.pyplot import show as show_
 
-def montecarlo(threshold: float) -> bool:
+# Simulation messages (shipments, taxes, AI choices, wars). Headless by
+# default: nothing is formatted nor written until console() is called.
+log = logging.getLogger("ndrangheta")
+log.setLevel(logging.WARNING)
+log.propagate = False
+log.addHandler(logging.NullHandler())
+
+INFO, DEBUG = logging.INFO, logging.DEBUG
+
+def console(level=DEBUG, stream=None):
+    """
+    Writes simulation messages of `level` and above to `stream` (stdout).
+    """
+    from ndrangheta.config import setup_locale
+    setup_locale()
+
+    handler = logging.StreamHandler(stream if stream is not None else sys.stdout)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    for h in list(log.handlers):
+        log.removeHandler(h)
+    log.addHandler(handler)
+    log.setLevel(level)
+
+
+def headless():
+    """
+    Silences simulation messages again.
+    """
+    for h in list(log.handlers):
+        log.removeHandler(h)
+    log.addHandler(logging.NullHandler())
+    log.setLevel(logging.WARNING)
+
+# =========================================================== #
+
+def montecarlo(threshold: float, rng=None) -> bool:
     """ 
-    Montecarlo random draw.
+    Montecarlo random draw; `rng` defaults to the global random module.
     """
-    return random() > threshold
+    return (rng.random() if rng is not None else random()) > threshold
 
 
 def cap(value, low, high):
@@ -28,6 +63,8 @@ def show(g, show=True, save=False, fpath=None):
     Shows a graph.
     """
     import matplotlib.pyplot as plt
+    from networkx import draw
+
     f = plt.figure()
 
     n_colors = [
@@ -37,15 +74,60 @@ def show(g, show=True, save=False, fpath=None):
     draw(g, with_labels=True, cmap="Paired", node_color=n_colors)
 
     if show:
-        show_()
+        plt.show()
     if save:
         f.savefig(fpath)
 
 
-def shuffle(l: List):
-    shuffle_1(l)
+def shuffle(l: List, rng=None):
+    if rng is not None:
+        rng.shuffle(l)
+    else:
+        shuffle_1(l)
     return l
 
+
+_UNSET = object()
+
+class Column:
+    """
+    Attribute kept on the instance until a TownState is attached; from
+    then on reads and writes go to the corresponding array of the state.
+
+    Writes to a `watched` column that actually change its value are
+    reported to the owner's world (see World.town_changed); writes to an
+    `exported` one mark it as changed for the next graph sync (see
+    World.touch).
+    """
+    def __init__(self, watched=False, exported=False):
+        self.watched  = watched
+        self.exported = exported
+
+    def __set_name__(self, owner, name):
+        self.name    = name
+        self.private = "_" + name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        if obj._state is None:
+            return getattr(obj, self.private)
+        return obj._state.columns[self.name].item(obj._row)
+
+    def __set__(self, obj, value):
+        if self.watched and obj.world is not None and obj.world.town_listeners:
+            # Unset while the entity is being built: nothing changed yet
+            old = getattr(obj, self.private, _UNSET) if obj._state is None else self.__get__(obj)
+            if old is not _UNSET and old != value:
+                obj.world.town_changed(obj.id)
+        if self.exported and obj.world is not None and obj.world.dirty is not None:
+            obj.world.touch(obj.id, self.name)
+
+        if obj._state is None:
+            setattr(obj, self.private, value)
+        else:
+            obj._state.columns[self.name][obj._row] = value
+
 # =========================================================== #
 
 class GenericMafiaException(Exception): pass
@@ -68,20 +150,90 @@ class In(When):
 
 @dataclass
 class Every(When):
-    turn: int
-    countdown: int
+    turn: int      #periodo
+    countdown: int #turni prima della prima esecuzione
     
 class Schedule:
+    __slots__ = ("func", "args", "when", "kwargs")
+
     def __init__(self, func: Callable, when: When, *args, **kwargs):
         self.func = func
         self.args = args
         self.when = when
-        self.kwargs = kwargs
+        self.kwargs = kwargs or None # an empty dict per task adds up
 
     def __call__(self):
+        if self.kwargs is None:
+            return self.func(*self.args)
         return self.func(*self.args, **self.kwargs)
-    
-    
 
-    
+
+class Scheduler:
+    """
+    Simulator-wide calendar of Schedule()s: the (owner, task) due in a
+    turn, in the order they were scheduled, for every turn.
+
+    Each turn only takes the tasks that are due; an Every() task is put
+    back `turn` turns later instead of being counted down.
+    """
+    def __init__(self):
+        self.now = 0
+        self.calendar: Dict[int, List[Tuple[Any, Schedule]]] = dict()
+
+    def __len__(self):
+        return sum(map(len, self.calendar.values()))
+
+    def __iter__(self) -> Iterator[Tuple[int, Any, Schedule]]:
+        """
+        (due turn, owner, task) of every pending task, in order of execution.
+        """
+        for due in sorted(self.calendar):
+            for owner, task in self.calendar[due]:
+                yield due, owner, task
+
+    def due_turn(self, when: When) -> int:
+        if isinstance(when, Every):
+            return self.now + when.countdown
+        return self.now + when.turn
+
+    def schedule(self, task: Schedule, owner: Any = None):
+        """
+        `owner` tells the simulator when to run the task (see Simulator.advance_time).
+        """
+        self._push(self.due_turn(task.when), owner, task)
+
+    def _push(self, due: int, owner: Any, task: Schedule):
+        self.calendar.setdefault(due, []).append((owner, task))
+
+    def reassign(self, owner: Any, new_owner: Any, keep: Callable[[Schedule], bool]) -> List[Schedule]:
+        """
+        Gives the pending tasks of `owner` that `keep` accepts to
+        `new_owner`, at the same turn; drops and returns the others.
+        """
+        dropped = list()
+        for due, tasks in self.calendar.items():
+            moved = list()
+            for o, task in tasks:
+                if o is not owner:
+                    moved.append((o, task))
+                elif keep(task):
+                    moved.append((new_owner, task))
+                else:
+                    dropped.append(task)
+            self.calendar[due] = moved
+        return dropped
+
+    def advance(self) -> List[Tuple[Any, Schedule]]:
+        """
+        Moves to the next turn; returns (owner, task) for the tasks due in it.
+        """
+        self.now += 1
+
+        due = list()
+        for turn in sorted(t for t in self.calendar if t <= self.now):
+            for owner, task in self.calendar.pop(turn):
+                if isinstance(task.when, Every):
+                    self._push(self.now + task.when.turn, owner, task)
+                due.append((owner, task))
+        return due
 
@@ -1,18 +1,111 @@
 from typing import *
+import random
+import weakref
+from ndrangheta.utils import Scheduler
+from ndrangheta.ledger import ShipmentLedger
+from ndrangheta.profiler import NO_PROFILER
+from ndrangheta.metrics import SimulationMetrics
 
 class World:
-    def __init__(self):
+    def __init__(self, rng: random.Random = None):
         self.towns = dict()
         self.families = dict()
+        self.family_towns: Dict["FamilyID", Set["TownID"]] = dict()
         self.highest_fid: "FamilyID" = 0
+
+        # Every pending Schedule() of the world, and the turn counter
+        self.scheduler = Scheduler()
+
+        # Called with (TownID, owner_changed) whenever hold or owner of a town
+        # changes; held weakly, see add_town_listener()
+        self.town_listeners: List[weakref.WeakMethod] = list()
+
+        # Source of every random draw of the game: the global random
+        # module, unless a (seeded) generator is given
+        self.rng = rng if rng is not None else random
+
+        # TownID -> exported fields (Town.EXPORTED) changed since the last
+        # Simulator.update_graph; None until the first sync, which exports
+        # every town, so that games never rendered don't pay for tracking
+        self.dirty: Dict["TownID", Set[str]] = None
+
+        # Optional struct-of-arrays storage, see attach_state()
+        self.state: "TownState" = None
+
+        # Every shipment sent, and its hops
+        self.ledger = ShipmentLedger(self)
+
+        # Timing of the phases of a turn, see Simulator(profile=True)
+        self.profiler = NO_PROFILER
+
+        # Counters and histograms of the game, see metrics
+        self.metrics = SimulationMetrics()
         
     def add_town(self, t: "Town"):
         self.towns[t.id] = t
+        self.family_towns.setdefault(t.family.id, set()).add(t.id)
+        if self.state is not None:
+            self.state.attach(t)
+        if self.dirty is not None:
+            self.dirty[t.id] = set(t.EXPORTED)
+
+    def attach_state(self) -> "TownState":
+        """
+        Moves the numeric state of every town into a TownState; Town and
+        LocalFamily objects keep working as views over it.
+        """
+        from ndrangheta.engine import TownState
+
+        if self.state is None:
+            self.state = TownState.from_towns(self.towns.values())
+            self.state.world = self
+        return self.state
+
+    def add_town_listener(self, method: Callable[["TownID", bool], None]):
+        """
+        Calls the bound `method` on every change of hold or owner, for as
+        long as its object lives: the world does not keep it alive.
+        """
+        self.town_listeners.append(weakref.WeakMethod(method))
+
+    def remove_town_listener(self, method: Callable[["TownID", bool], None]):
+        self.town_listeners = [ref for ref in self.town_listeners if ref() not in (None, method)]
+
+    def town_changed(self, t_id: "TownID", owner=False):
+        dead = False
+        for ref in self.town_listeners:
+            listener = ref()
+            if listener is None:
+                dead = True
+            else:
+                listener(t_id, owner)
+        if dead:
+            self.town_listeners = [ref for ref in self.town_listeners if ref() is not None]
+
+    def touch(self, t_id: "TownID", field: str):
+        if self.dirty is not None:
+            self.dirty.setdefault(t_id, set()).add(field)
 
     def add_family(self, f: "Family"):
         self.families[f.id] = f
         self.highest_fid = max(f.id, self.highest_fid)
 
+    def remove_family(self, f_id: "FamilyID"):
+        """
+        Forgets a family; its towns must then be moved to other families.
+        """
+        del self.families[f_id]
+
+    def move_town(self, t_id: "TownID", old_fid: "FamilyID", new_fid: "FamilyID"):
+        """
+        Keeps the family -> towns index in sync after a change of ownership.
+        """
+        old = self.family_towns[old_fid]
+        old.discard(t_id)
+        if not old:
+            del self.family_towns[old_fid]
+        self.family_towns.setdefault(new_fid, set()).add(t_id)
+
     def Family(self, f_id: "FamilyID"):
         return self.families[f_id]
 
@@ -20,7 +113,7 @@ class World:
         return self.towns[t_id]
 
     def towns_of_family(self, f_id: "FamilyID"):
-        return [t for t in self.towns.values() if t.family.id == f_id]
+        return [self.towns[tid] for tid in self.family_towns.get(f_id, ())]
 
     def print_cities(self, family_id, exclude_others=False):
         for tid, t in self.towns.items():
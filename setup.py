@@ -25,11 +25,11 @@ setup(
     classifiers=[
         "License :: OSI Approved :: GNU General Public License v3 (GPLv3)",
         "Development Status :: 2 - Pre-Alpha",
-        "Programming Language :: Python :: 3.9",
+        "Programming Language :: Python :: 3.10",
     ],
     packages=find_packages(),
     install_requires=[
-        "networkx", "matplotlib", 
+        "networkx", "matplotlib", "numpy",
         # external libraries to automatically download before a pip-install
     ],
     include_package_data=True, #TODO?
@@ -40,7 +40,8 @@ setup(
     entry_points={
         "console_scripts": [
             "moder-mafia=ndrangheta.graph:play",
+            "moder-mafia-batch=ndrangheta.batch:main",
         ]
     },
-    python_requires='>=3.9',
+    python_requires='>=3.10',
 )
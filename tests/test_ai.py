@@ -24,7 +24,100 @@ class TestSafePathGraph(unittest.TestCase):
             proposals_0
         )
 
+    def test_dry_capital(self):
+        w, g = load_graph("tests/dots/simple.dot")
+        sim = Simulator(w, g, player_id=None)
+        w.Town(2).drugs = 0
+        money = w.Family(0).money
+
+        # Nothing to buy and nothing in stock: the requests are skipped
+        sim.ai.commit_shipments(0, [(Request(0, 1), [[2, 0, 1]]), (Request(0, 0), None)])
+        self.assertEqual(sim.router.shipped_kgs, 0)
+        self.assertEqual(w.Family(0).money, money)
+
+        sim.ai.commit_shipments(0, [(Request(3, 1), [[2, 0, 1]])])
+        self.assertEqual(sim.router.shipped_kgs, 3)
+
         
 
         
         
+
+class TestParallelPlanning(unittest.TestCase):
+    def play(self, **options):
+        from ndrangheta.generate import generate_world
+
+        w, g = generate_world(400, n_families=8, seed=3, drugs=(0, 10))
+        sim = Simulator(w, g, player_id=None, seed=3, **options)
+        sim.advance_time(turns=6)
+        return sim
+
+    def state(self, sim):
+        w = sim.world
+        return (
+            [(t.family.id, t.hold, t.drugs) for t in w.towns.values()],
+            [(f.money, f.drugs) for f in w.families.values()],
+            sim.router.shipped_kgs, sim.router.captured_kgs,
+        )
+
+    def test_plans_are_read_only(self):
+        sim = self.play()
+        before = self.state(sim)
+        for fid in sim.world.families:
+            for r, paths in sim.ai.plan_shipments(fid):
+                self.assertEqual(len(paths), 1)
+                self.assertEqual(paths[0][0], sim.world.Family(fid).capital)
+                self.assertEqual(paths[0][-1], r.author)
+        self.assertEqual(self.state(sim), before)
+
+    def test_same_game_with_any_number_of_workers(self):
+        games = [
+            self.play(ai_workers=1),
+            self.play(ai_workers=4),
+            self.play(ai_workers=2, ai_executor="process"),
+        ]
+        self.assertGreater(games[0].router.shipped_kgs, 0)
+        for sim in games[1:]:
+            self.assertEqual(self.state(sim), self.state(games[0]))
+
+    def test_processes_keep_routes(self):
+        # Routes cached while planning are reused by later turns: forked
+        # planners must leave the same ones as threads
+        from ndrangheta.generate import generate_world
+
+        def play(turns, **options):
+            w, g = generate_world(900, n_families=8, seed=5, drugs=(0, 10))
+            sim = Simulator(w, g, player_id=None, seed=5, ai_workers=2, **options)
+            sim.advance_time(turns=turns)
+            return sim
+
+        for turns, options in ((8, {}), (3, {"ai_routes": 2})):
+            threads, processes = play(turns, **options), play(turns, ai_executor="process", **options)
+            self.assertGreater(len(threads.router.cache) + len(threads.router.cache.alternatives), 0)
+            self.assertEqual(self.state(processes), self.state(threads))
+            for sim in (threads, processes):
+                self.assertEqual(sim.world.metrics.dijkstra.value, sim.router.cache.misses)
+            for name in ("routes", "alternatives"):
+                # Strategies by name: each router has its own bound methods
+                entries = [{k[:3] + (k[3].__name__,) + k[4:]: v for k, v in getattr(sim.router.cache, name).items()}
+                           for sim in (threads, processes)]
+                self.assertEqual(entries[1], entries[0])
+            self.assertEqual((processes.router.cache.hits, processes.router.cache.misses),
+                             (threads.router.cache.hits, threads.router.cache.misses))
+
+    def test_threads_keep_counts(self):
+        # Every cache miss is one Dijkstra, whichever thread ran it
+        for options in ({"ai_workers": 8}, {"ai_workers": 8, "backend": "csr", "ai_routes": 2}):
+            sim = self.play(**options)
+            self.assertGreater(sim.router.cache.misses, 0)
+            self.assertEqual(sim.world.metrics.dijkstra.value, sim.router.cache.misses)
+
+    def test_spread_over_routes(self):
+        sim = self.play(ai_routes=3)
+        self.assertGreater(sim.router.shipped_kgs, 0)
+        plans = [paths for fid in sim.world.families for _, paths in sim.ai.plan_shipments(fid)]
+        self.assertTrue(any(len(paths) > 1 for paths in plans))
+        self.assertTrue(all(len(paths) <= 3 for paths in plans))
+
+        self.assertEqual(self.state(self.play(ai_routes=3, ai_workers=1)),
+                         self.state(self.play(ai_routes=3, ai_workers=2, ai_executor="process")))
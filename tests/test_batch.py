@@ -0,0 +1,18 @@
+import unittest
+
+from ndrangheta.batch import run_batch, parse_seeds
+
+class TestBatch(unittest.TestCase):
+    def test_parse_seeds(self):
+        self.assertEqual(parse_seeds(["3", "5-7"]), [3, 5, 6, 7])
+
+    def test_same_seed_same_game(self):
+        g1, g2, g3 = run_batch("ndrangheta/example.dot", 10, [4, 4, 5], jobs=1)
+
+        for g in (g1, g2, g3):
+            self.assertNotIn("error", g)
+            self.assertEqual(g["turns_played"], 10)
+            
+        del g1["wall_time"], g2["wall_time"]
+        self.assertEqual(g1, g2)
+        self.assertEqual(sum(f["towns"] for f in g3["families"].values()), 9)
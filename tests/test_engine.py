@@ -0,0 +1,73 @@
+import unittest
+import random
+
+from ndrangheta.graph import *
+from ndrangheta.read_dot import load_graph
+
+class TestTownState(unittest.TestCase):
+    def two_worlds(self, fpath, seed=0):
+        random.seed(seed)
+        w1, g1 = load_graph(fpath)
+        random.seed(seed)
+        w2, g2 = load_graph(fpath)
+        w2.attach_state()
+        return w1, w2
+
+    def assertSameTowns(self, w1, w2):
+        for tid, t1 in w1.towns.items():
+            t2 = w2.Town(tid)
+            self.assertAlmostEqual(t1.hold, t2.hold)
+            self.assertAlmostEqual(t1.drugs, t2.drugs)
+            self.assertAlmostEqual(t1.local_family.money, t2.local_family.money)
+
+        for fid, f1 in w1.families.items():
+            self.assertAlmostEqual(f1.money, w2.Family(fid).money)
+            self.assertAlmostEqual(f1.drugs, w2.Family(fid).drugs)
+
+    def test_towns_are_views(self):
+        _, w = self.two_worlds("tests/dots/two_nodes.dot")
+        t = w.Town(0)
+
+        t.drugs = 42
+        t.local_family.soldiers = 3
+        self.assertEqual(w.state.column("drugs")[t._row], 42)
+        self.assertEqual(w.state.column("soldiers")[t._row], 3)
+
+        w.state.column("hold")[t._row] = 0.66
+        self.assertAlmostEqual(t.hold, 0.66)
+
+    def test_same_results_as_per_object_turns(self):
+        w1, w2 = self.two_worlds("tests/dots/simple.dot")
+
+        # Plenty of drugs, a few days of drugs, no drugs at all
+        for w in (w1, w2):
+            for tid, t in w.towns.items():
+                t.drugs = [0, 10, 0.1, 2][tid % 4]
+
+        for _ in range(10):
+            for t in w1.towns.values():
+                t.advance_turn()
+            w2.state.sell_daily_doses()
+
+            self.assertSameTowns(w1, w2)
+
+    def test_same_results_in_simulator(self):
+        random.seed(3)
+        w1, g1 = load_graph("tests/dots/two_nodes.dot")
+        s1 = Simulator(w1, g1)
+        s1.advance_time(turns=12)
+
+        random.seed(3)
+        w2, g2 = load_graph("tests/dots/two_nodes.dot")
+        s2 = Simulator(w2, g2, vectorized=True)
+        s2.advance_time(turns=12)
+
+        self.assertSameTowns(w1, w2)
+
+    def test_ownership_change_is_seen_by_the_state(self):
+        w, g = load_graph("tests/dots/war-scenario-1.dot")
+        s = Simulator(w, g, vectorized=True)
+        s.declare_war(0, 0, 4)
+
+        row = w.Town(4)._row
+        self.assertIs(w.state.families[w.state.family[row]], w.Family(0))
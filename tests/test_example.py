@@ -1,5 +1,7 @@
 import unittest
 import random
+import gc
+import weakref
 
 from ndrangheta.graph import *
 from ndrangheta.read_dot import load_graph
@@ -52,6 +54,158 @@ class TestSafePathGraph(unittest.TestCase):
             [0,7,6]
         )
 
+    def test_route_cache(self):
+        w,g = load_graph("tests/dots/simple.dot")
+        r = Routing(w,g)
+
+        path = r.automatic_path(7, 4, r.safest_path_heuristic)
+        self.assertEqual(r.automatic_path(7, 4, r.safest_path_heuristic), path)
+        self.assertEqual((r.cache.hits, r.cache.misses), (1, 1))
+
+        # Town off the path: still cached
+        w.Town(8).hold = 0.51
+        r.automatic_path(7, 4, r.safest_path_heuristic)
+        self.assertEqual(r.cache.hits, 2)
+
+        # Town on the path: recomputed
+        w.Town(3).hold = 0.99
+        r.automatic_path(7, 4, r.safest_path_heuristic)
+        self.assertEqual(r.cache.misses, 2)
+
+        w.Town(6).change_ownership(w.Family(0))
+        self.assertEqual(len(r.cache), 0)
+
+    def test_routings_do_not_pile_up(self):
+        w, g = load_graph("tests/dots/simple.dot")
+        old = Simulator(w, g)
+        ref = weakref.ref(old.router)
+        del old
+        gc.collect()
+
+        # The world does not keep the first routing alive...
+        r = Simulator(w, g).router
+        self.assertIsNone(ref())
+        w.Town(3).hold = 0.99
+        self.assertEqual(len(w.town_listeners), 1)
+
+        # ...nor one closed
+        r.automatic_path(7, 4, r.safest_path_heuristic)
+        r.close()
+        w.Town(3).hold = 0.98
+        self.assertEqual(len(w.town_listeners), 0)
+        self.assertEqual(len(r.cache), 1)
+
+    def test_new_town_while_routing(self):
+        w, g = load_graph("tests/dots/simple.dot")
+        Simulator(w, g)
+        t = Town(9999, w.Family(0), world=w, capital=False, hold=0.5, pop=1000,
+                 soldiers=1, leader=1, drugs=0)
+        self.assertEqual(t.hold, 0.5)
+
+    def test_single_source_same_paths(self):
+        for fpath in ["tests/dots/simple.dot", "tests/dots/inevitable_family.dot",
+                      "tests/dots/low_trust_path.dot"]:
+            w,g = load_graph(fpath)
+            r1 = Routing(w, g, cache=False)
+            r2 = Routing(w, g, single_source=True)
+
+            for start in w.towns:
+                for t in w.towns_of_family(w.Town(start).family.id):
+                    self.assertEqual(
+                        r1.automatic_path(start, t.id, r1.safest_path_heuristic),
+                        r2.automatic_path(start, t.id, r2.safest_path_heuristic)
+                    )
+
+            self.assertEqual(len(r2.trees), len(w.towns))
+
+    def test_csr_backend_same_paths(self):
+        for fpath in ["tests/dots/simple.dot", "tests/dots/inevitable_family.dot",
+                      "tests/dots/low_trust_path.dot", "ndrangheta/example.dot"]:
+            w,g = load_graph(fpath)
+            r1 = Routing(w, g, cache=False)
+            r2 = Routing(w, g, cache=False, backend="csr")
+            r3 = Routing(w, g, single_source=True, backend="csr")
+
+            for start in w.towns:
+                for t in w.towns_of_family(w.Town(start).family.id):
+                    for h in ["safest_path_heuristic", "best_expected_path_heuristic",
+                              "most_reliable_path_heuristic"]:
+                        path = r1.automatic_path(start, t.id, getattr(r1, h))
+                        self.assertEqual(path, r2.automatic_path(start, t.id, getattr(r2, h)))
+                        self.assertEqual(path, r3.automatic_path(start, t.id, getattr(r3, h)))
+
+    def test_csr_weights_follow_changes(self):
+        for vectorized in (False, True):
+            w, g = load_graph("ndrangheta/example.dot", seed=1)
+            if vectorized:
+                w.attach_state()
+            r1 = Routing(w, g, cache=False)
+            r2 = Routing(w, g, cache=False, backend="csr")
+
+            def same_paths():
+                for fid in (0, 1):
+                    np.testing.assert_array_equal(r2.array_weights(fid, r2.safest_path_heuristic),
+                                                  r2.safest_path_weights(fid, *r2.csr.town_arrays(w)))
+                for t in w.towns_of_family(0):
+                    path = r1.automatic_path(w.Family(0).capital, t.id, r1.safest_path_heuristic)
+                    self.assertEqual(path, r2.automatic_path(w.Family(0).capital, t.id, r2.safest_path_heuristic))
+
+            same_paths()
+            weights = r2.array_weights(0, r2.safest_path_heuristic)
+            self.assertIs(r2.array_weights(0, r2.safest_path_heuristic), weights)
+
+            rng = random.Random(vectorized)
+            for _ in range(20):
+                t = w.Town(rng.choice(list(w.towns)))
+                if rng.random() < 0.2 and not t.is_capital:
+                    t.change_ownership(w.Family(rng.choice([0, 1])))
+                else:
+                    t.hold = rng.uniform(0.5, 1)
+                same_paths()
+
+    def test_most_reliable_path(self):
+        for fpath in ["tests/dots/inevitable_family.dot", "tests/dots/low_trust_path.dot",
+                      "ndrangheta/example.dot"]:
+            w,g = load_graph(fpath)
+            r = Routing(w, g)
+
+            for start in w.towns:
+                fid = w.Town(start).family.id
+                for t in w.towns_of_family(fid):
+                    path = r.automatic_path(start, t.id, r.most_reliable_path_heuristic)
+                    best = max(r.expected_multiplier_path(p, fid, None)
+                               for p in nx.all_simple_paths(g, start, t.id, cutoff=len(g)) ) if start != t.id else 1
+                    self.assertAlmostEqual(r.expected_multiplier_path(path, fid, None), best)
+
+    def test_alternative_paths(self):
+        w,g = load_graph("ndrangheta/example.dot")
+        r = Routing(w, g)
+        h = r.most_reliable_path_heuristic
+
+        # Only two loop-free paths from 7 to 4
+        paths = r.alternative_paths(7, 4, 3, h)
+        self.assertEqual(paths, [[7, 5, 3, 6, 4], [7, 5, 3, 2, 4]])
+        self.assertEqual(paths[0], r.automatic_path(7, 4, h))
+        self.assertEqual(r.alternative_paths(7, 4, 1, h), paths[:1])
+
+        mult = [r.expected_multiplier_path(p, 1, None) for p in paths]
+        self.assertEqual(mult, sorted(mult, reverse=True))
+
+        # Cached until a town on one of them changes
+        hits = r.cache.hits
+        self.assertEqual(r.alternative_paths(7, 4, 3, h), paths)
+        self.assertEqual(r.cache.hits, hits + 1)
+        w.Town(2).hold = 0.99
+        self.assertNotIn((1, 7, 4, h, 3), r.cache.alternatives)
+
+    def test_csr_adjacency(self):
+        w,g = load_graph("tests/dots/simple.dot")
+        csr = Routing(w, g, backend="csr").csr
+
+        for n1 in g.nodes():
+            for n2 in g.nodes():
+                self.assertEqual(csr.adjacent(n1, n2), n2 in g.adj[n1])
+
 # =========================================================== #
 
 class TestSafeShipmentGraph(unittest.TestCase):
@@ -111,3 +265,170 @@ class TestSafeShipmentGraph(unittest.TestCase):
         except ShipmentError:
             pass
         
+
+
+class Scripted(random.Random):
+    """
+    random() returns the numbers in `script` first.
+    """
+    script: List[float] = []
+
+    def random(self):
+        return self.script.pop(0) if self.script else super().random()
+
+
+class TestBatchShipments(unittest.TestCase):
+    def world(self, rng):
+        from ndrangheta.generate import generate_world
+
+        w, g = generate_world(400, n_families=4, seed=5, drugs=(0, 10))
+        w.rng = rng
+        r = Routing(w, g)
+
+        # Shortest paths, bouncing on an enemy town next to the destination
+        # if there is one. No destination is crossed by another shipment,
+        # whose draws would see its new hold.
+        batch, ends, crossed = list(), set(), set()
+        for f in w.families.values():
+            w.Town(f.capital).variate_drugs(1_000)
+            for t in w.towns_of_family(f.id)[1:]:
+                path = nx.shortest_path(g, f.capital, t.id)
+                enemies = [n for n in g.adj[t.id] if w.Town(n).family != f]
+                if enemies:
+                    path += [enemies[0], t.id]
+
+                through = set(path[1:]) - {t.id}
+                if t.id in crossed or t.id in ends or through & ends:
+                    continue
+                batch.append((f.capital, t.id, Shipment(2, 80_000, f.id), path))
+                ends.add(t.id)
+                crossed |= through
+        return w, r, batch
+
+    def outcome(self, w, r, batch, delivered):
+        return (
+            delivered,
+            [(ship.kgs, [(t.id, m) for t, m in ship.loss_history]) for _, _, ship, _ in batch],
+            [(t.hold, t.drugs) for t in w.towns.values()],
+            (r.shipped_kgs, r.delivered_kgs, r.captured_kgs),
+            {name: w.ledger.hops.column(name).tolist() for name in w.ledger.hops.columns},
+            {name: w.ledger.ships.column(name).tolist() for name in w.ledger.ships.columns},
+        )
+
+    def test_same_results_as_single_shipments(self):
+        w1, r1, batch1 = self.world(random.Random(1))
+        delivered1 = r1.send_shipments(batch1, rng=np.random.default_rng(0))
+
+        w2, r2, batch2 = self.world(Scripted(1))
+        draws = np.random.default_rng(0).random(sum(len(p) - 1 for _, _, _, p in batch2)).tolist()
+        delivered2 = list()
+        for start, end, ship, path in batch2:
+            w2.rng.script = draws[:len(path) - 1]
+            del draws[:len(path) - 1]
+            delivered2.append(r2.send_shipment_manual(start, end, ship, path))
+            w2.rng.script = []
+
+        self.assertGreater(len(batch1), 10)
+        self.assertIn(0, delivered1)
+        self.assertGreater(max(delivered1), 0)
+        self.assertIn(CAPTURED, w1.ledger.ships.column("outcome"))
+        self.assertEqual(self.outcome(w1, r1, batch1, delivered1), self.outcome(w2, r2, batch2, delivered2))
+        self.assertEqual(w1.metrics.hop_kg_lost.counts, w2.metrics.hop_kg_lost.counts)
+        self.assertAlmostEqual(w1.metrics.hop_kg_lost.sum, w2.metrics.hop_kg_lost.sum)
+
+    def test_not_adjacent(self):
+        w, r, batch = self.world(random.Random(1))
+        start, end, ship, path = max(batch, key=lambda b: len(b[3]))
+        with self.assertRaises(ShipmentError):
+            r.send_shipments([(start, end, ship, [start, end])])
+
+    def test_rejected_batch_changes_nothing(self):
+        w, r, batch = self.world(random.Random(1))
+        start, end, ship, path = max(batch, key=lambda b: len(b[3]))
+        state = lambda: ([t.drugs for t in w.towns.values()], r.shipped_kgs, len(w.ledger), w.metrics.values())
+        before = state()
+
+        # A good shipment, then one that can't be sent: not adjacent, or
+        # more drugs than are left after the first one
+        for bad in [(start, end, Shipment(1, 80_000, ship.from_family), [start, end]),
+                    (start, end, Shipment(w.Town(start).drugs, 80_000, ship.from_family), path)]:
+            with self.assertRaises(ShipmentError):
+                r.send_shipments([(start, end, ship, path), bad])
+            self.assertEqual(state(), before)
+
+
+class TestPathRisk(unittest.TestCase):
+    def test_matches_closed_form(self):
+        w, g = load_graph("tests/dots/inevitable_family.dot")
+        r = Routing(w, g)
+
+        for end in w.towns:
+            path = nx.shortest_path(g, 0, end)
+            towns = [w.Town(t) for t in path[1:]]
+            survive = np.prod([min(1, 2 * (1 - t.hold)) for t in towns if t.family.id != 0])
+
+            risk = r.path_risk(path, 0, samples=20_000, rng=np.random.default_rng(end))
+            self.assertAlmostEqual(risk.mean, r.expected_multiplier_path(path, 0, None), delta=0.02)
+            self.assertAlmostEqual(risk.capture_probability, 1 - survive, delta=0.02)
+
+            q = list(risk.quantiles.values())
+            self.assertEqual(q, sorted(q))
+            self.assertTrue(0 <= q[0] and q[-1] <= 1)
+
+    def test_ai_sized_on_quantile(self):
+        w1, g1 = load_graph("ndrangheta/example.dot", seed=2)
+        w2, g2 = load_graph("ndrangheta/example.dot", seed=2)
+        s1 = Simulator(w1, g1, player_id=None, seed=2)
+        s2 = Simulator(w2, g2, player_id=None, seed=2, ai_risk=0.1)
+
+        for s in (s1, s2):
+            s.advance_time(turns=5)
+        self.assertGreater(s1.router.shipped_kgs, 0)
+        self.assertGreater(s2.router.shipped_kgs, s1.router.shipped_kgs)
+
+    def test_ai_risk_with_negative_seed(self):
+        w, g = load_graph("ndrangheta/example.dot", seed=2)
+        s = Simulator(w, g, player_id=None, seed=-2, ai_risk=0.1)
+        s.advance_time(turns=3)
+        self.assertGreater(s.router.shipped_kgs, 0)
+
+
+class TestGraphSync(unittest.TestCase):
+    def assertSynced(self, s):
+        for tid, t in s.world.towns.items():
+            node = s.router.graph.nodes[tid]
+            self.assertEqual(node["family"], t.family.id)
+            self.assertEqual(node["hold"], t.hold)
+            self.assertEqual(node["drugs"], t.drugs)
+            self.assertEqual(node["is_capital"], t.is_capital)
+
+    def test_only_changed_towns_are_pushed(self):
+        w, g = load_graph("tests/dots/war-scenario-1.dot")
+        s = Simulator(w, g)
+        self.assertIsNone(w.dirty)
+
+        s.update_graph()
+        self.assertSynced(s)
+        self.assertEqual(w.dirty, dict())
+
+        w.Town(1).drugs = 3
+        s.declare_war(0, 0, 4)
+        self.assertEqual(w.dirty[1], {"drugs"})
+        self.assertIn("family", w.dirty[4])
+
+        s.update_graph()
+        self.assertSynced(s)
+        self.assertEqual(w.dirty, dict())
+
+    def test_vectorized_turns_are_tracked(self):
+        w, g = load_graph("tests/dots/simple.dot", seed=0)
+        s = Simulator(w, g, vectorized=True, seed=0)
+        for t in w.towns.values():
+            t.drugs = 1
+
+        s.update_graph()
+        s.advance_time(turns=3)
+        self.assertTrue(w.dirty)
+
+        s.update_graph()
+        self.assertSynced(s)
@@ -0,0 +1,46 @@
+import unittest
+
+from ndrangheta.graph import *
+from ndrangheta.generate import generate_world
+
+class TestGenerateWorld(unittest.TestCase):
+    def test_grid(self):
+        w, g = generate_world(100, n_families=4, seed=1, drugs=(0, 10))
+
+        self.assertEqual(len(w.towns), 100)
+        self.assertEqual(g.number_of_edges(), 2 * 10 * 9)
+        self.assertEqual(sorted(w.families), [0, 1, 2, 3])
+
+        for f in w.families.values():
+            self.assertEqual(w.Town(f.capital).family, f)
+            self.assertTrue(w.Town(f.capital).is_capital)
+
+        for t in w.towns.values():
+            self.assertEqual(g.nodes[t.id]["family"], t.family.id)
+            self.assertTrue(0.5 <= t.hold <= 1)
+            self.assertTrue(1000 <= t.population <= 100_000)
+
+    def test_same_seed_same_world(self):
+        w1, g1 = generate_world(200, n_families=3, topology="geometric", seed=7)
+        w2, g2 = generate_world(200, n_families=3, topology="geometric", seed=7)
+
+        self.assertEqual(sorted(g1.edges()), sorted(g2.edges()))
+        for tid, t in w1.towns.items():
+            self.assertEqual((t.family.id, t.hold), (w2.Town(tid).family.id, w2.Town(tid).hold))
+
+    def test_generated_world_plays(self):
+        for topology in ["grid", "geometric", "scale_free"]:
+            w, g = generate_world(300, n_families=5, topology=topology, capitals="random",
+                                  seed=3, drugs=(0, 5), vectorized=True)
+            sim = Simulator(w, g, player_id=None)
+            sim.advance_time(turns=3)
+            self.assertEqual(sim.turn, 3)
+
+    def test_geometric_world_is_connected(self):
+        for seed in range(3):
+            w, g = generate_world(900, n_families=6, topology="geometric", seed=seed)
+            self.assertTrue(nx.is_connected(g))
+
+            sim = Simulator(w, g, player_id=None, seed=seed)
+            sim.advance_time(turns=3)
+            self.assertEqual(sim.turn, 3)
@@ -0,0 +1,57 @@
+import unittest
+import subprocess
+import sys
+import json
+
+# Self time of the ndrangheta modules only (numpy and networkx excluded), in
+# microseconds; generous, since CI machines may be slow
+BUDGET = 250_000
+
+MODULES = "ndrangheta.graph, ndrangheta.batch, ndrangheta.snapshot, ndrangheta.generate, ndrangheta.render"
+
+SCRIPT = f"""
+import sys, json, locale
+before = locale.setlocale(locale.LC_ALL)
+import {MODULES}
+print(json.dumps({{
+    "heavy": sorted(m for m in sys.modules if m.split(".")[0] in ("matplotlib", "pydot")),
+    "locale": locale.setlocale(locale.LC_ALL) == before,
+}}))
+"""
+
+# Wall time of `import ndrangheta.graph` on top of numpy and networkx, which
+# it can't do without, in seconds
+WALL_BUDGET = 0.15
+
+WALL_SCRIPT = """
+import sys, time, json
+import numpy, networkx
+start = time.perf_counter()
+import ndrangheta.graph
+print(json.dumps({
+    "seconds": time.perf_counter() - start,
+    "pools": sorted(m for m in sys.modules if m.split(".")[0] in ("multiprocessing", "concurrent")),
+}))
+"""
+
+class TestImports(unittest.TestCase):
+    def test_import_is_lazy(self):
+        p = subprocess.run([sys.executable, "-X", "importtime", "-c", SCRIPT],
+                           capture_output=True, text=True, check=True)
+        result = json.loads(p.stdout)
+        self.assertEqual(result["heavy"], [])
+        self.assertTrue(result["locale"])
+
+        self_time = 0
+        for line in p.stderr.splitlines():
+            fields = line.split("|")
+            if len(fields) == 3 and fields[2].strip().startswith("ndrangheta"):
+                self_time += int(fields[0].split(":")[1])
+        self.assertLess(self_time, BUDGET)
+
+    def test_graph_import_time(self):
+        p = subprocess.run([sys.executable, "-c", WALL_SCRIPT],
+                           capture_output=True, text=True, check=True)
+        result = json.loads(p.stdout)
+        self.assertEqual(result["pools"], [])
+        self.assertLess(result["seconds"], WALL_BUDGET)
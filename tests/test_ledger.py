@@ -0,0 +1,85 @@
+import unittest
+import os
+import tempfile
+
+import numpy as np
+
+from ndrangheta.graph import *
+from ndrangheta.generate import generate_world
+from ndrangheta.ledger import DELIVERED, CAPTURED, IN_TRANSIT
+from ndrangheta.snapshot import save_snapshot, load_snapshot
+
+class TestLedger(unittest.TestCase):
+    def setUp(self):
+        w, g = generate_world(200, 6, seed=3)
+        self.sim = Simulator(w, g, seed=3)
+        self.sim.advance_time(turns=12)
+        self.w, self.r = w, self.sim.router
+        self.ships = self.w.ledger.ships
+
+    def test_matches_router_totals(self):
+        ships = self.ships
+        outcome = ships.column("outcome")
+        self.assertGreater(len(ships), 0)
+        self.assertNotIn(IN_TRANSIT, outcome)
+        self.assertAlmostEqual(ships.column("kgs").sum(), self.r.shipped_kgs)
+        self.assertAlmostEqual(ships.column("final_kgs")[outcome == DELIVERED].sum(), self.r.delivered_kgs)
+
+    def test_losses_add_up(self):
+        ledger, ships = self.w.ledger, self.ships
+        lost = ships.column("kgs") - ships.column("final_kgs")
+        lost[ships.column("outcome") == CAPTURED] = ships.column("kgs")[ships.column("outcome") == CAPTURED]
+
+        self.assertAlmostEqual(sum(ledger.loss_per_town().values()), lost.sum())
+        self.assertAlmostEqual(sum(ledger.kg_lost_per_turn().values()), lost.sum())
+        self.assertLessEqual(max(ledger.kg_lost_per_turn()), self.w.scheduler.now)
+
+    def test_capture_rate(self):
+        rates = self.w.ledger.capture_rate_per_family()
+        self.assertEqual(set(rates), set(self.ships.column("family").tolist()))
+        for rate in rates.values():
+            self.assertTrue(0 <= rate <= 1)
+
+    def test_history(self):
+        ledger = self.w.ledger
+        ship_id = int(np.argmax(self.ships.column("hops")))
+        history = ledger.history(ship_id)
+        self.assertEqual(len(history), self.ships.column("hops")[ship_id])
+
+        kgs = self.ships.column("kgs")[ship_id]
+        for _, m in history:
+            kgs *= m
+        self.assertAlmostEqual(kgs, self.ships.column("final_kgs")[ship_id])
+
+    def test_hops_in_transit(self):
+        ledger = self.w.ledger
+        f = next(iter(self.w.families.values()))
+        ship = Shipment(2, 80_000, f.id)
+        ledger.open(ship, f.capital, f.capital)
+        hops = len(ledger.hops)
+        for t in self.w.towns_of_family(f.id)[:3]:
+            ship.displace(0.5, t)
+
+        self.assertEqual(len(ledger.hops), hops)
+        self.assertEqual([m for _, m in ship.loss_history], [0.5] * 3)
+
+        ledger.close(ship, DELIVERED, f.capital)
+        self.assertEqual(len(ledger.hops), hops + 3)
+        self.assertEqual(self.ships.column("first_hop")[ship.id], hops)
+        self.assertEqual(ledger.history(ship.id), [(t.id, 0.5) for t in self.w.towns_of_family(f.id)[:3]])
+
+    def test_snapshot(self):
+        fd, path = tempfile.mkstemp(suffix=".snap")
+        os.close(fd)
+        try:
+            save_snapshot(self.sim, path)
+            loaded = load_snapshot(path).world.ledger
+        finally:
+            os.remove(path)
+
+        ledger = self.w.ledger
+        for mine, theirs in ((ledger.ships, loaded.ships), (ledger.hops, loaded.hops)):
+            self.assertEqual(len(mine), len(theirs))
+            for name in mine.columns:
+                np.testing.assert_array_equal(mine.column(name), theirs.column(name))
+        self.assertEqual(ledger.loss_per_town(), loaded.loss_per_town())
@@ -0,0 +1,49 @@
+import unittest
+import gc
+import random
+import weakref
+import tracemalloc
+
+from ndrangheta.graph import *
+from ndrangheta.read_dot import load_graph
+
+# Bytes per town (Town, LocalFamily, tax task, world indexes), half of what
+# __dict__ entities with a Schedule per town took
+BUDGET = 450
+
+class TestMemory(unittest.TestCase):
+    def test_bytes_per_town(self):
+        n = 100_000
+        rng = random.Random(0)
+        w = World(rng=random.Random(0))
+        fam = Family(0, "f", {"money": 0}, w)
+        w.add_family(fam)
+        args = [dict(capital=False, hold=rng.uniform(0.5, 1), pop=rng.randint(1, 100) * 1000,
+                     soldiers=1, leader=1, drugs=rng.uniform(0, 10)) for _ in range(n)]
+        ids = list(range(n))
+
+        gc.collect()
+        tracemalloc.start()
+        try:
+            for tid, kwargs in zip(ids, args):
+                w.add_town(Town(tid, fam, world=w, **kwargs))
+            size, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertLess(size / n, BUDGET)
+
+    def test_no_instance_dicts(self):
+        w, g = load_graph("ndrangheta/example.dot")
+        t = w.Town(0)
+        for obj in (t, t.local_family, t.family, Shipment(1, 80_000, 0), Request(1, 0)):
+            self.assertFalse(hasattr(obj, "__dict__"), type(obj))
+
+    def test_worlds_are_released(self):
+        w, g = load_graph("ndrangheta/example.dot")
+        Simulator(w, g).advance_time(turns=2)
+        ref = weakref.ref(w)
+
+        del w, g
+        gc.collect()
+        self.assertIsNone(ref())
@@ -0,0 +1,80 @@
+import unittest
+import os
+import tempfile
+
+import numpy as np
+
+from ndrangheta.graph import *
+from ndrangheta.read_dot import load_graph
+from ndrangheta.metrics import Registry
+
+def parse(text):
+    return {line.rsplit(" ", 1)[0]: float(line.rsplit(" ", 1)[1])
+            for line in text.splitlines() if not line.startswith("#")}
+
+class TestRegistry(unittest.TestCase):
+    def test_histogram(self):
+        r = Registry()
+        h1 = r.histogram("one", "one at a time", (1, 2, 5))
+        h2 = r.histogram("many", "all at once", (1, 2, 5))
+        values = [0.5, 1, 1.5, 2, 7, 3]
+        for v in values:
+            h1.observe(v)
+        h2.observe_many(np.array(values))
+
+        self.assertEqual(h1.counts, [2, 2, 1, 1])
+        self.assertEqual(h1.counts, h2.counts)
+        samples = parse(r.exposition())
+        self.assertEqual(samples['one_bucket{le="2"}'], 4)
+        self.assertEqual(samples['one_bucket{le="+Inf"}'], 6)
+        self.assertEqual(samples["one_count"], 6)
+        self.assertEqual(samples["one_sum"], sum(values))
+
+    def test_exposition(self):
+        r = Registry()
+        r.counter("things_total", "Things").inc(3)
+        r.gauge("level", "Level").set(0.25)
+        self.assertEqual(r.exposition(), "\n".join([
+            "# HELP things_total Things", "# TYPE things_total counter", "things_total 3",
+            "# HELP level Level", "# TYPE level gauge", "level 0.25",
+        ]) + "\n")
+        with self.assertRaises(ValueError):
+            r.counter("level", "Again")
+
+
+class TestSimulationMetrics(unittest.TestCase):
+    def test_game(self):
+        fd, path = tempfile.mkstemp(suffix=".prom")
+        os.close(fd)
+        try:
+            w, g = load_graph("ndrangheta/example.dot", seed=1)
+            sim = Simulator(w, g, player_id=None, seed=1, metrics_path=path)
+            sim.advance_time(turns=9)
+            with open(path) as f:
+                samples = parse(f.read())
+        finally:
+            os.remove(path)
+
+        r = sim.router
+        self.assertEqual(samples["ndrangheta_turn"], 9)
+        self.assertEqual(samples["ndrangheta_turn_seconds_count"], 9)
+        self.assertEqual(samples["ndrangheta_shipments_sent_total"], len(w.ledger))
+        self.assertEqual(samples["ndrangheta_shipments_sent_total"],
+                         samples["ndrangheta_shipments_delivered_total"] + samples["ndrangheta_shipments_captured_total"])
+        self.assertAlmostEqual(samples["ndrangheta_kg_sent_total"], r.shipped_kgs)
+        self.assertAlmostEqual(samples["ndrangheta_kg_delivered_total"], r.delivered_kgs)
+        self.assertEqual(samples["ndrangheta_hop_kg_lost_count"], len(w.ledger.hops))
+        self.assertAlmostEqual(samples["ndrangheta_hop_kg_lost_sum"], w.ledger.hops.column("lost").sum())
+        self.assertGreater(samples["ndrangheta_dijkstra_total"], 0)
+        self.assertGreater(samples["ndrangheta_narcos_spend_total"], 0)
+        self.assertGreater(samples["ndrangheta_taxes_collected_total"], 0)
+
+    def test_wars(self):
+        w, g = load_graph("tests/dots/war-scenario-1.dot")
+        s = Simulator(w, g)
+        s.declare_war(0, 0, 4)
+        s.declare_war(0, 0, 6)
+
+        m = w.metrics
+        self.assertEqual((m.wars_won.value, m.wars_lost.value), (1, 1))
+        self.assertEqual(m.towns_changed.value, 1)
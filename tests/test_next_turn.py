@@ -1,5 +1,7 @@
 import unittest
+import os
 import random
+import tempfile
 
 from ndrangheta.graph import *
 from ndrangheta.entities import *
@@ -72,7 +74,7 @@ class TestRequestsFromLocalFamilies(unittest.TestCase):
 
     def test_call_off_request_if_somehow_local_family_get_hold_of_drugs(self):
         town = self.w.Town(0)
-        town.money = 0
+        town.local_family.money = 0
         town.drugs = 0
 
         self.s.advance_time()
@@ -99,3 +101,73 @@ class TestNextStep(unittest.TestCase):
         self.s.advance_time()
 
     
+
+
+class TestReplay(unittest.TestCase):
+    def play(self, seed):
+        w, g = load_graph("ndrangheta/example.dot", seed=seed)
+        return Simulator(w, g, seed=seed)
+
+    def assertSameGame(self, s1, s2):
+        for tid, t1 in s1.world.towns.items():
+            t2 = s2.world.Town(tid)
+            self.assertEqual(t1.family.id, t2.family.id)
+            self.assertEqual(t1.hold, t2.hold)
+            self.assertEqual(t1.drugs, t2.drugs)
+            self.assertEqual(t1.local_family.money, t2.local_family.money)
+        for fid, f1 in s1.world.families.items():
+            self.assertEqual(f1.money, s2.world.Family(fid).money)
+            self.assertEqual(f1.drugs, s2.world.Family(fid).drugs)
+
+    def test_seed_does_not_depend_on_global_random(self):
+        random.seed(1)
+        s1 = self.play(5)
+        s1.advance_time(turns=20)
+
+        random.seed(2)
+        s2 = self.play(5)
+        s2.advance_time(turns=20)
+
+        self.assertSameGame(s1, s2)
+
+    def test_replay_journal(self):
+        s1 = self.play(3)
+        s1.advance_time(turns=2)
+        s1.order_drugs(0, 2)
+        s1.change_tax(0, 1, 0.3)
+        s1.advance_time()
+        s1.schedule_shipment(0, 2, 0, 1)
+        s1.advance_time(turns=10)
+
+        # Commands run by the AI and by scheduled tasks are not recorded
+        self.assertEqual(
+            [c.name for c in s1.journal],
+            ["advance_time", "order_drugs", "change_tax", "advance_time",
+             "schedule_shipment", "advance_time"]
+        )
+
+        with tempfile.TemporaryDirectory() as tmp:
+            fpath = os.path.join(tmp, "journal.json")
+            save_journal(fpath, s1.journal, s1.seed)
+            seed, journal = load_journal(fpath)
+
+        s2 = self.play(seed)
+        s2.replay(journal)
+
+        self.assertEqual(s2.turn, s1.turn)
+        self.assertEqual(s2.journal, s1.journal)
+        self.assertSameGame(s1, s2)
+
+    def test_replay_drug_purchases(self):
+        s1 = self.play(3)
+        s1.advance_time()
+        s1.order_drugs(0, 2)
+        s1.buy_drugs_now(0, 1)
+        s1.advance_time(turns=3)
+
+        self.assertEqual([c.name for c in s1.journal],
+                         ["advance_time", "order_drugs", "buy_drugs_now", "advance_time"])
+
+        s2 = self.play(3)
+        s2.replay(s1.journal)
+        self.assertSameGame(s1, s2)
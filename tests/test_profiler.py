@@ -0,0 +1,57 @@
+import unittest
+import json
+
+from ndrangheta.graph import *
+from ndrangheta.read_dot import load_graph
+from ndrangheta.profiler import NO_PROFILER
+
+class TestProfiler(unittest.TestCase):
+    def play(self, **options):
+        w, g = load_graph("ndrangheta/example.dot", seed=1)
+        sim = Simulator(w, g, player_id=None, seed=1, **options)
+        sim.advance_time(turns=5)
+        return sim
+
+    def test_phases(self):
+        prof = self.play(profile=True).profiler
+        summary = prof.summary()
+        for phase in ("turn", "towns", "local_tasks", "family", "requests", "commit",
+                      "dijkstra", "narcos", "transit"):
+            self.assertIn((phase,), summary)
+        self.assertEqual(summary[("turn",)]["calls"], 5)
+        self.assertIn("transit", prof.summary_table())
+
+        turns = {turn: (start, end) for phase, _, turn, _, start, end in prof.spans if phase == "turn"}
+        self.assertEqual(sorted(turns), [1, 2, 3, 4, 5])
+        for phase, family, turn, _, start, end in prof.spans:
+            if phase == "family":
+                self.assertIsNotNone(family)
+                self.assertTrue(turns[turn][0] <= start <= end <= turns[turn][1])
+
+        by_family = prof.summary(by=("phase", "family"))
+        self.assertEqual(sum(s["calls"] for (phase, _), s in by_family.items() if phase == "family"),
+                         summary[("family",)]["calls"])
+
+    def test_chrome_trace(self):
+        prof = self.play(profile=True, ai_workers=2).profiler
+        trace = json.loads(json.dumps(prof.chrome_trace()))
+        complete = [e for e in trace["traceEvents"] if e["ph"] == "X"]
+        threads  = [e for e in trace["traceEvents"] if e["ph"] == "M"]
+
+        self.assertEqual(len(complete), len(prof.spans))
+        self.assertIn("plan", {e["name"] for e in complete})
+        self.assertGreater(len(threads), 1)
+        for e in complete:
+            self.assertGreaterEqual(e["ts"], 0)
+            self.assertGreaterEqual(e["dur"], 0)
+
+    def test_disabled(self):
+        sim = self.play()
+        self.assertIs(sim.profiler, NO_PROFILER)
+        self.assertEqual(NO_PROFILER.spans, [])
+        self.assertIs(NO_PROFILER.span("turn"), NO_PROFILER.span("war", 1))
+
+    def test_same_game(self):
+        on, off = self.play(profile=True), self.play()
+        self.assertEqual([(f.money, f.drugs) for f in on.world.families.values()],
+                         [(f.money, f.drugs) for f in off.world.families.values()])
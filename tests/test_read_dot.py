@@ -66,3 +66,47 @@ class TestSafePathGraph(unittest.TestCase):
         
 
         
+
+class TestStreamingReader(unittest.TestCase):
+    def test_same_as_pydot_reader(self):
+        import glob
+        import random
+        from ndrangheta.read_dot import load_graph_pydot
+
+        for fpath in glob.glob("tests/dots/*.dot") + ["ndrangheta/example.dot"]:
+            random.seed(0)
+            w1, g1 = load_graph_pydot(fpath)
+            random.seed(0)
+            w2, g2 = load_graph(fpath)
+
+            self.assertEqual(list(g1.nodes(data=True)), list(g2.nodes(data=True)))
+            self.assertEqual({n: list(g1.adj[n]) for n in g1}, {n: list(g2.adj[n]) for n in g2})
+            self.assertEqual(list(w1.families), list(w2.families))
+
+            for fid, f in w1.families.items():
+                self.assertEqual((f.money, f.capital), (w2.Family(fid).money, w2.Family(fid).capital))
+            for tid, t in w1.towns.items():
+                self.assertEqual((t.family.id, t.hold, t.population),
+                                 (w2.Town(tid).family.id, w2.Town(tid).hold, w2.Town(tid).population))
+
+    def test_syntax(self):
+        from ndrangheta.read_dot import parse_dot
+
+        nodes, edges = parse_dot("""
+        /* a comment
+           on two lines */
+        strict graph "map" {
+          node [shape=box]; rankdir=LR
+          0 -- 1 -> {2; 3} [color=red]  # another comment
+          2 [label=<2<br/><i>x</i>>, family=1 hold=0.5]
+          3 [label="multi
+        line", family=-1]
+          2 [capital=t]
+        }
+        """.splitlines(keepends=True))
+
+        self.assertEqual(list(nodes), ["2", "3", "0", "1"])
+        self.assertEqual(nodes["2"], {"label": "<2<br/><i>x</i>>", "family": "1",
+                                      "hold": "0.5", "capital": "t"})
+        self.assertEqual(nodes["3"]["family"], "-1")
+        self.assertEqual(edges, [("0", "1"), ("1", "2"), ("1", "3")])
@@ -0,0 +1,73 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import networkx as nx
+
+from ndrangheta.graph import *
+from ndrangheta.read_dot import load_graph
+from ndrangheta.csr import CSRGraph
+from ndrangheta.render import Renderer, load_layout, layout_cache_path, bfs_distances, pivot_mds
+from ndrangheta.batch import run_batch
+
+class TestRenderer(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.map = os.path.join(self.tmp.name, "example.dot")
+        shutil.copy("ndrangheta/example.dot", self.map)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_layout_is_cached_next_to_the_map(self):
+        w, g = load_graph(self.map)
+        cache = layout_cache_path(self.map)
+
+        pos = load_layout(g, cache, seed=1)
+        self.assertTrue(os.path.exists(cache))
+        np.testing.assert_array_equal(pos, load_layout(g, cache, seed=2))
+
+        # Another topology doesn't use it
+        g.add_edge(0, 8)
+        self.assertFalse(np.array_equal(pos, load_layout(g, cache, seed=2)))
+
+    def test_frames(self):
+        w, g = load_graph(self.map, seed=3)
+        s = Simulator(w, g, seed=3, player_id=None)
+        r = s.renderer(map_path=self.map)
+
+        s.advance_time()
+        self.assertTrue(r.sent) # AI shipments of the turn
+        for ext in ("png", "svg"):
+            fpath = os.path.join(self.tmp.name, f"turn.{ext}")
+            r.frame(fpath)
+            self.assertGreater(os.path.getsize(fpath), 0)
+        self.assertEqual(r.sent, [])
+
+        # Colours follow the owners
+        w.Town(4).change_ownership(w.Family(0))
+        r.update()
+        i, j = r.csr.index[4], r.csr.index[0]
+        np.testing.assert_array_equal(r.nodes.get_facecolors()[i], r.nodes.get_facecolors()[j])
+
+    def test_batch_frames(self):
+        frames = os.path.join(self.tmp.name, "frames")
+        summary, = run_batch(self.map, 3, [0], jobs=1, frames=frames)
+        self.assertNotIn("error", summary)
+        self.assertEqual(sorted(os.listdir(os.path.join(frames, "seed-0"))),
+                         ["turn-00001.png", "turn-00002.png", "turn-00003.png"])
+
+    def test_big_map_layout(self):
+        g = nx.grid_2d_graph(30, 30)
+        g = nx.convert_node_labels_to_integers(g)
+        csr = CSRGraph(g)
+
+        lengths = nx.single_source_shortest_path_length(g, 0)
+        dist = bfs_distances(csr, 0)
+        self.assertEqual({n: dist[csr.index[n]] for n in g}, lengths)
+
+        pos = pivot_mds(csr)
+        self.assertEqual(pos.shape, (900, 2))
+        self.assertEqual(len(np.unique(np.round(pos, 6), axis=0)), 900)
@@ -0,0 +1,84 @@
+import unittest
+import os
+import tempfile
+
+from ndrangheta.graph import *
+from ndrangheta.read_dot import load_graph
+from ndrangheta.snapshot import save_snapshot, load_snapshot, SnapshotError
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.fpath = os.path.join(self.tmp.name, "game.snap")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def assertSameGame(self, s1, s2):
+        w1, w2 = s1.world, s2.world
+        self.assertEqual(s1.turn, s2.turn)
+        self.assertEqual(list(w1.towns), list(w2.towns))
+        self.assertEqual(w1.family_towns, w2.family_towns)
+
+        for tid, t1 in w1.towns.items():
+            t2 = w2.Town(tid)
+            self.assertEqual(t1.family.id, t2.family.id)
+            self.assertEqual(t1.is_capital, t2.is_capital)
+            for name in ("hold", "drugs", "population"):
+                self.assertAlmostEqual(getattr(t1, name), getattr(t2, name))
+            for name in ("money", "tax", "soldiers", "leader", "drug_cost_per_kg"):
+                self.assertAlmostEqual(getattr(t1.local_family, name), getattr(t2.local_family, name))
+
+        self.assertEqual(list(w1.families), list(w2.families))
+        for fid, f1 in w1.families.items():
+            f2 = w2.Family(fid)
+            self.assertAlmostEqual(f1.money, f2.money)
+            self.assertAlmostEqual(f1.drugs, f2.drugs)
+            self.assertEqual(f1.capital, f2.capital)
+
+    def resume(self, vectorized, mmap=True):
+        w, g = load_graph("ndrangheta/example.dot", seed=7)
+        s1 = Simulator(w, g, vectorized=vectorized, seed=7)
+        s1.advance_time(turns=5)
+
+        # Pending tasks of the player, due after the snapshot
+        s1.order_drugs(0, 1)
+        ship = Shipment(0.5, 80_000, 0)
+        s1.schedule(Schedule(s1.send_shipment, In(turn=2), 2, 0, ship), 0)
+
+        save_snapshot(s1, self.fpath)
+        s2 = load_snapshot(self.fpath, mmap=mmap)
+
+        self.assertSameGame(s1, s2)
+        self.assertEqual(len(s1.world.scheduler), len(s2.world.scheduler))
+        self.assertEqual(list(g.adj[1]), list(s2.router.graph.adj[1]))
+        self.assertEqual(s1.journal, s2.journal)
+
+        # Both go on with the same random draws
+        for s in (s1, s2):
+            s.advance_time(turns=12)
+        self.assertSameGame(s1, s2)
+        return s2
+
+    def test_resume(self):
+        self.resume(vectorized=False)
+
+    def test_resume_vectorized(self):
+        s = self.resume(vectorized=True)
+        self.assertIsNotNone(s.world.state)
+
+    def test_resume_without_mmap(self):
+        self.resume(vectorized=True, mmap=False)
+
+    def test_overwrite_loaded_snapshot(self):
+        w, g = load_graph("ndrangheta/example.dot")
+        save_snapshot(Simulator(w, g, vectorized=True), self.fpath)
+
+        s = load_snapshot(self.fpath)
+        s.advance_time(turns=3)
+        save_snapshot(s, self.fpath)
+        self.assertEqual(load_snapshot(self.fpath).turn, 3)
+
+    def test_not_a_snapshot(self):
+        with self.assertRaises(SnapshotError):
+            load_snapshot("ndrangheta/example.dot")
@@ -98,3 +98,52 @@ class TestRequestsFromLocalFamilies(unittest.TestCase):
         self.assertGreater(mult_3, mult_4)
         self.assertAlmostEqual(mult_4, 1000/2, delta=50)
         
+
+class TestScheduler(unittest.TestCase):
+    def test_in_and_every(self):
+        s, ran = Scheduler(), list()
+
+        s.schedule(Schedule(ran.append, In(turn=2), "in"))
+        s.schedule(Schedule(ran.append, Every(turn=3, countdown=1), "every"))
+
+        for turn in range(1, 8):
+            for _, task in s.advance():
+                task()
+            ran.append(turn)
+
+        self.assertEqual(
+            ran,
+            ["every", 1, "in", 2, 3, "every", 4, 5, 6, "every", 7]
+        )
+        self.assertEqual(len(s), 1)
+
+    def test_player_operations_run_next_turn(self):
+        w, g = load_graph("tests/dots/two_nodes.dot")
+        sim = Simulator(w, g)
+
+        sim.order_drugs(0, 5)
+        self.assertEqual(w.Town(0).drugs, 100)
+
+        sim.advance_time()
+        self.assertGreater(w.Town(0).drugs, 100)
+
+class TestHeadless(unittest.TestCase):
+    def tearDown(self):
+        headless()
+
+    def run_game(self):
+        w, g = load_graph("tests/dots/two_nodes.dot")
+        Simulator(w, g).send_shipment(0, 1, Shipment(2, 90_000, 0))
+
+    def test_console_and_headless(self):
+        import io
+        out = io.StringIO()
+
+        console(stream=out)
+        self.run_game()
+        self.assertIn("SHIPMENT: 0 to 1", out.getvalue())
+
+        headless()
+        out.truncate(0)
+        self.run_game()
+        self.assertEqual(out.getvalue(), "")
@@ -1,9 +1,12 @@
 import unittest
 import random
+import os
+import tempfile
 
 from ndrangheta.graph import *
 from ndrangheta.entities import *
 from ndrangheta.read_dot import load_graph
+from ndrangheta.snapshot import save_snapshot, load_snapshot
 
 class TestRequestsFromLocalFamilies(unittest.TestCase):
     def setUp(self):
@@ -70,3 +73,91 @@ class TestRequestsFromLocalFamilies(unittest.TestCase):
         self.assertTrue(
             all(x > 0 for x in c.values())
         )
+
+    def test_family_index_after_capital_falls(self):
+        self.s.declare_war(0, 0, 7)
+
+        for fid in self.w.families:
+            self.assertEqual(
+                {t.id for t in self.w.towns_of_family(fid)},
+                {t.id for t in self.w.towns.values() if t.family.id == fid}
+            )
+
+        # Every orphan town gets its own family
+        self.assertNotIn(1, self.w.family_towns)
+        self.assertEqual(len(self.w.families), 1 + 6)
+
+
+class TestWarPhase(unittest.TestCase):
+    def setUp(self):
+        self.w, self.g = load_graph("tests/dots/war-scenario-2.dot", seed=1)
+        self.s = Simulator(self.w, self.g, seed=1)
+
+    def owners(self):
+        return {t.id: (t.family.id, t.is_capital, t.local_family.soldiers) for t in self.w.towns.values()}
+
+    def test_batch(self):
+        # 0 and 2 both attack town 2: the strongest (0) first, then 2 takes
+        # it back from 0. Capital 3 falls, so 1 no longer owns town 2 and
+        # its attack from there is dropped
+        outcome = self.s.resolve_wars([Attack(2, 1, 2), Attack(0, 0, 2), Attack(0, 0, 3), Attack(1, 2, 4)])
+
+        self.assertEqual(outcome, [True, True, True, None])
+        self.assertEqual(self.w.Town(2).family.id, 2)
+        self.assertEqual(self.w.Town(3).family.id, 0)
+        self.assertNotIn(1, self.w.families)
+        self.assertEqual(self.w.Family(3).capital, 5)
+        self.assertTrue(self.w.Town(5).is_capital)
+
+    def test_same_result_in_any_order(self):
+        attacks = [Attack(2, 1, 2), Attack(0, 0, 2), Attack(0, 0, 3), Attack(1, 2, 4)]
+        self.s.resolve_wars(attacks)
+        expected = self.owners()
+
+        self.setUp()
+        self.s.resolve_wars(attacks[::-1])
+        self.assertEqual(self.owners(), expected)
+
+    def test_dissolution(self):
+        families = self.s.dissolve_family(self.w.Town(3))
+
+        # The fallen capital is left to its conqueror
+        self.assertEqual([f.capital for f in families], [2, 5])
+        self.assertEqual(self.w.family_towns[1], {3})
+        self.assertNotIn(1, self.w.families)
+        for f in families:
+            self.assertEqual([t.id for t in self.w.towns_of_family(f.id)], [f.capital])
+
+    def test_fought_next_turn(self):
+        self.s.declare_war_schedule(0, 0, 3)
+        self.assertEqual(self.w.Town(3).family.id, 1)
+
+        fd, path = tempfile.mkstemp(suffix=".snap")
+        os.close(fd)
+        try:
+            save_snapshot(self.s, path)
+            resumed = load_snapshot(path)
+        finally:
+            os.remove(path)
+
+        for sim in (self.s, resumed):
+            sim.advance_time()
+            self.assertEqual(sim.world.Town(3).family.id, 0)
+            self.assertNotIn(1, sim.world.families)
+            self.assertEqual(sim.attacks, [])
+
+    def test_paid_drugs_reach_the_conqueror(self):
+        def town_3_drugs(order: bool) -> float:
+            self.setUp()
+            self.w.Family(1).money = 10**9
+            self.s.buy_drugs_now(1, 2)
+            if order:
+                self.s.order_drugs(1, 5)
+                self.s.schedule_shipment(1, 3, 5, 1)
+            self.s.declare_war_schedule(0, 0, 3)
+            self.s.advance_time()
+            self.assertEqual(self.w.Town(3).family.id, 0)
+            self.assertEqual([t for _, owner, t in self.w.scheduler if isinstance(owner, Family)], [])
+            return self.w.Town(3).drugs
+
+        self.assertAlmostEqual(town_3_drugs(True), town_3_drugs(False) + 5)